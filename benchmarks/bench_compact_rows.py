@@ -0,0 +1,122 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Benchmark of the compact rows on a Zeek conn.log - peak memory of one read
+# batch and the _bulk body encoding, dict rows against compact rows.
+# Without a file a synthetic conn.log is written.
+# Usage: python3 benchmarks/bench_compact_rows.py [conn.log] [--rows=100000]
+# Dependency: time, tracemalloc, tempfile
+
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.json_codec import BACKENDS
+from modules.json_codec import set_codec
+from modules.json_load import serialize_document
+from modules.reader_plan import PlanCache
+from modules.stream_reader import read_records
+from modules.json_convert import get_line_parser
+from modules.forwarder_arg import get_arguments
+from modules.forwarder_arg import get_option
+
+
+CONN_FIELDS = ("ts", "uid", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p", "proto",
+               "service", "duration", "orig_bytes", "resp_bytes", "conn_state", "local_orig",
+               "local_resp", "missed_bytes", "history", "orig_pkts", "orig_ip_bytes",
+               "resp_pkts", "resp_ip_bytes", "tunnel_parents")
+CONN_TYPES = ("time", "string", "addr", "port", "addr", "port", "enum", "string", "interval",
+              "count", "count", "string", "bool", "bool", "count", "string", "count", "count",
+              "count", "count", "set[string]")
+
+
+def write_conn_log(filepath, rows):
+    """
+        synthetic Zeek conn.log
+    """
+    rand = random.Random(7)
+    with open(filepath, 'w') as file:
+        file.write("#separator \\x09\n#set_separator\t,\n#empty_field\t(empty)\n"
+                   "#unset_field\t-\n#path\tconn\n")
+        file.write("#fields\t" + "\t".join(CONN_FIELDS) + "\n")
+        file.write("#types\t" + "\t".join(CONN_TYPES) + "\n")
+        for idx in range(rows):
+            file.write(f"{1514764800 + idx / 100:.6f}\tC{rand.getrandbits(64):x}\t"
+                       f"10.0.{idx % 256}.{rand.randint(1, 254)}\t{rand.randint(1024, 65535)}\t"
+                       f"192.168.1.{rand.randint(1, 254)}\t{rand.choice((53, 80, 443))}\ttcp\t"
+                       f"{rand.choice(('ssl', 'http', '-'))}\t{rand.random():.6f}\t"
+                       f"{rand.randint(0, 9000)}\t{rand.randint(0, 90000)}\tSF\t-\t-\t0\t"
+                       f"ShADadFf\t{rand.randint(1, 90)}\t{rand.randint(40, 9000)}\t"
+                       f"{rand.randint(1, 90)}\t{rand.randint(40, 90000)}\t(empty)\n")
+
+
+def read_batch(filepath, compact, traced=False):
+    """
+        all rows as one batch, the read time and the peak of the traced memory (bytes)
+    """
+    plan = PlanCache(compact=compact).get(filepath)
+    parse_line, views = get_line_parser(plan)
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    data, _ = read_records(filepath, 0, parse_line, os.path.getsize(filepath) + 1, 
+                           sys.maxsize, True, views)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if traced:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return data, elapsed, peak
+
+
+def main():
+    filepaths = get_arguments()[1:]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not filepaths:
+            filepaths = [os.path.join(temp_dir, "conn.log")]
+            write_conn_log(filepaths[0], int(get_option("rows", 100000)))
+        print(f"{'rows':8} {'rows':>8} {'peak MB':>9} {'read s':>8} {'backend':8} "
+              f"{'encode MB/s':>12}")
+        for compact in (False, True):
+            _, _, peak = read_batch(filepaths[0], compact, True)
+            data, read, _ = read_batch(filepaths[0], compact)
+            for backend in BACKENDS:
+                try:
+                    set_codec(backend)
+                except ImportError:
+                    continue
+                start = time.perf_counter()
+                size = sum(len(serialize_document(document)) for document in data)
+                elapsed = time.perf_counter() - start
+                print(f"{'compact' if compact else 'dict':8} {len(data):8} {peak / 1e6:9.1f} "
+                      f"{read:8.2f} {backend:8} {size / elapsed / 1e6:12.1f}")
+            data = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Benchmark of the incremental CSV reader on netflow CSV exports - rows per
+# second with string and typed (auto) columns, read batch by batch like the
+# forwarder does. Without a file a synthetic netflow export is written.
+# Usage: python3 benchmarks/bench_csv_reader.py [netflow.csv ...] [--rows=500000] [--rounds=3]
+# Dependency: time, tempfile
+
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.csv_reader import read_csv_rows
+from modules.reader_plan import PlanCache
+from modules.forwarder_arg import get_arguments
+from modules.forwarder_arg import get_option
+
+
+NETFLOW_FIELDS = ("ts,te,td,sa,da,sp,dp,pr,flg,fwd,stos,ipkt,ibyt,opkt,obyt,"
+                  "in,out,sas,das,smk,dmk,dtos,dir,nh,nhb,svln,dvln,ismc,odmc,"
+                  "idmc,osmc,mpls1,cl,sl,al,ra,eng,exid,tr")
+
+
+def write_netflow(filepath, rows):
+    """
+        synthetic netflow export (nfdump CSV columns)
+    """
+    rand = random.Random(7)
+    with open(filepath, 'w', newline='') as file:
+        file.write(NETFLOW_FIELDS + "\r\n")
+        for idx in range(rows):
+            ts = 1514764800 + idx / 100
+            file.write(f"{ts:.3f},{ts + 1.5:.3f},1.500,10.0.{idx % 256}.{rand.randint(1, 254)},"
+                       f"192.168.{rand.randint(0, 255)}.{rand.randint(1, 254)},"
+                       f"{rand.randint(1024, 65535)},{rand.choice((53, 80, 443))},TCP,"
+                       f".AP.SF,0,0,{rand.randint(1, 90)},{rand.randint(40, 90000)},0,0,"
+                       f"0,0,0,0,0,0,0,0,0.0.0.0,0.0.0.0,0,0,00:00:00:00:00:00,"
+                       f"00:00:00:00:00:00,00:00:00:00:00:00,00:00:00:00:00:00,"
+                       f"0-0-0,0.000,0.000,0.000,127.0.0.1,0/0,1,\"2018-01-01 00:00:00\"\r\n")
+
+
+def measure(filepath, plan, rounds):
+    """
+        best time of the rounds in seconds and the rows
+    """
+    best, rows = None, 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        pointer, rows = plan.header_end, 0
+        while True:
+            data, next_pointer = read_csv_rows(filepath, pointer, plan)
+            if next_pointer == pointer:
+                break
+            rows += len(data)
+            pointer = next_pointer
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def main():
+    filepaths = get_arguments()[1:]
+    rounds = int(get_option("rounds", 3))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not filepaths:
+            filepaths = [os.path.join(temp_dir, "netflow.csv")]
+            write_netflow(filepaths[0], int(get_option("rows", 500000)))
+        print(f"{'file':24} {'columns':8} {'rows/s':>10} {'MB/s':>8}")
+        for filepath in filepaths:
+            size = os.path.getsize(filepath)
+            for csv_types in ("off", "auto"):
+                plan = PlanCache(csv_types=csv_types).get(filepath)
+                if not plan.complete:
+                    print(f"[ERROR] No CSV header in '{filepath}'")
+                    break
+                elapsed, rows = measure(filepath, plan, rounds)
+                print(f"{os.path.basename(filepath)[:24]:24} {csv_types:8} "
+                      f"{rows / elapsed:10.0f} {size / elapsed / 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
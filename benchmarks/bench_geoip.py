@@ -0,0 +1,99 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Benchmark of the GeoIP stage - address lookups per second on one core,
+# without and with the LRU cache, and records per second through the stage.
+# Without a database a synthetic GeoLite2-style ASN CSV is written.
+# Usage: python3 benchmarks/bench_geoip.py [GeoLite2-ASN.mmdb or blocks.csv] [--networks=400000]
+#        [--lookups=500000]
+# Dependency: time, tempfile
+
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.geoip import GeoIPStage
+from modules.geoip import open_database
+from modules.forwarder_arg import get_arguments
+from modules.forwarder_arg import get_option
+
+
+def write_asn_csv(filepath, networks):
+    """
+        synthetic ASN blocks - one /24 per network, spread over the IPv4 space
+    """
+    rand = random.Random(7)
+    blocks = sorted(rand.sample(range(1 << 24), networks))
+    with open(filepath, 'w') as file:
+        file.write("network,autonomous_system_number,autonomous_system_organization\n")
+        for block in blocks:
+            file.write(f"{block >> 16}.{(block >> 8) & 255}.{block & 255}.0/24,"
+                       f"{block % 60000 + 1},AS{block % 60000 + 1}\n")
+
+
+def get_addresses(count, distinct=None):
+    """
+        random addresses, or addresses with repeats like a capture if distinct
+        is given - a few hosts are most of the traffic
+    """
+    rand = random.Random(11)
+    hosts = [f"{rand.randint(1, 223)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}."
+             f"{rand.randint(1, 254)}" for _ in range(distinct or count)]
+    if distinct is None:
+        return hosts
+    return [hosts[min(int(rand.paretovariate(0.5)) - 1, distinct - 1)] for _ in range(count)]
+
+
+def main():
+    filepaths = get_arguments()[1:]
+    count = int(get_option("lookups", 500000))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not filepaths:
+            filepaths = [os.path.join(temp_dir, "asn.csv")]
+            write_asn_csv(filepaths[0], int(get_option("networks", 400000)))
+        start = time.perf_counter()
+        database = open_database(filepaths[0])
+        print(f"[INFO] {filepaths[0]} loaded in {time.perf_counter() - start:.2f}s")
+        stage = GeoIPStage([database])
+        unique = get_addresses(count)
+        repeated = get_addresses(count, 100000)
+        for name, addresses, lookup in (("no cache", unique, stage.find),
+                                        ("LRU cache", repeated, stage.lookup)):
+            start = time.perf_counter()
+            found = sum(1 for address in addresses if lookup(address) is not None)
+            elapsed = time.perf_counter() - start
+            print(f"{name:10} {len(addresses) / elapsed:12.0f} lookups/s  ({found} found)")
+        records = [{"id.orig_h": repeated[idx], "id.resp_h": repeated[-idx]} 
+                   for idx in range(len(repeated))]
+        start = time.perf_counter()
+        stage.process("zeek_conn", records)
+        print(f"{'stage':10} {len(records) / (time.perf_counter() - start):12.0f} records/s "
+              f"(2 addresses each)")
+
+
+if __name__ == "__main__":
+    main()
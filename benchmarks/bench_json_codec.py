@@ -0,0 +1,103 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Benchmark of the JSON backends on NDJSON samples (Suricata eve.json,
+# Zeek JSON logs) - full decode, partial extract and encode per line.
+# Usage: python3 benchmarks/bench_json_codec.py [eve.json ...] [--rounds=5]
+# Dependency: time, [optional] orjson, [optional] simdjson
+
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.json_codec import BACKENDS
+from modules.json_codec import make_codec
+from modules.forwarder_arg import get_arguments
+from modules.forwarder_arg import get_option
+
+
+# keys used for routing - event type, time and the addresses
+ROUTING_KEYS = ("event_type", "timestamp", "ts", "src_ip", "dest_ip")
+SAMPLES = ("test/test2.ndjson",)
+
+
+def read_samples(filepaths):
+    """
+        JSON lines of the sample files
+
+    Args:
+        filepaths (_list_): _NDJSON files_
+
+    Returns:
+        _list_: _lines as bytes_
+    """
+    lines = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as file:
+            lines.extend(line.strip() for line in file if line.startswith(b'{'))
+    return lines
+
+
+def measure(func, lines, rounds):
+    """
+        best time of the rounds in seconds
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    filepaths = get_arguments()[1:] or [os.path.join(root, path) for path in SAMPLES]
+    rounds = int(get_option("rounds", 5))
+    lines = read_samples(filepaths)
+    if len(lines) == 0:
+        print("[ERROR] No JSON lines in the sample files")
+        return
+    size = sum(len(line) for line in lines)
+    print(f"[INFO] {len(lines)} lines, {size} bytes, best of {rounds} rounds")
+    print(f"{'backend':10} {'loads MB/s':>12} {'extract MB/s':>13} {'dumps MB/s':>12}")
+    for backend in BACKENDS:
+        try:
+            codec = make_codec(backend)
+        except ImportError:
+            print(f"{backend:10} not installed")
+            continue
+        documents = [codec.loads(line) for line in lines]
+        loads = measure(codec.loads, lines, rounds)
+        extract = measure(lambda line: codec.extract(line, ROUTING_KEYS), lines, rounds)
+        dumps = measure(codec.dumps, documents, rounds)
+        print(f"{backend:10} {size / loads / 1e6:12.1f} {size / extract / 1e6:13.1f} "
+              f"{size / dumps / 1e6:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
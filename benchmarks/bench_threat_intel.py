@@ -0,0 +1,112 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Benchmark of the threat intel stage - feed load time, records per second
+# through the stage, and the records per second while a reload builds the
+# next index in the background. A synthetic feed is written (IPs, CIDRs,
+# domains, URLs and hashes).
+# Usage: python3 benchmarks/bench_threat_intel.py [--indicators=1000000] [--records=200000]
+# Dependency: time, tempfile
+
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.threat_intel import ThreatIntelStage
+from modules.forwarder_arg import get_option
+
+
+def write_feed(filepath, indicators):
+    """
+        synthetic feed - a fifth of each indicator type
+    """
+    rand = random.Random(7)
+    with open(filepath, 'w') as file:
+        file.write("# synthetic IOC feed\n")
+        for idx in range(indicators):
+            kind = idx % 5
+            if kind == 0:
+                file.write(f"{rand.randint(1, 223)}.{rand.randint(0, 255)}."
+                           f"{rand.randint(0, 255)}.{rand.randint(1, 254)}\n")
+            elif kind == 1:
+                file.write(f"{rand.randint(1, 223)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.0/24\n")
+            elif kind == 2:
+                file.write(f"d{idx}.example{idx % 1000}.com\n")
+            elif kind == 3:
+                file.write(f"http://u{idx}.example.net/payload/{idx}\n")
+            else:
+                file.write(f"{rand.getrandbits(256):064x}\n")
+
+
+def get_records(count):
+    """
+        conn, dns and http records - mostly misses like real traffic
+    """
+    rand = random.Random(11)
+    records = []
+    for idx in range(count):
+        address = f"{rand.randint(1, 223)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}." \
+                  f"{rand.randint(1, 254)}"
+        record = {"id.orig_h": f"10.0.{idx % 256}.{idx % 200 + 1}", "id.resp_h": address}
+        if idx % 3 == 1:
+            record["query"] = f"www.site{idx % 50000}.org"
+        elif idx % 3 == 2:
+            record["host"] = f"cdn{idx % 50000}.example.net"
+            record["uri"] = f"/static/{idx}.js"
+        records.append(record)
+    return records
+
+
+def main():
+    indicators = int(get_option("indicators", 1000000))
+    records = get_records(int(get_option("records", 200000)))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        feed = os.path.join(temp_dir, "feed.txt")
+        write_feed(feed, indicators)
+        start = time.perf_counter()
+        stage = ThreatIntelStage([feed], reload_seconds=0)
+        print(f"[INFO] {len(stage.index)} indicators loaded in {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        stage.process("zeek_conn", [dict(record) for record in records])
+        print(f"{'stage':10} {len(records) / (time.perf_counter() - start):12.0f} records/s")
+        # a changed feed - the next index is built while the batches go on
+        with open(feed, 'a') as file:
+            file.write("203.0.113.7\n")
+        reload = threading.Thread(target=stage.reload)
+        reload.start()
+        start, done = time.perf_counter(), 0
+        while reload.is_alive():
+            done += len(stage.process("zeek_conn", [dict(record) for record in records[:5000]]))
+        elapsed = time.perf_counter() - start
+        reload.join()
+        print(f"{'reloading':10} {done / elapsed:12.0f} records/s for {elapsed:.2f}s "
+              f"(no batch waits for the new index)")
+
+
+if __name__ == "__main__":
+    main()
@@ -32,16 +32,54 @@ from modules.json_convert import read_csv_to_json
 from modules.json_convert import read_to_json
 from modules.json_convert import read_log_to_json
 from modules.json_convert import read_gz_to_json
+from modules.json_convert import get_file_size
+from modules.stream_reader import READ_MAX_BYTES
+from modules.stream_reader import READ_MAX_RECORDS
 from modules.json_load import connect_elk_db
 from modules.json_load import load_json_to_elk
+from modules.json_load import submit_json_to_elk
 from modules.forwarder_arg import validate_args
 from modules.forwarder_arg import Locator
+from modules.forwarder_arg import get_option
+from modules.checkpoint import CheckpointStore
+from modules.checkpoint import CHECKPOINT_FILE
+from modules.inotify_watch import InotifyWatcher
+from modules.inotify_watch import inotify_available
+from modules.dir_scanner import DirScanner
+from modules.reader_plan import PLAN_EXTENSIONS
+from modules.gzip_stream import is_gzip
+from modules.backfill import run_backfill
+from modules.shard_reader import SHARD_MIN_BYTES
+from modules.file_scheduler import FILE_DONE
+from modules.file_scheduler import FILE_MORE
+from modules.file_scheduler import FILE_RETRY
+from modules.csv_reader import CSV_TYPES
+from modules.spool import Spool
+from modules.spool import SpoolSender
+from modules.spool import SPOOL_DIR
+from modules.spool import SPOOL_MAX_BYTES
+from modules.geoip import GEOIP_CACHE
+from modules.geoip import make_geoip_stage
+from modules.dhcp_join import DHCPJoinStage
+from modules.dhcp_join import DHCP_SNAPSHOT_FILE
+from modules.dhcp_join import DHCP_MAX_HOSTS
+from modules.dhcp_join import DHCP_INDEX_SUFFIX
+from modules.oui_lookup import OUI_TABLE_FILE
+from modules.oui_lookup import OUIStage
+from modules.oui_lookup import open_oui_table
+from modules.threat_intel import INTEL_RELOAD_SECONDS
+from modules.threat_intel import ThreatIntelStage
+from modules.normalize import NormalizeStage
+from modules.normalize import load_mappings
+from modules.csv_reader import validate_csv_types
+from modules import json_codec
 
 DEBUG_FLAG = False
 
 ## horang forwarder ##
 
-def load_data(filepath, pointer):
+def load_data(filepath, pointer, stat=None, max_bytes=READ_MAX_BYTES, 
+              max_records=READ_MAX_RECORDS, plan=None, gzindex=None, handles=None):
     """
     Load data from the pointer position
     if it's a CSV, then convert it to JSON
@@ -49,6 +87,12 @@ def load_data(filepath, pointer):
     Args:
         filepath (_str_): _full path and name - file name and path_
         pointer (_int_): _file line locator_
+        stat (_os.stat_result_): _stat from the directory scanner if it's known_
+        max_bytes (_int_): _maximum bytes to read at the time_
+        max_records (_int_): _maximum records to return at the time_
+        plan (_ReaderPlan_): _cached format and header of the file_
+        gzindex (_GzipIndex_): _seek points of gzip archives_
+        handles (_HandlePool_): _open handles of the tail-follow mode_
 
     Returns:
         _a list with data and pointer_ (_list_): _returns JSON data list and pointer_
@@ -70,23 +114,22 @@ def load_data(filepath, pointer):
         if idx in filepath:
             return ret_val
     if DEBUG_FLAG:
-        print("### [DEBUG]", filepath, pointer, os.path.getsize(filepath))
+        print("### [DEBUG]", filepath, pointer, get_file_size(filepath, stat))
     
     # file size 0
-    if os.path.getsize(filepath) == 0:
+    if get_file_size(filepath, stat) == 0:
         return ret_val
 
     # only allows .log, .json, ndjson, .log, .csv 
-    if validate_file_json(filepath):
-        return read_to_json(filepath, pointer)
-    elif validate_file_csv(filepath):
-        return read_csv_to_json(filepath, pointer)
-    elif validate_file_log(filepath):
-        return read_log_to_json(filepath, pointer)
-    # under maintainance
-    # elif validate_file_gz(filepath):
-        # run only one time
-        return read_gz_to_json(filepath, pointer)
+    if validate_file_json(filepath, stat):
+        return read_to_json(filepath, pointer, stat, max_bytes, max_records, plan, handles)
+    elif validate_file_csv(filepath, stat):
+        return read_csv_to_json(filepath, pointer, stat, max_bytes, max_records, plan, handles)
+    elif validate_file_log(filepath, stat):
+        return read_log_to_json(filepath, pointer, stat, max_bytes, max_records, plan, handles)
+    # gzip archives are streamed from the uncompressed position
+    elif validate_file_gz(filepath, stat):
+        return read_gz_to_json(filepath, pointer, stat, max_bytes, max_records, plan, gzindex)
     else:
         return ret_val
 
@@ -94,61 +137,299 @@ def load_data(filepath, pointer):
 
 
 
+def process_file(locator, root, file, stat=None):
+    """
+        load the new data of one file to the SIEM and commit the position
+        reads stop at the round budget of the scheduler
+
+    Args:
+        locator (_Locator_): _Locator instance_
+        root (_str_): _path_
+        file (_str_): _file name_
+        stat (_os.stat_result_): _stat from the directory scanner if it's known_
+
+    Returns:
+        _int_: _FILE_DONE, FILE_MORE (budget used up) or FILE_RETRY (the SIEM did not take the data)_
+    """
+    # file skip function
+    skip_flag = locator.skip_file(root, file)
+    if skip_flag == True:
+        return FILE_DONE
+    filepath = locator.set_filepath(root, file)
+    # rotation and truncation by file identity
+    locator.track_file(filepath, stat)
+    plan = None
+    scheduler = locator.scheduler
+    budget_bytes = scheduler.round_bytes
+    budget_records = scheduler.round_records
+    # chunk in flight to the SIEM - (future, position after it)
+    sent = None
+    current = locator.get_filepointer(filepath)
+    # format error skip
+    if current == -1:
+        return FILE_DONE
+    # bounded reads - the data is shipped and committed chunk by chunk,
+    # the next chunk is read while the one before is in flight
+    while True:
+        # back pressure - no new data while the sink is saturated (the spool takes it)
+        if locator.sink is not None and locator.spool is None:
+            locator.sink.wait_for_capacity()
+        # format and header from the plan cache - one head read per file identity
+        if plan is None and filepath.lower().endswith(PLAN_EXTENSIONS) and \
+           get_file_size(filepath, stat) > 0:
+            plan = locator.get_plan(filepath)
+        # memory bound across the files - the rest waits for the next round
+        max_bytes = scheduler.reserve(min(locator.read_max_bytes, budget_bytes))
+        if max_bytes == 0:
+            return FILE_MORE if commit_sent(locator, filepath, sent) else FILE_RETRY
+        future = None
+        # bytes of the chunk in flight - held in the memory bound until it's loaded
+        held = 0
+        try:
+            # initial position to load the file
+            data, pointer = load_data(filepath, current, stat, max_bytes, 
+                                      min(locator.read_max_records, budget_records), plan,
+                                      locator.gzindex, locator.handles)
+
+            # Notthing to load or flag to skip
+            if pointer == -1:
+                if not commit_sent(locator, filepath, sent):
+                    return FILE_RETRY
+                # format Error - ignore the file..
+                locator.set_filelocator(filepath, pointer)
+                return FILE_DONE
+            if pointer == current:
+                return FILE_DONE if commit_sent(locator, filepath, sent) else FILE_RETRY
+            if data:
+                print(f'[INFO] Sucessfully loaded the "{locator.filename}\" file; JSON Index count: \"{len(data)}\" now...', \
+                      flush=True)
+                if DEBUG_FLAG:
+                    print("[DEBUG] ", filepath, "Data Length:", len(data))
+                print(f'[INFO] Please wait....\n', flush=True)
+                ######################################################################
+                # Successfully loaded data as JSON, then load the JSON/s to the SIEM #
+                ###################################################################### 
+                # enrichment (GeoIP, ...) before the batch leaves the reader
+                if locator.stages:
+                    data = locator.stages.apply(locator.get_index(), data)
+                if locator.spool is not None:
+                    # durable in the spool before the position moves - sent in the background
+                    # the spool is full - try again later from the same position
+                    if locator.spool.append(locator.get_index(), data) != True:
+                        return FILE_RETRY
+                else:
+                    future = submit_json_to_elk(locator, data)
+                    held = min(max_bytes, max(pointer - current, 0))
+        finally:
+            scheduler.release(max_bytes - held)
+        # the chunk before went out while this one was read - its position first
+        if not commit_sent(locator, filepath, sent):
+            # not loaded - both chunks again later from the committed position
+            if future is not None:
+                future.result()
+                scheduler.release(held)
+            return FILE_RETRY
+        sent = None
+        if future is None:
+            # comments and empty lines only move the position
+            locator.set_filelocator(filepath, pointer)
+        else:
+            sent = (future, pointer, held)
+        budget_bytes -= pointer - current
+        budget_records -= len(data)
+        current = pointer
+        # gzip positions are uncompressed - the next read finds the end
+        if not is_gzip(filepath) and pointer >= get_file_size(filepath, stat):
+            return FILE_DONE if commit_sent(locator, filepath, sent) else FILE_RETRY
+        if budget_bytes <= 0 or budget_records <= 0:
+            return FILE_MORE if commit_sent(locator, filepath, sent) else FILE_RETRY
+
+
+def commit_sent(locator, filepath, sent):
+    """
+        wait for the chunk in flight and commit the position after it
+
+    Args:
+        locator (_Locator_): _Locator instance_
+        filepath (_str_): _file of the chunk_
+        sent (_tuple_): _future of the load, the position and the bytes held in the memory
+                         bound, None if nothing is in flight_
+
+    Returns:
+        _bool_: _True if the chunk is loaded (or nothing was in flight)_
+    """
+    if sent is None:
+        return True
+    future, pointer, held = sent
+    loaded = future.result()
+    locator.scheduler.release(held)
+    if loaded != True:
+        return False
+    locator.set_filelocator(filepath, pointer)
+    return True
+
+
+def process_files(locator, pending):
+    """
+        one round of the scheduler - the files with new data and the backlog
+        by priority lane, each file up to its budget
+
+    Args:
+        locator (_Locator_): _Locator instance_
+        pending (_dict_): _file path to os.stat_result, None if it's not known_
+
+    Returns:
+        _set_: _files that need another attempt_
+    """
+    retry = set()
+    scheduler = locator.scheduler
+    for filepath in sorted(pending):
+        # the lane follows the index of the file
+        locator.set_index(os.path.dirname(filepath), os.path.basename(filepath))
+        scheduler.add(filepath, pending[filepath], locator.get_index())
+    for filepath, stat in scheduler.next_round():
+        # removed or renamed again since it was reported
+        if stat is None and not os.path.isfile(filepath):
+            scheduler.done(filepath)
+            continue
+        status = process_file(locator, os.path.dirname(filepath), 
+                              os.path.basename(filepath), stat)
+        # files with more data stay in the scheduler for the next round
+        if status != FILE_MORE:
+            scheduler.done(filepath)
+        if status == FILE_RETRY:
+            retry.add(filepath)
+    return retry
+
+
+def scan_directory(locator, scanner, retry=(), full=False):
+    """
+        check the files from sub directories with the stat cache scanner
+
+    Args:
+        locator (_Locator_): _Locator instance_
+        scanner (_DirScanner_): _stat cache of the directory_
+        retry (_set_): _files from the last cycle that need another attempt_
+        full (_bool_): _list every directory and check every file_
+
+    Returns:
+        _set_: _files that need another attempt_
+    """
+    pending = dict(scanner.scan(full))
+    for filepath in retry:
+        pending.setdefault(filepath, None)
+    return process_files(locator, pending)
+
+
+def watch_directory(locator, watcher, scanner):
+    """
+        event-driven loop - only the files reported by inotify are read
+
+    Args:
+        locator (_Locator_): _Locator instance_
+        watcher (_InotifyWatcher_): _watches on the directory tree_
+        scanner (_DirScanner_): _stat cache for the catch-up scans_
+    """
+    # catch up with the files written before the watches were added
+    retry = scan_directory(locator, scanner, full=True)
+    while True:
+        # no wait while the scheduler has a backlog, wake up for the retries
+        if locator.scheduler.has_backlog():
+            timeout = 0
+        else:
+            timeout = locator.interval if retry else None
+        changed, rescan = watcher.read_events(timeout)
+        if rescan:
+            print('[INFO] inotify queue overflow; scanning the directory again', flush=True)
+            retry = scan_directory(locator, scanner, retry, full=True)
+        else:
+            pending = dict.fromkeys(retry | changed)
+            retry = process_files(locator, pending)
+        # positions of this round in one write
+        if locator.checkpoint is not None:
+            locator.checkpoint.flush()
+
+
 def monitor_directory(locator=None):
     '''
-    os walk to check all files from sub directories to load JSONs to a SIEM
-    multi-threading using _thread
+    check all files from sub directories to load JSONs to a SIEM
+    with inotify events (Linux) or stat cache polling with the interval
     '''
     if not isinstance(locator, Locator):
         return
 
+    watcher = None
+    scanner = DirScanner(locator.dirlocator)
+    sender = None
     try:
+        # spooled batches (also the ones left from the last run) go out in the background
+        if locator.spool is not None:
+            sender = SpoolSender(locator.spool, 
+                                 lambda index, documents: load_json_to_elk(locator, documents, index))
+            sender.start()
+        # inotify unless the polling is chosen or it's not available
+        if locator.watch_mode != "poll" and inotify_available():
+            watcher = InotifyWatcher(locator.dirlocator)
+            print(f'[INFO] Watching "{locator.dirlocator}" with inotify', flush=True)
+            watch_directory(locator, watcher, scanner)
+        elif locator.watch_mode == "inotify":
+            print('[ERROR] inotify is not available; polling with the interval', flush=True)
         # in order to check the directories and files periodically with the interval (default: 10 second)
+        retry = set()
         while True:
-            # Get the list of subfolders and files in the base directory
-            for root, dirs, files in os.walk(locator.dirlocator):
-                # for loop to iterate each file
-                for file in files:
-                    # file skip function
-                    skip_flag = locator.skip_file(root, file)
-                    if skip_flag == True:
-                        continue
-                    filepath = locator.set_filepath(root, file)
-                    # format error skip
-                    if locator.get_filepointer(filepath) == -1:
-                       continue
-                    else:
-                        # initial position to load the file
-                        data, pointer = load_data(filepath, 
-                                                  locator.get_filepointer(filepath))
-
-                        # Notthing to load or flag to skip
-                    if pointer == -1 or data == "":
-                        # format Error then fail-over re-attempt
-                        if pointer == -1:
-                            # ignore the file..
-                            locator.set_filelocator(filepath, pointer)
-                        # break for invalid format mapping to pass the next time
-                        time.sleep(locator.interval)
-                        continue
-                    if data and pointer > locator.get_filepointer(filepath):
-                        print(f'[INFO] Sucessfully loaded the "{locator.filename}\" file; JSON Index count: \"{len(data)}\" now...', \
-                              flush=True)
-                        if DEBUG_FLAG:
-                            print("[DEBUG] ", filepath, "Data Length:", len(data))
-                        print(f'[INFO] Please wait....\n', flush=True)
-                    ######################################################################
-                    # Successfully loaded data as JSON, then load the JSON/s to the SIEM #
-                    # possibly add threads for future                                    #
-                    ###################################################################### 
-                    ret = load_json_to_elk(locator, data)
-                    # if succefully loaded
-                    if ret == True:
-                        locator.set_filelocator(filepath, pointer)
-            time.sleep(locator.interval)
+            retry = scan_directory(locator, scanner, retry)
+            # positions of this cycle in one write
+            if locator.checkpoint is not None:
+                locator.checkpoint.flush()
+            # the next round of the backlog goes on with a quick scan
+            if not locator.scheduler.has_backlog():
+                time.sleep(locator.interval)
     except Exception as err:
         print(f'[ERROR] Closing out... due to {err}')
         sys.exit(1)
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if sender is not None:
+            sender.stop()
+            locator.spool.close()
+        # the _bulk requests in flight finish before the checkpoint is closed
+        if locator.sink is not None:
+            locator.sink.close()
+        if locator.handles is not None:
+            locator.handles.close_all()
+        locator.stages.close()
+        if locator.checkpoint is not None:
+            locator.checkpoint.close()
+
+
+def backfill_directory(locator=None):
+    '''
+    one-shot load of the archives under the directory with a process pool
+    exits when every file is loaded - a stopped backfill resumes from the checkpoint
+    '''
+    if not isinstance(locator, Locator):
+        return
+    try:
+        ship = load_json_to_elk
+        shard_min_bytes = SHARD_MIN_BYTES
+        if locator.stages:
+            def ship(locator, data):
+                return load_json_to_elk(locator, locator.stages.apply(locator.get_index(), data))
+            # shards are NDJSON lines - only for stages that read raw lines
+            if locator.stages.needs_fields():
+                shard_min_bytes = sys.maxsize
+        failed = run_backfill(locator, load_data, ship, locator.backfill_workers, shard_min_bytes)
+        if failed:
+            print(f'[ERROR] Backfill incomplete for {len(failed)} file(s)', flush=True)
+            sys.exit(1)
+        print('[INFO] Backfill completed', flush=True)
+    finally:
+        if locator.sink is not None:
+            locator.sink.close()
+        locator.stages.close()
+        if locator.checkpoint is not None:
+            locator.checkpoint.close()
 
 
 def main():
@@ -156,12 +437,88 @@ def main():
     log forwader main
     '''
     try:
+        # JSON backend for the readers and the _bulk body
+        try:
+            codec = json_codec.set_codec(get_option("json-backend", "auto"))
+        except (ValueError, ImportError) as err:
+            print(f"[ERROR] JSON backend: {err}", flush=True)
+            sys.exit(1)
+        print(f'[INFO] JSON backend: {codec.name}', flush=True)
+        try:
+            validate_csv_types(get_option("csv-types", CSV_TYPES))
+        except ValueError as err:
+            print(f"[ERROR] CSV types: {err}", flush=True)
+            sys.exit(1)
         locator = Locator()
+        # committed file positions survive restarts
+        locator.set_checkpoint(CheckpointStore(get_option("checkpoint", CHECKPOINT_FILE)))
+        # enrichment stages - the passthrough is off unless every stage reads raw lines
+        geoip = get_option("geoip", False)
+        if geoip:
+            try:
+                locator.stages.add(make_geoip_stage(geoip, get_option("geoip-locations"),
+                                                    int(get_option("geoip-cache", GEOIP_CACHE))))
+            except (OSError, ImportError, ValueError) as err:
+                print(f"[ERROR] GeoIP database: {err}", flush=True)
+                sys.exit(1)
+            print(f'[INFO] GeoIP enrichment: {geoip}', flush=True)
+        dhcp_join = get_option("dhcp-join", False)
+        if dhcp_join:
+            locator.stages.add(DHCPJoinStage(DHCP_SNAPSHOT_FILE if dhcp_join is True else dhcp_join,
+                                             int(get_option("dhcp-hosts", DHCP_MAX_HOSTS))))
+            # the leases of a round are read before the conn.log
+            locator.scheduler.lanes.insert(0, ["*" + DHCP_INDEX_SUFFIX])
+            locator.add_state_file(locator.stages.stages[-1].snapshot_path)
+            print(f'[INFO] DHCP host name join: {locator.stages.stages[-1].snapshot_path}', 
+                  flush=True)
+        oui = get_option("oui", False)
+        if oui:
+            oui_table = get_option("oui-table", OUI_TABLE_FILE)
+            locator.add_state_file(oui_table)
+            try:
+                table = open_oui_table("" if oui is True else oui, oui_table)
+            except (OSError, ValueError) as err:
+                print(f"[ERROR] OUI table: {err}", flush=True)
+                sys.exit(1)
+            locator.stages.add(OUIStage(table))
+            print(f'[INFO] MAC OUI lookup: {len(table)} prefixes', flush=True)
+        intel = get_option("intel", False)
+        if intel:
+            feeds = [feed.strip() for feed in str(intel).split(',') if feed.strip()]
+            try:
+                stage = ThreatIntelStage(feeds, int(get_option("intel-reload", INTEL_RELOAD_SECONDS)))
+            except (OSError, ValueError) as err:
+                print(f"[ERROR] Threat intel feeds: {err}", flush=True)
+                sys.exit(1)
+            locator.stages.add(stage)
+            print(f'[INFO] Threat intel: {len(stage.index)} indicators from {len(feeds)} feeds', 
+                  flush=True)
+        # the last stage - the enrichment stages above match the original field names
+        normalize = get_option("normalize", False)
+        if normalize:
+            try:
+                plans = load_mappings(None if normalize is True else normalize)
+            except (OSError, ValueError) as err:
+                print(f"[ERROR] Field normalization: {err}", flush=True)
+                sys.exit(1)
+            locator.stages.add(NormalizeStage(plans))
+            print(f'[INFO] Field normalization: {", ".join(plans)}', flush=True)
+        if locator.stages.needs_fields():
+            locator.plans.set_passthrough(False)
+        # parsed batches go through the disk spool - a bare --spool uses the default directory
+        spool = get_option("spool", False)
+        if spool:
+            locator.spool = Spool(SPOOL_DIR if spool is True else spool,
+                                  max_bytes=int(get_option("spool-bytes", SPOOL_MAX_BYTES)))
         # option 1 is ELK
         if locator.dest_opt == "1":
             locator.client = connect_elk_db()
             if locator.client != None:
-                monitor_directory(locator)
+                # historical archives once, or follow the directory
+                if get_option("backfill", False) is True:
+                    backfill_directory(locator)
+                else:
+                    monitor_directory(locator)
             else:
                 print("[ERROR] Please choose the option..")
         # other options for future
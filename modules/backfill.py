@@ -0,0 +1,379 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Backfill - one-shot load of historical archives (Zeek/Suricata .log,
+# .log.gz, .json) with a process pool. Workers decompress and parse whole
+# files and hand the records back in bounded chunks through a queue; the
+# main process ships them to the sink and commits the positions, so a
+# stopped backfill resumes from the checkpoint and finished files are skipped.
+# A large plain file is split into mmap shards parsed by several workers.
+# Dependency: os, time, multiprocessing, concurrent.futures
+
+
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from modules.dir_scanner import DirScanner
+from modules.gzip_stream import GzipIndex
+from modules.gzip_stream import is_gzip
+from modules.reader_plan import PlanCache
+from modules.reader_plan import PLAN_EXTENSIONS
+from modules.shard_reader import SHARD_BYTES
+from modules.shard_reader import SHARD_FORMATS
+from modules.shard_reader import SHARD_MIN_BYTES
+from modules.shard_reader import ShardCommitter
+from modules.shard_reader import parse_shard
+from modules.shard_reader import split_shards
+from modules.stream_reader import is_quiet
+from modules import json_codec
+
+
+# chunks waiting in the queue per worker - bounds the memory
+BACKFILL_QUEUE_CHUNKS = 2
+# seconds between the progress lines
+BACKFILL_REPORT_SECONDS = 10
+
+# queue and stop flags (one per file) of the worker process - set by the pool initializer
+WORKER_QUEUE = None
+WORKER_STOP = None
+
+
+def set_worker_queue(chunks, stops=None):
+    global WORKER_QUEUE, WORKER_STOP
+    WORKER_QUEUE = chunks
+    WORKER_STOP = stops
+
+
+def is_stopped(settings):
+    """
+        True if the main process gave up on the file - its chunks would be dropped
+    """
+    slot = settings.get("slot")
+    return WORKER_STOP is not None and slot is not None and WORKER_STOP[slot] != 0
+
+
+def is_backfill_done(entry, stat):
+    """
+        True if the checkpoint records the file as loaded and it has not changed
+
+    Args:
+        entry (_dict_): _checkpoint entry of the file_
+        stat (_os.stat_result_): _current stat of the file_
+    """
+    if not entry or not entry.get("done"):
+        return False
+    return (entry.get("dev"), entry.get("ino"), entry.get("size")) == \
+           (stat.st_dev, stat.st_ino, stat.st_size)
+
+
+def backfill_file(load, filepath, pointer, settings):
+    """
+        worker - read one file to the end, records sent in chunks to the queue
+        messages: (filepath, records, pointer, done)
+
+    Args:
+        load (_callable_): _load_data of the forwarder_
+        filepath (_str_): _full path and name_
+        pointer (_int_): _position to resume from_
+        settings (_dict_): _read limits, plan options, gzip seek point and key_
+
+    Returns:
+        _int_: _position after the last chunk, -1 for unreadable files_
+    """
+    try:
+        plans = PlanCache(typed=settings["typed"], time_format=settings["time_format"],
+                          passthrough=settings["passthrough"], csv_types=settings["csv_types"])
+        plan = plans.get(filepath)
+        gzindex = GzipIndex()
+        if settings.get("gz"):
+            gzindex.add_member(filepath, settings["key"], *settings["gz"])
+        size = os.path.getsize(filepath)
+        while not is_stopped(settings):
+            data, next_pointer = load(filepath, pointer, None, settings["max_bytes"],
+                                      settings["max_records"], plan, gzindex)
+            if next_pointer == -1 or next_pointer == pointer:
+                pointer = next_pointer
+                break
+            pointer = next_pointer
+            if plan.raw:
+                # memoryview slices do not cross processes
+                data = [bytes(line) for line in data]
+            WORKER_QUEUE.put((filepath, data, pointer, False))
+            if not is_gzip(filepath) and pointer >= size:
+                break
+    except Exception as err:
+        print(f'[ERROR] Backfill {err} - {filepath} file..', flush=True)
+        pointer = -1
+    finally:
+        WORKER_QUEUE.put((filepath, None, pointer, True))
+    return pointer
+
+
+def backfill_shard(filepath, start, end, settings):
+    """
+        worker - parse one shard of a large file to NDJSON lines
+        message: (filepath, documents or None on errors, (start, end), True)
+    """
+    documents = None
+    try:
+        if not is_stopped(settings):
+            documents = parse_shard(filepath, start, end, settings)
+    except Exception as err:
+        print(f'[ERROR] Backfill {err} - {filepath} file [{start}:{end}]..', flush=True)
+    finally:
+        WORKER_QUEUE.put((filepath, documents, (start, end), True))
+    return start, end
+
+
+class BackfillProgress:
+    def __init__(self, total_files, total_bytes, report_seconds=BACKFILL_REPORT_SECONDS):
+        """
+            files, bytes on disk and records done with the rate and ETA
+            gzip archives count their bytes when they are done
+        """
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.report_seconds = report_seconds
+        self.files = 0
+        self.bytes = 0
+        self.records = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def add(self, records=0, size=0, files=0):
+        self.records += records
+        self.bytes += size
+        self.files += files
+
+    def get_status(self):
+        """
+            progress line
+
+        Returns:
+            _str_: _files, GB, records/s and ETA_
+        """
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        rate = self.records / elapsed
+        eta = "--:--:--"
+        if self.bytes > 0:
+            remaining = max(self.total_bytes - self.bytes, 0) * elapsed / self.bytes
+            eta = time.strftime("%H:%M:%S", time.gmtime(remaining))
+        return f'{self.files}/{self.total_files} files, ' \
+               f'{self.bytes / 1e9:.2f}/{self.total_bytes / 1e9:.2f} GB, ' \
+               f'{self.records} records ({rate:.0f} records/s), ETA {eta}'
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if force or now - self.last_report >= self.report_seconds:
+            self.last_report = now
+            print(f'[INFO] Backfill: {self.get_status()}', flush=True)
+
+
+def list_backfill_files(locator):
+    """
+        files to load under the directory, the largest first
+        files recorded as done in the checkpoint are skipped
+
+    Args:
+        locator (_Locator_): _Locator instance_
+
+    Returns:
+        _list_: _(path, stat) of the files_
+    """
+    files = []
+    for filepath, stat in DirScanner(locator.dirlocator).scan(full=True):
+        root, filename = os.path.split(filepath)
+        if not filepath.lower().endswith(PLAN_EXTENSIONS) or stat.st_size == 0 or \
+           locator.skip_file(root, filename):
+            continue
+        if locator.checkpoint is not None and \
+           is_backfill_done(locator.checkpoint.get_entry(filepath), stat):
+            continue
+        files.append((filepath, stat))
+    files.sort(key=lambda item: item[1].st_size, reverse=True)
+    return files
+
+
+def stop_workers(pool, futures, chunks, stops):
+    """
+        give up the backfill - the work not started is cancelled, and the queue is
+        read until the running workers finish (they block on a full queue otherwise)
+    """
+    for slot in range(len(stops)):
+        stops[slot] = 1
+    pool.shutdown(wait=False, cancel_futures=True)
+    while not all(future.done() for future in futures):
+        try:
+            chunks.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+
+def run_backfill(locator, load, ship, workers=None, shard_min_bytes=SHARD_MIN_BYTES,
+                 shard_bytes=SHARD_BYTES):
+    """
+        load every file under the directory once with a process pool
+
+    Args:
+        locator (_Locator_): _Locator instance with the checkpoint_
+        load (_callable_): _load_data of the forwarder (picklable)_
+        ship (_callable_): _ship(locator, records) - True if the sink took them_
+        workers (_int_): _worker processes, the core count by default_
+        shard_min_bytes (_int_): _plain files with more unread bytes are sharded_
+        shard_bytes (_int_): _bytes per shard_
+
+    Returns:
+        _list_: _files that were not loaded completely_
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    files = list_backfill_files(locator)
+    starts = {}
+    settings = {}
+    # large plain files - shards and the position merged from them
+    shards = {}
+    committers = {}
+    for slot, (filepath, stat) in enumerate(files):
+        root, filename = os.path.split(filepath)
+        locator.set_filepath(root, filename)
+        # resume - rotated, replaced or truncated files are handled by the identity
+        pointer = max(locator.track_file(filepath, stat), 0)
+        starts[filepath] = pointer
+        settings[filepath] = {"max_bytes": locator.read_max_bytes,
+                              "max_records": locator.read_max_records,
+                              "typed": locator.plans.typed,
+                              "time_format": locator.plans.time_format,
+                              "passthrough": locator.plans.passthrough,
+                              "csv_types": locator.plans.csv_types,
+                              "gz": locator.gzindex.member_point(filepath, pointer),
+                              "key": (stat.st_dev, stat.st_ino),
+                              "json_backend": json_codec.codec.name,
+                              "slot": slot}
+        if not is_gzip(filepath) and stat.st_size - pointer >= shard_min_bytes and \
+           locator.get_plan(filepath).format in SHARD_FORMATS:
+            end = stat.st_size if is_quiet(filepath, stat) else None
+            shards[filepath] = split_shards(filepath, pointer, end, shard_bytes)
+            committers[filepath] = ShardCommitter(pointer)
+    total_bytes = sum(stat.st_size - (0 if is_gzip(path) else min(starts[path], stat.st_size))
+                      for path, stat in files)
+    progress = BackfillProgress(len(files), total_bytes)
+    print(f'[INFO] Backfill: {len(files)} files, {total_bytes / 1e9:.2f} GB, '
+          f'{workers} workers', flush=True)
+    stats = dict(files)
+    positions = dict(starts)
+    failed = set()
+    completed = set()
+    chunks = multiprocessing.Queue(maxsize=workers * BACKFILL_QUEUE_CHUNKS)
+    # set for a failed file - its workers stop instead of parsing chunks to drop
+    stops = multiprocessing.RawArray('b', max(len(files), 1))
+
+    def stop_file(filepath):
+        failed.add(filepath)
+        stops[settings[filepath]["slot"]] = 1
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_queue,
+                             initargs=(chunks, stops)) as pool:
+        futures = []
+        for filepath, _ in files:
+            if filepath in shards:
+                futures.extend(pool.submit(backfill_shard, filepath, start, end, 
+                                           settings[filepath]) 
+                               for start, end in shards[filepath])
+            else:
+                futures.append(pool.submit(backfill_file, load, filepath, starts[filepath], 
+                                           settings[filepath]))
+        # shards not received yet per file
+        shards_left = {filepath: len(ranges) for filepath, ranges in shards.items()}
+        # files without shards (nothing but a partial line) are finished
+        finished = sum(1 for left in shards_left.values() if left == 0)
+        completed.update(filepath for filepath, left in shards_left.items() if left == 0)
+        while finished < len(files):
+            try:
+                filepath, data, pointer, done = chunks.get(timeout=1)
+            except queue.Empty:
+                progress.report()
+                # a worker process died without its last message
+                if any(future.done() and future.exception() is not None for future in futures):
+                    print('[ERROR] Backfill worker stopped; run it again to resume', flush=True)
+                    failed.update(path for path, _ in files if path not in completed)
+                    stop_workers(pool, futures, chunks, stops)
+                    break
+                continue
+            root, filename = os.path.split(filepath)
+            stat = stats[filepath]
+            if isinstance(pointer, tuple):
+                # a shard - shipped in any order, committed in order
+                shards_left[filepath] -= 1
+                if data is None:
+                    stop_file(filepath)
+                elif filepath not in failed:
+                    locator.set_filepath(root, filename)
+                    if data and not ship(locator, data):
+                        print(f'[ERROR] Backfill stopped for "{filepath}" at '
+                              f'{positions[filepath]}; run it again to resume', flush=True)
+                        stop_file(filepath)
+                    else:
+                        progress.add(records=len(data), size=pointer[1] - pointer[0])
+                        position = committers[filepath].done(*pointer)
+                        if position is not None:
+                            positions[filepath] = position
+                            locator.set_filelocator(filepath, position)
+                if shards_left[filepath] > 0:
+                    progress.report()
+                    continue
+                # the last shard - finished like a whole file
+                pointer = positions[filepath]
+            if done:
+                finished += 1
+                completed.add(filepath)
+                if pointer == -1:
+                    failed.add(filepath)
+                    locator.set_filelocator(filepath, -1)
+                elif filepath not in failed:
+                    rest = stat.st_size if is_gzip(filepath) else stat.st_size - positions[filepath]
+                    progress.add(size=max(rest, 0), files=1)
+                    # finished - skipped by the next backfill while it's unchanged
+                    if locator.checkpoint is not None:
+                        locator.checkpoint.update(filepath, positions[filepath], done=True, 
+                                                  size=stat.st_size)
+                progress.report()
+                continue
+            if filepath in failed:
+                continue
+            # the index follows the file of the chunk
+            locator.set_filepath(root, filename)
+            if data and not ship(locator, data):
+                print(f'[ERROR] Backfill stopped for "{filepath}" at {positions[filepath]}; '
+                      f'run it again to resume', flush=True)
+                stop_file(filepath)
+                continue
+            if not is_gzip(filepath):
+                progress.add(size=pointer - positions[filepath])
+            progress.add(records=len(data))
+            positions[filepath] = pointer
+            locator.set_filelocator(filepath, pointer)
+            progress.report()
+    progress.report(force=True)
+    if locator.checkpoint is not None:
+        locator.checkpoint.flush(force=True)
+    return sorted(failed)
@@ -0,0 +1,221 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Elasticsearch sink that keeps several _bulk requests in flight.
+# Concurrency and batch size follow AIMD - additive increase while the
+# cluster keeps up, multiplicative decrease on 429 or slow responses.
+# Dependency: threading, concurrent.futures
+
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from modules.json_load import BULK_MAX_DOCS
+from modules.json_load import BULK_MAX_BYTES
+from modules.json_load import BULK_MAX_RETRIES
+from modules.json_load import BULK_RETRY_BACKOFF
+from modules.json_load import BULK_RETRY_BACKOFF_MAX
+from modules.json_load import iter_bulk_batches
+from modules.json_load import send_bulk_batch
+
+
+# in-flight _bulk requests
+BULK_WORKERS = 4
+# a response slower than this (seconds) counts as congestion
+BULK_LATENCY_TARGET = 2.0
+# smallest batch when the cluster pushes back
+BULK_MIN_DOCS = 50
+
+
+class AIMDController:
+    def __init__(self, max_concurrency=BULK_WORKERS, max_docs=BULK_MAX_DOCS,
+                 min_docs=BULK_MIN_DOCS, latency_target=BULK_LATENCY_TARGET):
+        """
+            AIMD limits for the in-flight requests and the batch size
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_docs = max(1, max_docs)
+        self.min_docs = max(1, min(min_docs, self.max_docs))
+        self.latency_target = latency_target
+        # start in the middle and grow while the cluster keeps up
+        self.concurrency = max(1, self.max_concurrency // 2)
+        self.batch_docs = self.max_docs
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def on_success(self, latency):
+        """
+            grow by one request (per window of successes) and a tenth of the batch
+            a latency spike shrinks the limits like a rejection
+
+        Args:
+            latency (_float_): _response time in seconds_
+        """
+        if latency > self.latency_target:
+            self.on_reject()
+            return
+        with self.lock:
+            self.successes += 1
+            if self.successes < self.concurrency:
+                return
+            self.successes = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.batch_docs = min(self.max_docs,
+                                  self.batch_docs + max(1, self.max_docs // 10))
+
+    def on_reject(self):
+        """
+            halve the concurrency and the batch size
+        """
+        with self.lock:
+            self.successes = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            self.batch_docs = max(self.min_docs, self.batch_docs // 2)
+
+
+class BulkSink:
+    def __init__(self, client, max_concurrency=BULK_WORKERS, max_docs=BULK_MAX_DOCS,
+                 max_bytes=BULK_MAX_BYTES, max_retries=BULK_MAX_RETRIES,
+                 latency_target=BULK_LATENCY_TARGET):
+        """
+            Elasticsearch sink with concurrent _bulk requests and back pressure
+        """
+        self.client = client
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.controller = AIMDController(max_concurrency, max_docs,
+                                         latency_target=latency_target)
+        self.pool = ThreadPoolExecutor(max_workers=self.controller.max_concurrency,
+                                       thread_name_prefix="horang-bulk")
+        # one chunk at a time is split into the batches, in the order of submit()
+        self.dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="horang-dispatch")
+        self.slots = threading.Condition()
+        self.in_flight = 0
+        # no new data is read until the cool down ends after a rejection
+        self.cooldown_until = 0
+
+    def acquire(self):
+        with self.slots:
+            while self.in_flight >= self.controller.concurrency:
+                self.slots.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.slots:
+            self.in_flight -= 1
+            self.slots.notify_all()
+
+    def send(self, positions, body):
+        """
+            send one batch from a worker thread and update the AIMD limits
+
+        Returns:
+            _tuple_: _positions to retry and a list of rejected items_
+        """
+        try:
+            start = time.monotonic()
+            retry, rejected = send_bulk_batch(self.client, positions, body)
+            if retry:
+                self.controller.on_reject()
+                self.cooldown_until = time.monotonic() + BULK_RETRY_BACKOFF
+            else:
+                self.controller.on_success(time.monotonic() - start)
+            return retry, rejected
+        finally:
+            self.release()
+
+    def saturated(self):
+        """
+            True if the sink cannot take more data now
+        """
+        return self.in_flight >= self.controller.concurrency or \
+               time.monotonic() < self.cooldown_until
+
+    def wait_for_capacity(self, timeout=None):
+        """
+            block the reader while the sink is saturated
+
+        Args:
+            timeout (_float_): _maximum wait in seconds, None to wait until ready_
+
+        Returns:
+            _bool_: _True if the sink is ready_
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.saturated():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            delay = max(0.01, min(self.cooldown_until - time.monotonic(), 0.1))
+            time.sleep(delay)
+        return True
+
+    def load(self, index, documents):
+        """
+            send the documents with N _bulk requests in flight
+            only the documents rejected with a retryable status are sent again
+
+        Args:
+            index (_str_): _index name_
+            documents (_list_): _a list of JSONs_
+
+        Returns:
+            _tuple_: _positions not accepted after the retries and rejected items_
+        """
+        pending = list(range(len(documents)))
+        rejected = []
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(min(BULK_RETRY_BACKOFF * (2 ** (attempt - 1)),
+                               BULK_RETRY_BACKOFF_MAX))
+            futures = []
+            # the batch size is read per batch, so a rejection shrinks the next ones
+            batches = iter_bulk_batches(index, documents, pending,
+                                        lambda: self.controller.batch_docs, self.max_bytes)
+            for positions, body in batches:
+                self.acquire()
+                futures.append(self.pool.submit(self.send, positions, body))
+            retry = []
+            for future in futures:
+                failed, dropped = future.result()
+                retry.extend(failed)
+                rejected.extend(dropped)
+            pending = sorted(retry)
+            if len(pending) == 0:
+                break
+        return pending, rejected
+
+    def submit(self, load, *args):
+        """
+            run a load in the background - the reader goes on with the next chunk
+            while the batches of this one are in flight
+
+        Args:
+            load (_callable_): _ex. load_json_to_elk_
+
+        Returns:
+            _Future_: _the result of the load_
+        """
+        return self.dispatcher.submit(load, *args)
+
+    def close(self):
+        self.dispatcher.shutdown(wait=True)
+        self.pool.shutdown(wait=True)
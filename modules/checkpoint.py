@@ -0,0 +1,166 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Persistent checkpoint store for the file positions (Locator.fileposition).
+# The store is one JSON file replaced atomically - written to a temp file,
+# fsync'd and renamed - and flushed in batches, not on every pointer update.
+# Dependency: json, os, tempfile
+
+
+import json
+import os
+import tempfile
+import time
+
+
+CHECKPOINT_FILE = "horang_checkpoint.json"
+CHECKPOINT_VERSION = 1
+# flush after this many updates or seconds, whichever comes first
+CHECKPOINT_FLUSH_UPDATES = 1000
+CHECKPOINT_FLUSH_SECONDS = 5
+
+
+def write_atomic(filepath, data):
+    """
+        replace the file with the data, crash-safe
+        temp file in the same directory, fsync, rename and fsync the directory
+
+    Args:
+        filepath (_str_): _destination file_
+        data (_bytes_): _file content_
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_path = tempfile.mkstemp(prefix=".horang_", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # the rename is durable only after the directory entry is synced
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # not supported (ex. Windows)
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class CheckpointStore:
+    def __init__(self, filepath=CHECKPOINT_FILE, flush_updates=CHECKPOINT_FLUSH_UPDATES,
+                 flush_seconds=CHECKPOINT_FLUSH_SECONDS):
+        """
+            on-disk file positions, loaded once at start up
+        """
+        self.filepath = filepath
+        self.flush_updates = flush_updates
+        self.flush_seconds = flush_seconds
+        self.entries = {}
+        self.updates = 0
+        self.last_flush = time.monotonic()
+        self.load()
+
+    def load(self):
+        """
+            read the checkpoint file - a missing or broken file starts empty
+
+        Returns:
+            _dict_: _file path and entry ({"pos": int, ...})_
+        """
+        self.entries = {}
+        try:
+            with open(self.filepath, "rb") as file:
+                content = json.loads(file.read())
+            if content.get("version") == CHECKPOINT_VERSION:
+                self.entries = content.get("files", {})
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError) as err:
+            print(f'[ERROR] Ignoring the broken checkpoint file "{self.filepath}" - {err}',
+                  flush=True)
+        return self.entries
+
+    def get(self, filepath, default=None):
+        """
+            saved position of the file
+
+        Args:
+            filepath (_str_): _full path and name_
+            default (_int_): _position if the file is unknown_
+
+        Returns:
+            _int_: _saved position_
+        """
+        entry = self.entries.get(filepath)
+        if entry is None:
+            return default
+        return entry.get("pos", default)
+
+    def get_entry(self, filepath):
+        return self.entries.get(filepath)
+
+    def update(self, filepath, pointer, **meta):
+        """
+            record the position, flushed with the next batch
+
+        Args:
+            filepath (_str_): _full path and name_
+            pointer (_int_): _committed position_
+            meta (_dict_): _extra values for the file_
+        """
+        entry = self.entries.setdefault(filepath, {})
+        entry["pos"] = pointer
+        entry.update(meta)
+        self.updates += 1
+        if self.updates >= self.flush_updates or \
+           time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def remove(self, filepath):
+        if self.entries.pop(filepath, None) is not None:
+            self.updates += 1
+
+    def flush(self, force=False):
+        """
+            write the pending updates
+
+        Args:
+            force (_bool_): _write even without pending updates_
+        """
+        if self.updates == 0 and not force:
+            return
+        content = {"version": CHECKPOINT_VERSION, "files": self.entries}
+        write_atomic(self.filepath, json.dumps(content, separators=(',', ':')).encode('utf-8'))
+        self.updates = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
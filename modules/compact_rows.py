@@ -0,0 +1,186 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Compact rows for TSV and CSV - a row is a tuple of values that shares one
+# schema (field names) per file instead of a dict per row repeating the keys.
+# The schema compiles the serializer once: a key template for the json module,
+# or a short-lived dict for the C codecs (orjson, simdjson) that encode dicts
+# faster than values one by one. None marks a dropped value (Zeek "-").
+# Repeated values of a column (proto, service, ports, addresses) are shared
+# by the rows until the column turns out to have too many distinct values.
+# Dependency: json
+
+
+import json
+from json.encoder import encode_basestring
+from modules import json_codec
+
+
+# distinct values shared per column - more turns the sharing off for the column
+COMPACT_SHARED_VALUES = 4096
+# rows between the checks of the shared values
+COMPACT_CHECK_ROWS = 1024
+
+
+class CompactRow(tuple):
+    """
+        values of one row in the schema order - read only, dict-like access
+    """
+    __slots__ = ()
+    schema = None
+
+    def get(self, name, default=None):
+        pos = self.schema.index.get(name)
+        if pos is None or pos >= len(self) or self[pos] is None:
+            return default
+        return self[pos]
+
+    def to_dict(self):
+        return {name: value for name, value in zip(self.schema.fields, self) 
+                if value is not None}
+
+    def __reduce__(self):
+        # the row class is made per schema - other processes get a dict
+        return (dict, (self.to_dict(),))
+
+
+def encode_value(value):
+    """
+        JSON text of one value - the json module output without the dict
+    """
+    if value.__class__ is str:
+        return encode_basestring(value)
+    if value.__class__ is int or (value.__class__ is float and value - value == 0):
+        return repr(value)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class RowSchema:
+    def __init__(self, fields):
+        """
+            field names shared by the rows of one file
+            row - the row class of the schema, ex. schema.row(values)
+        """
+        self.fields = tuple(fields)
+        self.index = {name: pos for pos, name in enumerate(self.fields)}
+        self.row = type("CompactRow", (CompactRow,), {"__slots__": (), "schema": self})
+        self.codec = None
+        self.encode = None
+
+    def compile(self, codec):
+        """
+            serializer of the rows for the codec
+
+        Returns:
+            _callable_: _row to the JSON bytes_
+        """
+        fields = self.fields
+        if codec.name != "stdlib":
+            dumps = codec.dumps
+            return lambda row: dumps({name: value for name, value in zip(fields, row) 
+                                      if value is not None})
+        keys = [json.dumps(name, ensure_ascii=False) + ':' for name in fields]
+
+        def encode(row):
+            return ('{' + ','.join([key + encode_value(value) for key, value in zip(keys, row) 
+                                    if value is not None]) + '}').encode('utf-8')
+
+        return encode
+
+    def serialize(self, row):
+        """
+            row as JSON bytes for the _bulk body
+
+        Args:
+            row (_CompactRow_): _row of the schema_
+
+        Returns:
+            _bytes_: _JSON document_
+        """
+        codec = json_codec.codec
+        if codec is not self.codec:
+            # compiled again only if the JSON backend changes
+            self.encode = self.compile(codec)
+            self.codec = codec
+        return self.encode(row)
+
+
+class SharedValues:
+    def __init__(self, width, shared=None, max_values=COMPACT_SHARED_VALUES):
+        """
+            one object per repeated value of a column - ex. "tcp" once for all rows
+            tables - value table per column, None for the columns not shared
+            shared - True for the columns to share (hashable values), None for all
+        """
+        self.tables = [{} if shared is None or shared[pos] else None for pos in range(width)]
+        self.max_values = max_values
+        self.rows = 0
+
+    def tick(self):
+        """
+            count a row - unique columns (time, uid) stop sharing, the table is only overhead
+        """
+        self.rows += 1
+        if self.rows % COMPACT_CHECK_ROWS == 0:
+            for pos, table in enumerate(self.tables):
+                if table is not None and len(table) > self.max_values:
+                    self.tables[pos] = None
+
+    def share(self, values):
+        """
+            values (list) with the shared objects
+        """
+        self.tick()
+        return [value if table is None else table.setdefault(value, value) 
+                for table, value in zip(self.tables, values)]
+
+
+def make_compact_tsv_parser(plan):
+    """
+        TSV line to a compact row of strings - the default parser without the dicts
+
+    Args:
+        plan (_ReaderPlan_): _plan with the Zeek #fields_
+
+    Returns:
+        _callable_: _line (bytes) to a row, None for comments, empty or invalid lines_
+    """
+    separator = plan.separator
+    width = len(plan.fields)
+    row = RowSchema(plan.fields).row
+    share = SharedValues(width).share
+
+    def parse_line(line):
+        line = line.decode('utf-8', 'replace')
+        if line.startswith('#') or line.startswith('{'):
+            return None
+        line = line.strip()
+        if line == "":
+            return None
+        values = line.split(separator)
+        if len(values) == 1:
+            values = [ele for ele in line.split(' ') if ele]
+        if len(values) != width:
+            return None
+        return row(share(values))
+
+    return parse_line
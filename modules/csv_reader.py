@@ -0,0 +1,285 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Incremental CSV reader - one csv.reader per read over the binary lines.
+# Lines come from the chunked line readers with the byte offset after each,
+# so a row ends at an exact offset even when a quoted field spans lines.
+# A row cut off by the end of the data (a quoted new line still being
+# written) is read again with the next call. Columns are strings, or typed
+# by --csv-types (auto from the head rows, or name:type pairs).
+# Dependency: csv, re
+
+
+import csv
+import re
+from modules.compact_rows import RowSchema
+from modules.compact_rows import SharedValues
+from modules.stream_reader import BOM
+from modules.stream_reader import READ_MAX_BYTES
+from modules.stream_reader import READ_MAX_RECORDS
+from modules.stream_reader import iter_chunk_lines
+from modules.stream_reader import iter_lines
+
+
+# off, auto (from the head rows) or name:type pairs - ex. bytes:int,duration:float
+CSV_TYPES = "off"
+# rows after the header for the type detection
+CSV_TYPE_SAMPLE_ROWS = 200
+# column types
+CSV_COLUMN_TYPES = ("int", "float", "bool", "str")
+
+INT_VALUE = re.compile(r'-?(0|[1-9][0-9]*)\Z')
+FLOAT_VALUE = re.compile(r'-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\Z')
+BOOL_VALUES = {"true": True, "false": False}
+
+
+class LineFeed:
+    def __init__(self, lines):
+        """
+            decoded lines for csv.reader with the byte offset after the last one
+            exhausted once the line reader has no more lines
+        """
+        self.lines = lines
+        self.offset = None
+        self.exhausted = False
+
+    def __iter__(self):
+        for line, offset in self.lines:
+            self.offset = offset
+            yield line.decode('utf-8', 'replace') + '\n'
+        self.exhausted = True
+
+
+def iter_csv_rows(lines, final=True):
+    """
+        CSV rows of the lines with the byte offset after each row
+
+    Args:
+        lines (_iterable_): _line (bytes) and the offset after it - iter_lines_
+        final (_bool or callable_): _keep a row cut off by the end of the data_
+
+    Yields:
+        _tuple_: _values (list) and the byte offset after the row_
+    """
+    feed = LineFeed(lines)
+    for values in csv.reader(feed):
+        # csv.reader asks for the next line only to complete a quoted field,
+        # so a row after the end of the lines was cut off
+        if feed.exhausted and not (final() if callable(final) else final):
+            return
+        yield values, feed.offset
+
+
+def parse_csv_header(head):
+    """
+        field names and the offset after the header row
+
+    Args:
+        head (_bytes_): _first bytes of the file_
+
+    Returns:
+        _tuple_: _field names (list) and the header end, None if the header is incomplete_
+    """
+    offset = len(BOM) if head.startswith(BOM) else 0
+    lines = iter_chunk_lines((head[offset:],), offset, final=False)
+    for values, header_end in iter_csv_rows(lines, final=False):
+        if values:
+            return [name.strip() for name in values], header_end
+    return None
+
+
+def guess_type(values):
+    """
+        the narrowest column type of the sample values, str if there is none
+    """
+    values = [value for value in values if value != ""]
+    if not values:
+        return "str"
+    if all(INT_VALUE.match(value) for value in values):
+        return "int"
+    if all(FLOAT_VALUE.match(value) for value in values):
+        return "float"
+    if all(value.lower() in BOOL_VALUES for value in values):
+        return "bool"
+    return "str"
+
+
+def to_bool(value):
+    return BOOL_VALUES[value.lower()]
+
+
+def get_converter(column_type):
+    """
+        str to the typed value, None for str columns
+    """
+    if column_type not in CSV_COLUMN_TYPES:
+        raise ValueError(f"unknown CSV column type '{column_type}'")
+    return {"int": int, "float": float, "bool": to_bool}.get(column_type)
+
+
+def parse_csv_types(csv_types):
+    """
+        name:type pairs of the --csv-types option
+
+    Returns:
+        _dict_: _field name to the column type_
+    """
+    types = {}
+    for pair in csv_types.split(','):
+        name, _, column_type = pair.strip().rpartition(':')
+        if not name:
+            raise ValueError(f"--csv-types needs name:type pairs, not '{pair}'")
+        get_converter(column_type)
+        types[name] = column_type
+    return types
+
+
+def validate_csv_types(csv_types):
+    """
+        raise ValueError if the --csv-types option is not off, auto or name:type pairs
+    """
+    if csv_types not in ("off", "auto"):
+        parse_csv_types(csv_types)
+
+
+def sample_csv_rows(filepath, plan, max_rows=CSV_TYPE_SAMPLE_ROWS):
+    """
+        the first rows after the header - values only
+    """
+    rows = []
+    lines = iter_lines(filepath, plan.header_end, final=False)
+    try:
+        for values, _ in iter_csv_rows(lines, final=False):
+            if values:
+                rows.append(values)
+            if len(rows) >= max_rows:
+                break
+    finally:
+        lines.close()
+    return rows
+
+
+def detect_csv_types(filepath, plan, csv_types=CSV_TYPES):
+    """
+        column types of the file - all str if off
+
+    Args:
+        filepath (_str_): _full path and name_
+        plan (_ReaderPlan_): _plan with the CSV header_
+        csv_types (_str_): _off, auto or name:type pairs_
+
+    Returns:
+        _list_: _column type per field_
+    """
+    if csv_types == "off":
+        return ["str"] * len(plan.fields)
+    if csv_types == "auto":
+        columns = list(zip(*sample_csv_rows(filepath, plan))) or [()] * len(plan.fields)
+        return [guess_type(values) for values in columns] + \
+               ["str"] * (len(plan.fields) - len(columns))
+    types = parse_csv_types(csv_types)
+    return [types.get(name, "str") for name in plan.fields]
+
+
+def make_csv_parser(fields, types=None, compact=False):
+    """
+        row values to a JSON - compiled once per file
+
+    Args:
+        fields (_list_): _field names from the header_
+        types (_list_): _column type per field, None for strings_
+        compact (_bool_): _compact rows (tuples of one schema) instead of dicts_
+
+    Returns:
+        _callable_: _values (list) to a JSON_
+    """
+    converters = [get_converter(column_type) for column_type in types or ()]
+    row = RowSchema(fields).row if compact else None
+    share = SharedValues(len(fields)).share if compact else None
+    if not any(converters):
+        if compact:
+            return lambda values: row(share(values))
+        return lambda values: dict(zip(fields, values))
+    columns = list(zip(fields, converters + [None] * (len(fields) - len(converters))))
+
+    def parse_compact_row(values):
+        record = []
+        for (_, convert), value in zip(columns, values):
+            if convert is None:
+                record.append(value)
+            elif value == "":
+                record.append(None)
+            else:
+                try:
+                    record.append(convert(value))
+                except (ValueError, KeyError):
+                    record.append(value)
+        return row(share(record))
+
+    def parse_row(values):
+        record = {}
+        for (name, convert), value in zip(columns, values):
+            if convert is None:
+                record[name] = value
+            elif value != "":
+                try:
+                    record[name] = convert(value)
+                except (ValueError, KeyError):
+                    # a value off the detected type is kept as it is
+                    record[name] = value
+        return record
+
+    return parse_compact_row if compact else parse_row
+
+
+def read_csv_rows(filepath, pointer, plan, max_bytes=READ_MAX_BYTES,
+                  max_records=READ_MAX_RECORDS, final=True, line_reader=iter_lines):
+    """
+        the next rows from the pointer (start of a row after the header)
+
+    Args:
+        filepath (_str_): _full path and name_
+        pointer (_int_): _byte offset to start from_
+        plan (_ReaderPlan_): _plan with the CSV header and the row parser_
+        max_bytes (_int_): _maximum bytes to read_
+        max_records (_int_): _maximum records to return_
+        final (_bool or callable_): _read the last row even without a new line_
+        line_reader (_callable_): _iter_lines or the pooled reader of the tail-follow mode_
+
+    Returns:
+        _list_: _records and the pointer after the last complete row_
+    """
+    data = []
+    start = pointer
+    parse_row = plan.parse_row or make_csv_parser(plan.fields)
+    lines = line_reader(filepath, pointer, None, final)
+    try:
+        for values, offset in iter_csv_rows(lines, final):
+            pointer = offset
+            # empty lines
+            if values:
+                data.append(parse_row(values))
+            if len(data) >= max_records or pointer - start >= max_bytes:
+                break
+    finally:
+        lines.close()
+    return [data, pointer]
@@ -0,0 +1,279 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# DHCP host name join - leases from Zeek dhcp.log records as they are read
+# (assigned address, host name, MAC and lease time) are kept per address,
+# and conn.log records get the host name of the lease valid at their ts.
+# Expired leases are evicted in expiry order as the log time moves on, the
+# number of addresses is capped (least recently leased out first) and so is
+# the expiry heap (rebuilt from the addresses when stale entries pile up),
+# and the leases are saved to a snapshot so a restart keeps the join state.
+# Dependency: heapq, json
+
+
+import heapq
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from modules.checkpoint import write_atomic
+from modules.stages import get_record
+from modules.stages import iter_records
+
+
+DHCP_SNAPSHOT_FILE = "horang_dhcp.json"
+DHCP_SNAPSHOT_VERSION = 1
+# addresses in the index - the least recently leased is dropped above it
+DHCP_MAX_HOSTS = 100000
+# leases kept per address (renewals of the same lease are merged)
+DHCP_LEASES_PER_HOST = 4
+# lease time if the record has none, and the longest one kept - "infinite" is 0xffffffff (seconds)
+DHCP_DEFAULT_LEASE = 86400
+DHCP_MAX_LEASE = 30 * 86400
+# heap entries per address before the heap is rebuilt
+DHCP_HEAP_FACTOR = 2
+# expired leases stay this long for late conn.log records (seconds)
+DHCP_GRACE_SECONDS = 3600
+DHCP_SNAPSHOT_SECONDS = 60
+# index names of the leases and of the records to tag - ex. zeek_dhcp, zeek_conn
+DHCP_INDEX_SUFFIX = "_dhcp"
+CONN_INDEX_SUFFIX = "_conn"
+# address field and the field added with the host name and MAC
+DHCP_JOIN_FIELDS = (("id.orig_h", "orig_dhcp"), ("id.resp_h", "resp_dhcp"))
+
+
+def to_epoch(value):
+    """
+        Zeek time as epoch seconds - float, or ISO 8601 (--zeek-time=iso, JSON logs)
+
+    Returns:
+        _float_: _epoch seconds, None if it's not a time_
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class LeaseIndex:
+    def __init__(self, max_hosts=DHCP_MAX_HOSTS, grace=DHCP_GRACE_SECONDS):
+        """
+            leases by address - [start, expiry, host name, MAC] sorted by start
+            expiries - heap of (expiry, address) for the incremental eviction, an entry
+                at or after the latest expiry of every address (older ones are stale)
+            watermark - the latest lease time seen (log time, not the clock)
+        """
+        self.max_hosts = max(1, max_hosts)
+        self.grace = grace
+        self.hosts = OrderedDict()
+        self.expiries = []
+        self.watermark = 0.0
+
+    def add(self, address, start, lease_time, host_name=None, mac=None):
+        """
+            a lease from a DHCP ACK - a renewal extends the current lease
+        """
+        expiry = start + min(max(lease_time, 0), DHCP_MAX_LEASE)
+        leases = self.hosts.pop(address, [])
+        latest = max((lease[1] for lease in leases), default=None)
+        last = leases[-1] if leases else None
+        if last is not None and last[2] == host_name and last[3] == mac and \
+           last[0] <= start <= last[1]:
+            last[1] = max(last[1], expiry)
+        else:
+            leases.append([start, expiry, host_name, mac])
+            leases.sort(key=lambda lease: lease[0])
+            del leases[:-DHCP_LEASES_PER_HOST]
+        # most recently leased last
+        self.hosts[address] = leases
+        # a renewal within the lease doesn't move the expiry
+        if latest is None or expiry > latest:
+            heapq.heappush(self.expiries, (expiry, address))
+        self.watermark = max(self.watermark, start)
+        while len(self.hosts) > self.max_hosts:
+            self.hosts.popitem(last=False)
+        if len(self.expiries) > DHCP_HEAP_FACTOR * len(self.hosts) + DHCP_LEASES_PER_HOST:
+            self.rebuild()
+
+    def rebuild(self):
+        """
+            the expiry heap without the stale entries - one per address
+        """
+        self.expiries = [(max(lease[1] for lease in leases), address) 
+                         for address, leases in self.hosts.items()]
+        heapq.heapify(self.expiries)
+
+    def find(self, address, ts):
+        """
+            the lease of the address valid at ts
+
+        Returns:
+            _list_: _[start, expiry, host name, MAC], None if there is none_
+        """
+        leases = self.hosts.get(address)
+        if leases is None:
+            return None
+        for lease in reversed(leases):
+            if lease[0] <= ts < lease[1]:
+                return lease
+        return None
+
+    def evict(self):
+        """
+            drop the leases that expired before the watermark and the grace time
+
+        Returns:
+            _int_: _addresses removed_
+        """
+        removed = 0
+        limit = self.watermark - self.grace
+        while self.expiries and self.expiries[0][0] < limit:
+            _, address = heapq.heappop(self.expiries)
+            leases = self.hosts.get(address)
+            if leases is None:
+                continue
+            # a renewed lease has a later entry in the heap
+            leases[:] = [lease for lease in leases if lease[1] >= limit]
+            if not leases:
+                del self.hosts[address]
+                removed += 1
+        return removed
+
+    def snapshot(self):
+        return {"version": DHCP_SNAPSHOT_VERSION, "watermark": self.watermark,
+                "hosts": self.hosts}
+
+    def restore(self, content):
+        """
+            leases from a snapshot, in the saved order
+        """
+        if content.get("version") != DHCP_SNAPSHOT_VERSION:
+            return
+        self.watermark = float(content.get("watermark", 0))
+        for address, leases in content.get("hosts", {}).items():
+            self.hosts[address] = [list(lease) for lease in leases]
+        while len(self.hosts) > self.max_hosts:
+            self.hosts.popitem(last=False)
+        self.rebuild()
+
+
+def get_lease(record):
+    """
+        lease of a Zeek dhcp.log record - Zeek 3+ (assigned_addr) or 2.x (assigned_ip)
+
+    Returns:
+        _tuple_: _address, start, lease time, host name and MAC, None without a lease_
+    """
+    address = record.get("assigned_addr") or record.get("assigned_ip")
+    start = to_epoch(record.get("ts"))
+    if not isinstance(address, str) or address in ("-", "0.0.0.0") or start is None:
+        return None
+    lease_time = to_epoch(record.get("lease_time"))
+    host_name = record.get("host_name") or record.get("client_fqdn")
+    host_name = host_name if isinstance(host_name, str) and host_name != "-" else None
+    mac = record.get("mac")
+    mac = mac if isinstance(mac, str) and mac != "-" else None
+    return address, start, lease_time or DHCP_DEFAULT_LEASE, host_name, mac
+
+
+class DHCPJoinStage:
+    def __init__(self, snapshot=DHCP_SNAPSHOT_FILE, max_hosts=DHCP_MAX_HOSTS, 
+                 fields=DHCP_JOIN_FIELDS):
+        """
+            leases from the *_dhcp batches, host names for the *_conn batches
+        """
+        self.index = LeaseIndex(max_hosts)
+        self.fields = fields
+        self.snapshot_path = snapshot
+        self.last_snapshot = time.monotonic()
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if self.snapshot_path is None:
+            return
+        try:
+            with open(self.snapshot_path, "rb") as file:
+                self.index.restore(json.loads(file.read()))
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError, TypeError, IndexError) as err:
+            print(f'[ERROR] Ignoring the broken DHCP snapshot "{self.snapshot_path}" - {err}',
+                  flush=True)
+
+    def save(self):
+        """
+            write the leases - atomic like the checkpoint
+        """
+        if self.snapshot_path is None or not self.changed:
+            return
+        write_atomic(self.snapshot_path, 
+                     json.dumps(self.index.snapshot(), separators=(',', ':')).encode('utf-8'))
+        self.changed = False
+        self.last_snapshot = time.monotonic()
+
+    def add_leases(self, documents):
+        for _, record in iter_records(documents):
+            lease = get_lease(record)
+            if lease is not None:
+                self.index.add(*lease)
+                self.changed = True
+
+    def tag(self, documents):
+        find = self.index.find
+        for pos, record in iter_records(documents):
+            ts = to_epoch(record.get("ts"))
+            if ts is None:
+                continue
+            added = None
+            for field, target in self.fields:
+                lease = find(record.get(field), ts)
+                if lease is None:
+                    continue
+                values = {"host_name": lease[2]} if lease[2] else {}
+                if lease[3]:
+                    values["mac"] = lease[3]
+                if values:
+                    added = added or {}
+                    added[target] = values
+            if added:
+                get_record(documents, pos).update(added)
+
+    def process(self, index, documents):
+        if index.endswith(DHCP_INDEX_SUFFIX):
+            self.add_leases(documents)
+            if self.index.evict():
+                self.changed = True
+        elif index.endswith(CONN_INDEX_SUFFIX):
+            self.tag(documents)
+        if time.monotonic() - self.last_snapshot >= DHCP_SNAPSHOT_SECONDS:
+            self.save()
+        return documents
+
+    def close(self):
+        self.save()
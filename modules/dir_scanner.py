@@ -0,0 +1,139 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Incremental directory scanner for the polling mode.
+# os.scandir with a stat cache - (size, mtime_ns, inode) per file and
+# mtime per directory - so only changed files are handed to the readers.
+# Directories whose mtime did not change are not listed again - their files
+# are stat'ed every cycle, quiet files too (notice.log, alerts), since a
+# stat is cheap next to listing a directory.
+# Dependency: os
+
+
+import os
+import stat as stat_module
+
+
+# every N-th scan lists every directory
+SCAN_FULL_EVERY = 30
+
+
+class DirScanner:
+    def __init__(self, root, full_scan_every=SCAN_FULL_EVERY):
+        """
+            stat cache of the files under the root directory
+        """
+        self.root = root
+        self.full_scan_every = max(1, full_scan_every)
+        # path to (size, mtime_ns, inode)
+        self.files = {}
+        # directory to (mtime_ns, sub directories, file names)
+        self.dirs = {}
+        self.cycle = 0
+
+    def check_file(self, path, stat, changed):
+        signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if self.files.get(path) != signature:
+            self.files[path] = signature
+            changed.append((path, stat))
+
+    def forget(self, directory, names):
+        for name in names:
+            path = os.path.join(directory, name)
+            self.files.pop(path, None)
+
+    def list_directory(self, directory, dir_stat, changed):
+        """
+            list the directory with os.scandir and stat its files
+
+        Returns:
+            _list_: _sub directories_
+        """
+        subdirs = []
+        names = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file():
+                            names.append(entry.name)
+                            self.check_file(entry.path, entry.stat(), changed)
+                    except OSError:
+                        # removed while listing
+                        continue
+        except OSError:
+            return []
+        cached = self.dirs.get(directory)
+        if cached is not None:
+            self.forget(directory, set(cached[2]) - set(names))
+            for subdir in set(cached[1]) - set(subdirs):
+                self.drop_tree(subdir)
+        self.dirs[directory] = (dir_stat.st_mtime_ns, subdirs, names)
+        return subdirs
+
+    def drop_tree(self, directory):
+        cached = self.dirs.pop(directory, None)
+        if cached is None:
+            return
+        self.forget(directory, cached[2])
+        for subdir in cached[1]:
+            self.drop_tree(subdir)
+
+    def scan(self, full=False):
+        """
+            one scan cycle
+
+        Args:
+            full (_bool_): _list every directory_
+
+        Returns:
+            _list_: _(file path, os.stat_result) of the new or changed files_
+        """
+        full = full or self.cycle % self.full_scan_every == 0
+        self.cycle += 1
+        changed = []
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_stat = os.stat(directory)
+            except OSError:
+                self.drop_tree(directory)
+                continue
+            if not stat_module.S_ISDIR(dir_stat.st_mode):
+                continue
+            cached = self.dirs.get(directory)
+            if full or cached is None or cached[0] != dir_stat.st_mtime_ns:
+                stack.extend(self.list_directory(directory, dir_stat, changed))
+                continue
+            # same entries - a stat per file finds the appends
+            stack.extend(cached[1])
+            for name in cached[2]:
+                path = os.path.join(directory, name)
+                try:
+                    self.check_file(path, os.stat(path), changed)
+                except OSError:
+                    continue
+        changed.sort()
+        return changed
@@ -0,0 +1,84 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# File identity for the position tracking.
+# A file is the same file while (st_dev, st_ino) and the head bytes match,
+# whatever its name is - rotation renames it, truncation shrinks it.
+# Dependency: hashlib, os
+
+
+import hashlib
+import os
+
+
+# head bytes for the fingerprint
+FINGERPRINT_BYTES = 256
+
+
+def get_fingerprint(filepath, length=FINGERPRINT_BYTES):
+    """
+        digest of the first bytes of the file
+
+    Args:
+        filepath (_str_): _full path and name_
+        length (_int_): _head bytes to read_
+
+    Returns:
+        _tuple_: _hex digest and the number of bytes read_
+    """
+    with open(filepath, "rb") as file:
+        head = file.read(length)
+    return hashlib.blake2b(head, digest_size=8).hexdigest(), len(head)
+
+
+def get_file_identity(filepath, stat=None):
+    """
+        identity of the file - device, inode, size and head fingerprint
+
+    Args:
+        filepath (_str_): _full path and name_
+        stat (_os.stat_result_): _stat of the file if it's known_
+
+    Returns:
+        _dict_: _dev, ino, size, fp and fp_len_
+    """
+    stat = os.stat(filepath) if stat is None else stat
+    fingerprint, length = get_fingerprint(filepath)
+    return {"dev": stat.st_dev, "ino": stat.st_ino, "size": stat.st_size,
+            "fp": fingerprint, "fp_len": length}
+
+
+def is_same_content(identity, filepath):
+    """
+        True if the head of the file still matches the fingerprint
+
+    Args:
+        identity (_dict_): _identity from get_file_identity_
+        filepath (_str_): _full path and name_
+    """
+    if not identity or "fp" not in identity:
+        return True
+    try:
+        fingerprint, length = get_fingerprint(filepath, identity.get("fp_len", 0))
+    except OSError:
+        return False
+    return length == identity.get("fp_len", 0) and fingerprint == identity["fp"]
@@ -0,0 +1,156 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Fair scheduler for the files with new data.
+# Every active file gets a byte and record budget per round, files are
+# served by priority lane (index patterns - alerts and notices first) and
+# then round-robin, so one large backlog cannot hold back the others.
+# The bytes read and not yet shipped (in flight to the SIEM until it takes
+# them) are bounded across all files.
+# Dependency: fnmatch, threading
+
+
+import fnmatch
+import threading
+
+
+# budget of one file per round
+SCHEDULE_ROUND_BYTES = 8 * 1024 * 1024
+SCHEDULE_ROUND_RECORDS = 20000
+# bytes read and not yet shipped across all files
+SCHEDULE_MEMORY_BYTES = 256 * 1024 * 1024
+# index patterns per lane, lanes separated by ";" - the first lane goes first
+SCHEDULE_LANES = "zeek_notice*,zeek_intel*"
+
+# process_file results
+FILE_DONE = 0
+FILE_MORE = 1
+FILE_RETRY = 2
+
+
+def parse_lanes(value):
+    """
+        lanes from the option - ex. zeek_notice*,zeek_intel*;zeek_dns*
+
+    Args:
+        value (_str_): _index patterns, comma separated, lanes separated by ";"_
+
+    Returns:
+        _list_: _a list of index patterns per lane_
+    """
+    lanes = []
+    for lane in str(value).split(';'):
+        patterns = [pattern.strip() for pattern in lane.split(',') if pattern.strip()]
+        if patterns:
+            lanes.append(patterns)
+    return lanes
+
+
+class FileScheduler:
+    def __init__(self, lanes=None, round_bytes=SCHEDULE_ROUND_BYTES,
+                 round_records=SCHEDULE_ROUND_RECORDS, memory_bytes=SCHEDULE_MEMORY_BYTES):
+        """
+            active files by lane with a budget per round
+            files not in any lane go to the last lane
+        """
+        self.lanes = parse_lanes(SCHEDULE_LANES) if lanes is None else lanes
+        self.round_bytes = max(1, round_bytes)
+        self.round_records = max(1, round_records)
+        self.memory_bytes = max(1, memory_bytes)
+        # file path to [lane, stat, round of the last turn]
+        self.active = {}
+        self.index_lanes = {}
+        self.rounds = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def get_lane(self, index):
+        """
+            lane of the index, the first matching lane
+        """
+        lane = self.index_lanes.get(index)
+        if lane is None:
+            lane = len(self.lanes)
+            for number, patterns in enumerate(self.lanes):
+                if any(fnmatch.fnmatchcase(index, pattern) for pattern in patterns):
+                    lane = number
+                    break
+            self.index_lanes[index] = lane
+        return lane
+
+    def add(self, filepath, stat=None, index=""):
+        """
+            a file with new data - it stays active until it's read to the end
+
+        Args:
+            filepath (_str_): _full path and name_
+            stat (_os.stat_result_): _stat from the scanner, None if it's not known_
+            index (_str_): _index name of the file for the lane_
+        """
+        entry = self.active.get(filepath)
+        if entry is None:
+            self.active[filepath] = [self.get_lane(index), stat, -1]
+        else:
+            entry[1] = stat
+
+    def next_round(self):
+        """
+            the active files in the serving order of one round
+            lane first, then the file served the longest time ago
+
+        Returns:
+            _list_: _(file path, stat) of the round_
+        """
+        self.rounds += 1
+        order = sorted(self.active.items(), key=lambda item: (item[1][0], item[1][2], item[0]))
+        turns = []
+        for filepath, entry in order:
+            turns.append((filepath, entry[1]))
+            entry[2] = self.rounds
+            # a stat from the scanner is stale after the turn
+            entry[1] = None
+        return turns
+
+    def done(self, filepath):
+        self.active.pop(filepath, None)
+
+    def has_backlog(self):
+        return len(self.active) > 0
+
+    def reserve(self, size):
+        """
+            bytes to read now within the memory bound
+
+        Args:
+            size (_int_): _bytes the reader wants_
+
+        Returns:
+            _int_: _bytes granted, 0 if the bound is reached_
+        """
+        with self.lock:
+            granted = max(0, min(size, self.memory_bytes - self.in_flight))
+            self.in_flight += granted
+            return granted
+
+    def release(self, size):
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - size)
@@ -23,6 +23,67 @@
 import os
 import re
 import sys
+from modules.json_load import BULK_MAX_DOCS
+from modules.json_load import BULK_MAX_BYTES
+from modules.json_load import BULK_MAX_RETRIES
+from modules.bulk_sink import BULK_WORKERS
+from modules.stream_reader import READ_MAX_BYTES
+from modules.stream_reader import READ_MAX_RECORDS
+from modules.file_identity import FINGERPRINT_BYTES
+from modules.file_identity import get_file_identity
+from modules.file_identity import is_same_content
+from modules.reader_plan import PlanCache
+from modules.csv_reader import CSV_TYPES
+from modules.stages import StagePipeline
+from modules.gzip_stream import GzipIndex
+from modules.gzip_stream import is_gzip
+from modules.handle_pool import HandlePool
+from modules.handle_pool import HANDLE_POOL_MAX
+from modules.file_scheduler import FileScheduler
+from modules.file_scheduler import parse_lanes
+from modules.file_scheduler import SCHEDULE_LANES
+from modules.file_scheduler import SCHEDULE_ROUND_BYTES
+from modules.file_scheduler import SCHEDULE_ROUND_RECORDS
+from modules.file_scheduler import SCHEDULE_MEMORY_BYTES
+
+
+# rotated files waiting to be seen under their new name
+ROTATED_MAX = 10000
+
+
+def get_arguments(argv=None):
+    """
+        positional arguments without the options (--name=value or --flag)
+
+    Args:
+        argv (_list_): _arguments, sys.argv by default_
+
+    Returns:
+        _list_: _positional arguments_
+    """
+    argv = sys.argv if argv is None else argv
+    return [arg for arg in argv if not arg.startswith("--")]
+
+
+def get_option(name, default=None, argv=None):
+    """
+        option value from --name=value, or True for --name
+
+    Args:
+        name (_str_): _option name without dashes_
+        default (_any_): _value if the option is not given_
+        argv (_list_): _arguments, sys.argv by default_
+
+    Returns:
+        _str_: _option value_
+    """
+    argv = sys.argv if argv is None else argv
+    for arg in argv:
+        if arg == "--" + name:
+            return True
+        if arg.startswith("--" + name + "="):
+            return arg.split("=", 1)[1]
+    return default
 
 
 class Locator:
@@ -30,13 +91,59 @@ class Locator:
         """
             Locator is to track the variables and file IO to send data accurately
         """
+        args = get_arguments()
         # <directory> is madatory
-        self.dirlocator = sys.argv[1] if len(sys.argv) > 1 else arg_one
+        self.dirlocator = args[1] if len(args) > 1 else arg_one
         # <Interval> is optional
-        self.interval = int(sys.argv[2]) if len(sys.argv) > 2 else arg_two
+        self.interval = int(args[2]) if len(args) > 2 else int(arg_two)
         # <dest option> is optional, then but please add the interval
-        self.dest_opt = int(sys.argv[3]) if len(sys.argv) > 3 else arg_three
+        self.dest_opt = int(args[3]) if len(args) > 3 else arg_three
+        # _bulk request limits and retries
+        self.bulk_max_docs = int(get_option("bulk-docs", BULK_MAX_DOCS))
+        self.bulk_max_bytes = int(get_option("bulk-bytes", BULK_MAX_BYTES))
+        self.bulk_max_retries = int(get_option("bulk-retries", BULK_MAX_RETRIES))
+        # concurrent _bulk requests (AIMD upper limit)
+        self.bulk_workers = int(get_option("bulk-workers", BULK_WORKERS))
+        self.sink = None
+        # bounded reads per file and call
+        self.read_max_bytes = int(get_option("read-bytes", READ_MAX_BYTES))
+        self.read_max_records = int(get_option("read-records", READ_MAX_RECORDS))
+        # auto (inotify if available), inotify or poll
+        self.watch_mode = get_option("watch", "auto")
         self.fileposition = {}
+        # on-disk positions (CheckpointStore), None keeps them in memory only
+        self.checkpoint = None
+        # the forwarder's own files (checkpoint, DHCP leases, OUI table) - never shipped
+        self.state_files = set()
+        # file identity - path to identity, (dev, ino) to path
+        self.fileidentity = {}
+        self.inodes = {}
+        # (dev, ino) of rotated files to their position and identity
+        self.rotated = {}
+        self.checkpoint_inodes = {}
+        # reader plans (format and header) by (dev, ino)
+        self.plans = PlanCache(typed=get_option("zeek-types", "on") != "off",
+                               time_format=get_option("zeek-time", "epoch"),
+                               passthrough=get_option("passthrough", False) is True,
+                               csv_types=get_option("csv-types", CSV_TYPES),
+                               compact=get_option("compact-rows", False) is True)
+        # seek points of gzip archives - positions are uncompressed offsets
+        self.gzindex = GzipIndex()
+        # tail-follow - open handles of the growing files, None to open per read
+        self.handles = None
+        if get_option("follow", False) is True:
+            self.handles = HandlePool(int(get_option("follow-handles", HANDLE_POOL_MAX)))
+        # budget per file and round, priority lanes by index pattern
+        self.scheduler = FileScheduler(parse_lanes(get_option("lanes", SCHEDULE_LANES)),
+                                       int(get_option("round-bytes", SCHEDULE_ROUND_BYTES)),
+                                       int(get_option("round-records", SCHEDULE_ROUND_RECORDS)),
+                                       int(get_option("memory-bytes", SCHEDULE_MEMORY_BYTES)))
+        # worker processes of the backfill mode
+        self.backfill_workers = int(get_option("backfill-workers", os.cpu_count() or 1))
+        # disk spool between the readers and the SIEM (Spool), None to send directly
+        self.spool = None
+        # enrichment stages applied to every batch before it is shipped
+        self.stages = StagePipeline()
         self.client = None
         # current values
         self.index = ""
@@ -58,9 +165,15 @@ class Locator:
         self.filename = filename
         self.root = root
         filepath = os.path.join(root, filename)
+        # the index follows the current file
+        self.set_index(root, filename)
         if filepath not in self.fileposition:
-            self.set_index(root, filename)
-            self.fileposition[filepath] = 0
+            pointer = 0
+            # resume from the last committed position
+            if self.checkpoint is not None:
+                pointer = self.checkpoint.get(filepath, 0)
+                self.load_gz_point(filepath, pointer)
+            self.fileposition[filepath] = pointer
         return filepath
 
     def is_filepath_in_position(self, filepath):
@@ -69,6 +182,177 @@ class Locator:
 
     def set_filelocator(self, filepath, pointer):
         self.fileposition[filepath] = pointer
+        if self.checkpoint is not None:
+            identity = self.fileidentity.get(filepath, {})
+            meta = {key: identity[key] for key in ("dev", "ino", "fp", "fp_len") 
+                    if key in identity}
+            # gzip - the member boundary to resume from after a restart
+            if is_gzip(filepath):
+                meta["gz"] = self.gzindex.member_point(filepath, pointer)
+            self.checkpoint.update(filepath, pointer, **meta)
+
+    def load_gz_point(self, filepath, pointer):
+        """
+            seek point of a gzip file from the checkpoint
+        Args:
+            filepath (_str_): _full path and name_
+            pointer (_int_): _committed position_
+        """
+        entry = self.checkpoint.get_entry(filepath)
+        if not is_gzip(filepath) or entry is None or not entry.get("gz") or "ino" not in entry:
+            return
+        in_offset, out_offset = entry["gz"]
+        if out_offset <= pointer:
+            self.gzindex.add_member(filepath, (entry["dev"], entry["ino"]), in_offset, out_offset)
+
+    def set_checkpoint(self, checkpoint):
+        """
+            keep the committed positions in the checkpoint store
+        Args:
+            checkpoint (_CheckpointStore_): _store loaded at start up_
+        """
+        self.checkpoint = checkpoint
+        self.add_state_file(checkpoint.filepath)
+        # files rotated while the forwarder was down are found by inode
+        self.checkpoint_inodes = {(entry["dev"], entry["ino"]): path 
+                                  for path, entry in checkpoint.entries.items() 
+                                  if "ino" in entry}
+
+    def track_file(self, filepath, stat=None):
+        """
+            follow the file by (st_dev, st_ino) and the head fingerprint
+            a rotated file continues from its position under the new name,
+            a truncated or replaced file starts from 0
+        Args:
+            filepath (_str_): _full path and name from set_filepath_
+            stat (_os.stat_result_): _stat of the file if it's known_
+
+        Returns:
+            _int_: _position to read from_
+        """
+        pointer = self.fileposition.get(filepath, 0)
+        try:
+            stat = os.stat(filepath) if stat is None else stat
+        except OSError:
+            return pointer
+        key = (stat.st_dev, stat.st_ino)
+        known = self.fileidentity.get(filepath)
+        # gzip positions are uncompressed offsets - not comparable with the size
+        compressed = is_gzip(filepath)
+        if known is not None and (known["dev"], known["ino"]) == key:
+            # same file - size going backwards is a truncation
+            if stat.st_size < known["size"] or (not compressed and stat.st_size < pointer):
+                print(f'[INFO] "{filepath}" was truncated; reading from the start', flush=True)
+                pointer = 0 if pointer != -1 else pointer
+                self.plans.invalidate(key)
+                self.gzindex.invalidate(filepath)
+                known = None
+            elif known["fp_len"] < FINGERPRINT_BYTES and stat.st_size > known["fp_len"]:
+                # the fingerprint grows with a small file
+                if not is_same_content(known, filepath):
+                    pointer = 0 if pointer != -1 else pointer
+                    self.plans.invalidate(key)
+                    self.gzindex.invalidate(filepath)
+                known = None
+            else:
+                known["size"] = stat.st_size
+        else:
+            if known is not None:
+                # the path holds a new file - the old one was rotated away
+                self.stash_rotated(known, pointer)
+                pointer = 0
+            elif self.checkpoint is not None:
+                entry = self.checkpoint.get_entry(filepath)
+                # positions saved without an identity are kept as they are
+                if entry is not None and "ino" in entry:
+                    if (entry["dev"], entry["ino"]) != key:
+                        # replaced while the forwarder was down
+                        self.stash_rotated(dict(entry), entry.get("pos", 0))
+                    pointer = 0
+            source = self.find_previous(filepath, key)
+            if source is not None:
+                position, identity = source
+                if position == -1 or ((compressed or stat.st_size >= position) and \
+                                      is_same_content(identity, filepath)):
+                    pointer = position
+                else:
+                    pointer = 0
+            known = None
+        if known is None:
+            # a new, replaced or truncated file - the open handle is not valid
+            if self.handles is not None:
+                self.handles.close(filepath)
+            try:
+                known = get_file_identity(filepath, stat)
+            except OSError:
+                return pointer
+            self.fileidentity[filepath] = known
+            self.inodes[key] = filepath
+            # a new identity or a moved position is committed with the next flush
+            self.set_filelocator(filepath, pointer)
+            return pointer
+        self.fileposition[filepath] = pointer
+        return pointer
+
+    def stash_rotated(self, identity, pointer):
+        """
+            keep the position of a file that left its name
+        Args:
+            identity (_dict_): _identity of the old file_
+            pointer (_int_): _position of the old file_
+        """
+        old_key = (identity["dev"], identity["ino"])
+        self.rotated[old_key] = (pointer, identity)
+        self.inodes.pop(old_key, None)
+        self.checkpoint_inodes.pop(old_key, None)
+        if len(self.rotated) > ROTATED_MAX:
+            self.rotated.pop(next(iter(self.rotated)))
+
+    def get_plan(self, filepath):
+        """
+            reader plan of the file, cached by its identity
+        Args:
+            filepath (_str_): _full path and name from track_file_
+
+        Returns:
+            _ReaderPlan_: _format and header of the file_
+        """
+        identity = self.fileidentity.get(filepath)
+        key = None if identity is None else (identity["dev"], identity["ino"])
+        return self.plans.get(filepath, key)
+
+    def find_previous(self, filepath, key):
+        """
+            position and identity of the file seen before under any name
+        Args:
+            filepath (_str_): _current name_
+            key (_tuple_): _(st_dev, st_ino)_
+
+        Returns:
+            _tuple_: _position and identity, or None for a new file_
+        """
+        if key in self.rotated:
+            return self.rotated.pop(key)
+        old_path = self.inodes.get(key)
+        if old_path is not None and old_path != filepath:
+            # renamed before the old name was looked at again
+            del self.inodes[key]
+            identity = self.fileidentity.pop(old_path, None)
+            position = self.fileposition.pop(old_path, 0)
+            if self.checkpoint is not None:
+                self.checkpoint.remove(old_path)
+            return position, identity
+        entry_path = self.checkpoint_inodes.pop(key, None)
+        if entry_path is not None and self.checkpoint is not None:
+            entry = self.checkpoint.get_entry(entry_path)
+            # the old name may be committed with a new file already
+            if entry is None or (entry.get("dev"), entry.get("ino")) != key:
+                return None
+            if entry_path != filepath:
+                # rotated while the forwarder was down
+                self.checkpoint.remove(entry_path)
+            return entry.get("pos", 0), entry
+        return None
 
     def set_client(self, client):
         if isinstance(Locator, client):
@@ -109,8 +393,25 @@ class Locator:
     def get_index(self):
         return self.index
 
+    def add_state_file(self, filepath):
+        """
+            a file the forwarder writes - skipped if it's under the directory
+            (the temp files of the atomic writes start with a dot)
+        """
+        self.state_files.add(os.path.abspath(filepath))
+
     def skip_file(self, root, filename):
         filepath = os.path.join(root, filename)
+        # the forwarder's own state files and spool under the directory
+        if os.path.abspath(filepath) in self.state_files:
+            if filepath not in self.fileposition:
+                self.fileposition[filepath] = -1
+            return True
+        if self.spool is not None and \
+           os.path.abspath(root) == os.path.abspath(self.spool.directory):
+            if filepath not in self.fileposition:
+                self.fileposition[filepath] = -1
+            return True
         # custom skip for zeek or suricata
         if filename.lower().endswith(".db") or\
            filename.lower().endswith(".sh") or\
@@ -143,11 +444,12 @@ def validate_args():
     '''
     Argument validation and helper
     '''
-    if len(sys.argv) < 2:
+    args = get_arguments()
+    if len(args) < 2:
         print("[USAGE] python3 horang_forwarder.py <directory> [<interval>] [<dest option>]")
         return False
     
-    if sys.argv[1] == "-h" or sys.argv[1] == "help":
+    if args[1] == "-h" or args[1] == "help":
         print("[USAGE] python3 horang_forwarder.py <directory> [<interval>] [<dest option>]")
         print("1. <directory> is madatory")
         print(" Please define the directory to load data")
@@ -160,10 +462,45 @@ def validate_args():
         print(" Destination option, such as ELK or other SIEM")
         print(" option 1 == ELK")
         print(" ELK is default as the SIEM")
+        print("4. [<options>] are optional")
+        print(" --bulk-docs=1000      maximum documents per _bulk request")
+        print(" --bulk-bytes=5242880  maximum body size (bytes) per _bulk request")
+        print(" --bulk-retries=3      retries for rejected documents only")
+        print(" --bulk-workers=4      maximum _bulk requests in flight")
+        print(" --checkpoint=horang_checkpoint.json  file positions kept across restarts")
+        print(" --watch=auto          inotify (Linux) or poll - auto uses inotify if available")
+        print(" --read-bytes=67108864 maximum bytes read from a file at the time")
+        print(" --read-records=100000 maximum records read from a file at the time")
+        print(" --zeek-types=on       Zeek TSV columns typed by #types (off: strings)")
+        print(" --zeek-time=epoch     Zeek time fields as epoch or iso (with @timestamp)")
+        print(" --csv-types=off       CSV columns as strings, auto (typed from the head rows) or name:type")
+        print(" --compact-rows        TSV/CSV rows kept as tuples of one schema per file, not dicts")
+        print(" --passthrough         NDJSON lines sent as they are, without JSON decoding")
+        print(" --json-backend=auto   orjson, simdjson or stdlib - auto picks the fastest installed")
+        print(" --follow              keep growing files open and read on from the handle")
+        print(" --follow-handles=256  open handles at the time in the tail-follow mode")
+        print(" --lanes=zeek_notice*,zeek_intel*  index patterns read first (lanes by ;)")
+        print(" --round-bytes=8388608 bytes read from a file per round before the next file")
+        print(" --round-records=20000 records read from a file per round before the next file")
+        print(" --memory-bytes=268435456  bytes read and not yet shipped across the files")
+        print(" --geoip=GeoLite2-City.mmdb,GeoLite2-ASN.mmdb  geo/AS fields from .mmdb or .csv databases")
+        print(" --geoip-locations=GeoLite2-City-Locations-en.csv  names for the CSV blocks files")
+        print(" --geoip-cache=65536   recent addresses cached by the GeoIP stage")
+        print(" --dhcp-join=horang_dhcp.json  DHCP host names added to conn.log, leases kept in the file")
+        print(" --dhcp-hosts=100000   addresses kept by the DHCP join")
+        print(" --oui=oui.csv,mam.csv,oui36.csv  MAC vendor fields from the IEEE registry files")
+        print(" --oui-table=horang_oui.bin  compiled prefix table of --oui")
+        print(" --intel=ips.txt,domains.txt  IOC matches (IP/CIDR, domain, URL, hash) as threat_intel")
+        print(" --intel-reload=60     seconds between the checks for changed feeds, 0 to load once")
+        print(" --normalize=mapping.json  fields renamed/moved/cast per index, ECS addresses by default")
+        print(" --spool=horang_spool  batches written to a disk spool and sent by a background sender")
+        print(" --spool-bytes=1073741824  undelivered spool bytes before the readers wait")
+        print(" --backfill            load the archives (.log, .log.gz, .json) once and exit")
+        print(" --backfill-workers=N  worker processes of the backfill, the core count by default")
         return False
     
-    if os.path.exists(sys.argv[1]) and os.path.isdir(sys.argv[1]):
+    if os.path.exists(args[1]) and os.path.isdir(args[1]):
         return True
     else:
-        print(f"The directory '{sys.argv[1]}' does not exist.")
+        print(f"The directory '{args[1]}' does not exist.")
         return False
\ No newline at end of file
@@ -0,0 +1,341 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# GeoIP/ASN enrichment stage - geo and AS fields for the addresses of the
+# records (Zeek id.orig_h/id.resp_h, Suricata src_ip/dest_ip).
+# CSV databases (MaxMind GeoLite2 blocks, with the locations file for the
+# names) are loaded into sorted interval arrays and searched with bisect;
+# MMDB files are searched with the maxminddb reader (its own binary trie).
+# Recent addresses are answered from a bounded LRU cache.
+# Dependency: bisect, csv, ipaddress, socket, [optional] maxminddb
+
+
+import csv
+import ipaddress
+import socket
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from modules.stages import get_record
+from modules.stages import iter_records
+
+
+# address field and the field added with its geo/AS values
+GEOIP_FIELDS = (("id.orig_h", "orig_geo"), ("id.resp_h", "resp_geo"),
+                ("src_ip", "src_geo"), ("dest_ip", "dest_geo"))
+# recent addresses and their results
+GEOIP_CACHE = 65536
+# CSV columns kept and their names - latitude and longitude go to location
+GEOIP_CSV_COLUMNS = {"country_iso_code": "country_iso_code", "country_name": "country_name",
+                     "city_name": "city_name", "continent_code": "continent_code",
+                     "subdivision_1_name": "region_name", "postal_code": "postal_code",
+                     "time_zone": "time_zone", "asn": "asn", "as_org": "as_org",
+                     "autonomous_system_number": "asn",
+                     "autonomous_system_organization": "as_org"}
+
+
+def parse_ip(address):
+    """
+        IP version and integer of an address - strict, no short IPv4 forms
+
+    Returns:
+        _tuple_: _version (4 or 6) and integer, None if it's not an address_
+    """
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except (OSError, TypeError):
+        pass
+    try:
+        # zone index - ex. fe80::1%eth0
+        address = address.split('%', 1)[0]
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+    except (OSError, TypeError, AttributeError, ValueError):
+        return None
+
+
+def parse_network(network):
+    """
+        first and last address of a CIDR network - ex. 1.0.0.0/24
+
+    Returns:
+        _tuple_: _version, first and last (integers), None if it's not a network_
+    """
+    address, _, prefix = network.strip().partition('/')
+    parsed = parse_ip(address)
+    if parsed is None:
+        return None
+    version, ip = parsed
+    bits = 32 if version == 4 else 128
+    try:
+        prefix = int(prefix) if prefix else bits
+    except ValueError:
+        return None
+    if not 0 <= prefix <= bits:
+        return None
+    host = (1 << (bits - prefix)) - 1
+    return version, ip & ~host, (ip & ~host) | host
+
+
+class NetworkIndex:
+    def __init__(self):
+        """
+            sorted, non-overlapping address intervals per IP version
+            a value is shared by the intervals with the same values
+        """
+        self.starts = {4: array('Q'), 6: []}
+        self.ends = {4: array('Q'), 6: []}
+        self.values = {4: [], 6: []}
+
+    def build(self, networks):
+        """
+            index the networks
+
+        Args:
+            networks (_iterable_): _network (CIDR) and its values (dict)_
+
+        Returns:
+            _NetworkIndex_: _self_
+        """
+        intervals = {4: [], 6: []}
+        for network, values in networks:
+            parsed = parse_network(network)
+            if parsed is not None:
+                intervals[parsed[0]].append((parsed[1], parsed[2], values))
+        for version, items in intervals.items():
+            items.sort(key=lambda item: item[0])
+            self.starts[version].extend(item[0] for item in items)
+            self.ends[version].extend(item[1] for item in items)
+            self.values[version] = [item[2] for item in items]
+        return self
+
+    def __len__(self):
+        return len(self.values[4]) + len(self.values[6])
+
+    def lookup(self, version, ip):
+        """
+            values of the network with the address, None if there is none
+        """
+        pos = bisect_right(self.starts[version], ip) - 1
+        if pos >= 0 and ip <= self.ends[version][pos]:
+            return self.values[version][pos]
+        return None
+
+
+def read_locations(filepath):
+    """
+        GeoLite2 locations CSV - geoname_id to the names
+    """
+    locations = {}
+    with open(filepath, newline='', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            values = {GEOIP_CSV_COLUMNS[name]: value for name, value in row.items() 
+                      if name in GEOIP_CSV_COLUMNS and value}
+            locations[row.get("geoname_id", "")] = values
+    return locations
+
+
+def get_csv_values(row, columns, names, location, locations):
+    """
+        values of one blocks CSV row - names by geoname_id, latitude and longitude as location
+    """
+    values = {}
+    for pos in names:
+        if row[pos]:
+            values.update(locations.get(row[pos], {}))
+            break
+    for pos, name in columns:
+        if row[pos]:
+            values[name] = row[pos]
+    if "asn" in values:
+        values["asn"] = int(values["asn"])
+    if len(location) == 2 and row[location[0]] and row[location[1]]:
+        values["location"] = {"lat": float(row[location[0]]), "lon": float(row[location[1]])}
+    return values
+
+
+def iter_csv_networks(filepath, locations=None):
+    """
+        networks and their values of a CSV database (network column first)
+
+    Args:
+        filepath (_str_): _blocks CSV - ex. GeoLite2-ASN-Blocks-IPv4.csv_
+        locations (_dict_): _geoname_id to the names, from read_locations_
+
+    Yields:
+        _tuple_: _network and values (dict)_
+    """
+    with open(filepath, newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        positions = {name: pos for pos, name in enumerate(header)}
+        if "network" not in positions:
+            raise ValueError(f"no network column in '{filepath}'")
+        network = positions["network"]
+        columns = [(pos, GEOIP_CSV_COLUMNS[name]) for pos, name in enumerate(header) 
+                   if name in GEOIP_CSV_COLUMNS]
+        names = [positions[name] for name in ("geoname_id", "registered_country_geoname_id") 
+                 if name in positions and locations is not None]
+        location = [positions[name] for name in ("latitude", "longitude") if name in positions]
+        keys = [pos for pos, _ in columns] + names + location
+        # one dict per distinct value set - ex. per city or per AS
+        shared = {}
+        for row in reader:
+            try:
+                key = tuple([row[pos] for pos in keys])
+            except IndexError:
+                continue
+            values = shared.get(key)
+            if values is None:
+                values = shared[key] = get_csv_values(row, columns, names, location, locations)
+            if values:
+                yield row[network], values
+
+
+def flatten_mmdb(record):
+    """
+        the fields of a MaxMind record (City, Country or ASN database)
+    """
+    values = {}
+    if not isinstance(record, dict):
+        return values
+    country = record.get("country") or record.get("registered_country") or {}
+    if country.get("iso_code"):
+        values["country_iso_code"] = country["iso_code"]
+    if country.get("names", {}).get("en"):
+        values["country_name"] = country["names"]["en"]
+    if record.get("continent", {}).get("code"):
+        values["continent_code"] = record["continent"]["code"]
+    if record.get("city", {}).get("names", {}).get("en"):
+        values["city_name"] = record["city"]["names"]["en"]
+    location = record.get("location", {})
+    if "latitude" in location and "longitude" in location:
+        values["location"] = {"lat": location["latitude"], "lon": location["longitude"]}
+    if "autonomous_system_number" in record:
+        values["asn"] = record["autonomous_system_number"]
+    if record.get("autonomous_system_organization"):
+        values["as_org"] = record["autonomous_system_organization"]
+    return values
+
+
+class MMDBDatabase:
+    def __init__(self, filepath):
+        """
+            MaxMind DB file searched with the maxminddb reader
+        """
+        try:
+            import maxminddb
+        except ImportError:
+            raise ImportError("the maxminddb package is needed for .mmdb files "
+                              "(pip install maxminddb), or use the GeoLite2 CSV files")
+        self.reader = maxminddb.open_database(filepath)
+
+    def lookup(self, version, ip):
+        address = ipaddress.IPv4Address(ip) if version == 4 else ipaddress.IPv6Address(ip)
+        return flatten_mmdb(self.reader.get(address)) or None
+
+    def close(self):
+        self.reader.close()
+
+
+def open_database(filepath, locations=None):
+    """
+        MMDB file or CSV blocks file
+
+    Args:
+        filepath (_str_): _.mmdb or .csv_
+        locations (_str_): _GeoLite2 locations CSV for the names of a blocks CSV_
+
+    Returns:
+        _NetworkIndex or MMDBDatabase_: _database with lookup(version, ip)_
+    """
+    if filepath.lower().endswith(".mmdb"):
+        return MMDBDatabase(filepath)
+    names = read_locations(locations) if locations else None
+    return NetworkIndex().build(iter_csv_networks(filepath, names))
+
+
+class GeoIPStage:
+    def __init__(self, databases, fields=GEOIP_FIELDS, cache_size=GEOIP_CACHE):
+        """
+            geo/AS fields for the address fields of the records
+            the values of all databases are merged - ex. City and ASN
+        """
+        self.databases = list(databases)
+        self.fields = fields
+        # a miss (private address) is cached like a hit
+        self.lookup = lru_cache(maxsize=cache_size)(self.find)
+
+    def find(self, address):
+        """
+            geo/AS values of the address
+
+        Args:
+            address (_str_): _IPv4 or IPv6 address_
+
+        Returns:
+            _dict_: _values (shared, read only), None if no database has the address_
+        """
+        parsed = parse_ip(address)
+        if parsed is None:
+            return None
+        found = None
+        for database in self.databases:
+            values = database.lookup(*parsed)
+            if values:
+                found = values if found is None else {**found, **values}
+        return found
+
+    def process(self, index, documents):
+        lookup = self.lookup
+        for pos, record in iter_records(documents):
+            added = None
+            for field, target in self.fields:
+                address = record.get(field)
+                if address is None:
+                    continue
+                values = lookup(address) if isinstance(address, str) else None
+                if values is not None:
+                    added = added or {}
+                    # a copy per record - the cached values are shared
+                    added[target] = dict(values)
+            if added:
+                get_record(documents, pos).update(added)
+        return documents
+
+
+def make_geoip_stage(filepaths, locations=None, cache_size=GEOIP_CACHE):
+    """
+        GeoIP stage of the --geoip databases
+
+    Args:
+        filepaths (_str_): _comma separated .mmdb or .csv files_
+        locations (_str_): _GeoLite2 locations CSV for the names_
+        cache_size (_int_): _recent addresses cached_
+
+    Returns:
+        _GeoIPStage_: _stage for the pipeline_
+    """
+    if not isinstance(filepaths, str) or not filepaths.strip():
+        raise ValueError("--geoip needs the database files - ex. --geoip=GeoLite2-ASN.mmdb")
+    databases = [open_database(filepath.strip(), locations) 
+                 for filepath in filepaths.split(',') if filepath.strip()]
+    return GeoIPStage(databases, cache_size=cache_size)
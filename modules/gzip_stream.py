@@ -0,0 +1,256 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Streaming gzip reader - archives are decompressed with zlib in blocks of
+# GZIP_BLOCK_BYTES, without temp files and without reading the whole file.
+# Positions are uncompressed byte offsets. Seek points (compressed offset,
+# uncompressed offset) let a read resume near its position like zran:
+# a copy of the decompressor every block in memory, and member boundaries
+# (multi-member archives) that are kept in the checkpoint across restarts.
+# Dependency: os, zlib
+
+
+import bisect
+import os
+import zlib
+from collections import OrderedDict
+from collections import deque
+from itertools import chain
+from modules.stream_reader import BOM
+from modules.stream_reader import iter_chunk_lines
+
+
+# gzip header and trailer with a 32K window
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# compressed read size
+GZIP_READ_BYTES = 256 * 1024
+# decompressed bytes per step - one in-memory seek point per block
+GZIP_BLOCK_BYTES = 1024 * 1024
+# in-memory seek points per file (a decompressor copy is ~40KB)
+GZIP_RECENT_POINTS = 4
+# member boundaries per file
+GZIP_MEMBER_POINTS = 1024
+# files in the seek index
+GZIP_INDEX_MAX = 64
+
+
+def is_gzip(filepath):
+    return filepath.lower().endswith("gz")
+
+
+class GzipIndex:
+    def __init__(self, max_files=GZIP_INDEX_MAX, recent_points=GZIP_RECENT_POINTS):
+        """
+            seek points of gzip files by path, least recently used out
+            the points of a file are dropped when (st_dev, st_ino) changes
+        """
+        self.max_files = max_files
+        self.recent_points = recent_points
+        self.files = OrderedDict()
+
+    def get_entry(self, filepath, key):
+        entry = self.files.get(filepath)
+        if entry is None or entry["key"] != key:
+            entry = {"key": key, "members": [], "recent": deque(maxlen=self.recent_points)}
+            self.files[filepath] = entry
+            if len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+        self.files.move_to_end(filepath)
+        return entry
+
+    def add_member(self, filepath, key, in_offset, out_offset):
+        """
+            a member boundary - a new decompressor can start there
+        """
+        members = self.get_entry(filepath, key)["members"]
+        point = (in_offset, out_offset)
+        position = bisect.bisect_left(members, point)
+        if position < len(members) and members[position] == point:
+            return
+        members.insert(position, point)
+        if len(members) > GZIP_MEMBER_POINTS:
+            # every other point - the span doubles
+            members[:] = members[1::2]
+
+    def add_recent(self, filepath, key, in_offset, out_offset, decompressor):
+        """
+            a decompressor state in the middle of a member
+        """
+        self.get_entry(filepath, key)["recent"].append((in_offset, out_offset, decompressor))
+
+    def nearest(self, filepath, key, out_offset):
+        """
+            the last seek point at or before the position
+
+        Args:
+            filepath (_str_): _full path and name_
+            key (_tuple_): _(st_dev, st_ino) of the open file_
+            out_offset (_int_): _uncompressed position_
+
+        Returns:
+            _tuple_: _compressed offset, uncompressed offset, decompressor or None_
+        """
+        best = (0, 0, None)
+        entry = self.files.get(filepath)
+        if entry is None or entry["key"] != key:
+            return best
+        for in_offset, point in entry["members"]:
+            if point > out_offset:
+                break
+            best = (in_offset, point, None)
+        for in_offset, point, decompressor in entry["recent"]:
+            if best[1] < point <= out_offset:
+                best = (in_offset, point, decompressor)
+        return best
+
+    def member_point(self, filepath, out_offset):
+        """
+            the last member boundary at or before the position - saved in the checkpoint
+
+        Returns:
+            _list_: _compressed and uncompressed offsets, or None_
+        """
+        entry = self.files.get(filepath)
+        if entry is None:
+            return None
+        point = None
+        for in_offset, member in entry["members"]:
+            if member > out_offset:
+                break
+            point = [in_offset, member]
+        return point
+
+    def invalidate(self, filepath):
+        self.files.pop(filepath, None)
+
+
+class GzipStream:
+    def __init__(self, filepath, pointer=0, index=None):
+        """
+            decompressed bytes of a gzip file from an uncompressed position
+            complete is True once the last member ended at the end of the file
+        """
+        self.filepath = filepath
+        self.pointer = pointer
+        self.index = index
+        self.complete = False
+
+    def iter_blocks(self):
+        """
+            decompressed blocks from the pointer, constant memory
+
+        Yields:
+            _bytes_: _decompressed data_
+        """
+        with open(self.filepath, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            key = (stat.st_dev, stat.st_ino)
+            in_offset, out_offset, decompressor = (0, 0, None) if self.index is None else \
+                self.index.nearest(self.filepath, key, self.pointer)
+            # a new member - no input fed to the decompressor yet
+            fresh = decompressor is None
+            decompressor = zlib.decompressobj(GZIP_WBITS) if fresh else decompressor.copy()
+            file.seek(in_offset)
+            data = b''
+            last_point = out_offset
+            while True:
+                if not data:
+                    data = file.read(GZIP_READ_BYTES)
+                    if not data:
+                        # a clean end only between members
+                        self.complete = fresh
+                        return
+                if fresh:
+                    # zero padding after a member
+                    stripped = data.lstrip(b'\x00')
+                    in_offset += len(data) - len(stripped)
+                    data = stripped
+                    if not data:
+                        continue
+                if self.index is not None and not fresh and \
+                   out_offset - last_point >= GZIP_BLOCK_BYTES:
+                    self.index.add_recent(self.filepath, key, in_offset, out_offset,
+                                          decompressor.copy())
+                    last_point = out_offset
+                block = decompressor.decompress(data, GZIP_BLOCK_BYTES)
+                fresh = False
+                rest = decompressor.unused_data if decompressor.eof else \
+                       decompressor.unconsumed_tail
+                in_offset += len(data) - len(rest)
+                data = rest
+                if block:
+                    # the part before the pointer is only decompressed
+                    skip = self.pointer - out_offset
+                    out_offset += len(block)
+                    if skip < len(block):
+                        yield block[skip:] if skip > 0 else block
+                if decompressor.eof:
+                    if self.index is not None:
+                        self.index.add_member(self.filepath, key, in_offset, out_offset)
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+                    fresh = True
+
+
+def iter_gz_lines(filepath, pointer=0, max_bytes=None, final=True, chunk_size=None,
+                  views=False, index=None):
+    """
+        lines of a gzip file from an uncompressed position, like iter_lines
+
+    Args:
+        filepath (_str_): _full path and name_
+        pointer (_int_): _uncompressed offset to start from (start of a line)_
+        max_bytes (_int_): _stop after this many uncompressed bytes, None for all_
+        final (_bool_): _yield the last line without a new line if the archive is complete_
+        chunk_size (_int_): _not used - the block size is GZIP_BLOCK_BYTES_
+        views (_bool_): _yield memoryview slices instead of copies_
+        index (_GzipIndex_): _seek points of the file, None to start from the head_
+
+    Yields:
+        _tuple_: _line without the new line (bytes) and the offset after it_
+    """
+    stream = GzipStream(filepath, pointer, index)
+    reader = stream.iter_blocks()
+    blocks = reader
+    offset = pointer
+    if pointer == 0:
+        first = next(reader, b'')
+        # UTF-8 BOM is not part of the first line
+        if first.startswith(BOM):
+            first = first[len(BOM):]
+            offset = len(BOM)
+        blocks = chain((first,), reader)
+    try:
+        yield from iter_chunk_lines(blocks, offset, max_bytes,
+                                    lambda: (final() if callable(final) else final) and stream.complete, views)
+    finally:
+        reader.close()
+
+
+def get_gz_size(filepath):
+    """
+        uncompressed size of a gzip file - streamed, the ISIZE trailer only
+        covers the last member and wraps at 4GB
+
+    Returns:
+        _int_: _uncompressed bytes_
+    """
+    return sum(len(block) for block in GzipStream(filepath).iter_blocks())
@@ -0,0 +1,150 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Open file handles for the tail-follow mode.
+# Growing files keep one binary handle each (least recently used closed
+# first) and the partial last line read so far, so the next read goes on
+# from the handle without open, seek or stat, and a half-written line is
+# only parsed once its new line arrives.
+# Dependency: os
+
+
+import os
+from collections import OrderedDict
+from itertools import chain
+from modules.stream_reader import BOM
+from modules.stream_reader import READ_CHUNK_BYTES
+from modules.stream_reader import iter_chunk_lines
+
+
+# open handles at the time
+HANDLE_POOL_MAX = 256
+
+
+class TailHandle:
+    def __init__(self, file, offset):
+        """
+            an open file, the offset after the last line read
+            and the bytes read after it (partial line)
+        """
+        self.file = file
+        self.offset = offset
+        self.partial = b''
+
+
+def seek_line(file, pointer):
+    """
+        move the file to the pointer, after the UTF-8 BOM at the start
+
+    Returns:
+        _int_: _offset of the first line to read_
+    """
+    if pointer == 0:
+        # UTF-8 BOM is not part of the first line
+        file.seek(0)
+        if file.read(len(BOM)) == BOM:
+            return len(BOM)
+    file.seek(pointer)
+    return pointer
+
+
+class HandlePool:
+    def __init__(self, max_handles=HANDLE_POOL_MAX):
+        """
+            open handles by path, least recently used out
+        """
+        self.max_handles = max(1, max_handles)
+        self.handles = OrderedDict()
+
+    def get(self, filepath, pointer):
+        """
+            the handle of the file at the pointer - opened or moved if needed
+
+        Args:
+            filepath (_str_): _full path and name_
+            pointer (_int_): _byte offset to read from (start of a line)_
+
+        Returns:
+            _TailHandle_: _handle at the pointer_
+        """
+        handle = self.handles.get(filepath)
+        if handle is not None:
+            self.handles.move_to_end(filepath)
+            if handle.offset != pointer and not (pointer == 0 and handle.offset == len(BOM)):
+                # a retry from an older position or a moved pointer
+                handle.offset = seek_line(handle.file, pointer)
+                handle.partial = b''
+            return handle
+        file = open(filepath, 'rb')
+        handle = TailHandle(file, seek_line(file, pointer))
+        self.handles[filepath] = handle
+        if len(self.handles) > self.max_handles:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.file.close()
+        return handle
+
+    def close(self, filepath):
+        """
+            close the handle - the file was rotated, replaced or truncated
+        """
+        handle = self.handles.pop(filepath, None)
+        if handle is not None:
+            handle.file.close()
+
+    def close_all(self):
+        for handle in self.handles.values():
+            handle.file.close()
+        self.handles.clear()
+
+
+def iter_tail_lines(filepath, pointer=0, max_bytes=None, final=True,
+                    chunk_size=READ_CHUNK_BYTES, views=False, pool=None):
+    """
+        lines from the pooled handle of the file, like iter_lines
+
+    Args:
+        filepath (_str_): _full path and name_
+        pointer (_int_): _byte offset to start from (start of a line)_
+        max_bytes (_int_): _stop after this many bytes, None to the end of the file_
+        final (_bool_): _yield the last line even without a new line_
+        chunk_size (_int_): _read size_
+        views (_bool_): _yield memoryview slices instead of copies_
+        pool (_HandlePool_): _open handles_
+
+    Yields:
+        _tuple_: _line without the new line (bytes) and the byte offset after it_
+    """
+    handle = pool.get(filepath, pointer)
+    offset = handle.offset
+    reads = iter(lambda: handle.file.read(chunk_size), b'')
+    chunks = chain((handle.partial,), reads) if handle.partial else reads
+    rest = []
+    handle.partial = b''
+    lines = iter_chunk_lines(chunks, offset, max_bytes, final, views, rest)
+    try:
+        for line, offset in lines:
+            handle.offset = offset
+            yield line, offset
+    finally:
+        lines.close()
+        # the bytes after the last line wait in the handle for their new line
+        handle.partial = rest[0] if rest else b''
@@ -21,14 +21,13 @@
 # SOFTWARE.
 
 
-import gzip
-import shutil
-import os
+from modules.gzip_stream import get_gz_size
 
 
 def get_uncompressed_size(filepath):
     """
-        in order to get the correct file size using os.path.getsize
+        in order to get the uncompressed size of a gzip file
+        streamed through zlib in constant memory, no temp file
 
     Args:
         filepath (_str_): _filepath_
@@ -40,13 +39,8 @@ def get_uncompressed_size(filepath):
     if not filepath:
         return size
     try:
-        with gzip.open(filepath, 'rt') as f_in:
-            with open('__temp__file', 'wt') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        size = os.path.getsize('__temp__file')
-        os.remove('__temp__file')
+        size = get_gz_size(filepath)
     except Exception as err:
         size = 0
         print(f'[ERROR] File Size Calculation Error {err}\n')
-        exit(1)
-    return size
\ No newline at end of file
+    return size
@@ -0,0 +1,181 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Event-driven directory watcher with Linux inotify (ctypes, no extra service).
+# Directories are watched recursively and changed files are reported within
+# milliseconds of IN_MODIFY, IN_CLOSE_WRITE, IN_CREATE or IN_MOVED_TO.
+# Dependency: ctypes, select, struct (Linux only - polling is the fall back)
+
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO | \
+             IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+# struct inotify_event - wd, mask, cookie, len, then the name
+EVENT_HEADER = struct.Struct("iIII")
+EVENT_BUFFER = 64 * 1024
+
+
+def load_libc():
+    """
+        libc with the inotify calls or None if it's not Linux
+
+    Returns:
+        _ctypes.CDLL_: _libc_
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def inotify_available():
+    return load_libc() is not None
+
+
+class InotifyWatcher:
+    def __init__(self, root):
+        """
+            recursive inotify watches under the root directory
+        """
+        self.libc = load_libc()
+        if self.libc is None:
+            raise OSError("inotify is not available on this platform")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.root = root
+        # watch descriptor to directory
+        self.watches = {}
+        self.add_tree(root)
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            print(f'[ERROR] Unable to watch "{directory}" - {os.strerror(errno)}', flush=True)
+            return False
+        self.watches[wd] = directory
+        return True
+
+    def add_tree(self, root):
+        """
+            watch the directory and its sub directories
+
+        Args:
+            root (_str_): _directory_
+
+        Returns:
+            _set_: _files found - created before the watch was added_
+        """
+        found = set()
+        for path, dirs, files in os.walk(root):
+            self.add_watch(path)
+            found.update(os.path.join(path, name) for name in files)
+        return found
+
+    def read_events(self, timeout=None):
+        """
+            wait for events and collect the changed files
+
+        Args:
+            timeout (_float_): _seconds to wait, None to wait for an event_
+
+        Returns:
+            _tuple_: _set of changed file paths and a full rescan flag_
+        """
+        changed = set()
+        rescan = False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed, rescan
+        try:
+            buffer = os.read(self.fd, EVENT_BUFFER)
+        except BlockingIOError:
+            return changed, rescan
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped by the kernel
+                rescan = True
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            if mask & IN_MOVE_SELF:
+                # the new location is reported by its parent with IN_MOVED_TO
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+                continue
+            if mask & IN_DELETE_SELF:
+                continue
+            if not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # new sub directory - watch it and pick up what is already in it
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self.add_tree(path))
+                continue
+            if mask & IN_MOVED_FROM:
+                continue
+            changed.add(path)
+        return changed, rescan
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
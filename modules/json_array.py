@@ -0,0 +1,179 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Incremental reader for JSON documents that are one top-level array
+# (exports from other tools). The elements are found with a byte scanner
+# (strings skipped, brackets counted) and decoded one by one, so memory
+# follows the largest element, not the file, and every element carries the
+# byte offset after it - a restart resumes in the middle of the array.
+# Dependency: re
+
+
+import re
+from modules import json_codec
+from modules.stream_reader import BOM
+from modules.stream_reader import READ_CHUNK_BYTES
+from modules.stream_reader import READ_MAX_BYTES
+from modules.stream_reader import READ_MAX_RECORDS
+
+
+# a complete string, an unterminated string (group 1) or a structural character (group 2)
+ARRAY_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|(")|([\[\]{},])')
+WHITESPACE = b' \t\r\n'
+
+
+def skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in WHITESPACE:
+        pos += 1
+    return pos
+
+
+def scan_element(buffer, pos, depth=0):
+    """
+        end of the JSON value that starts in the buffer
+
+    Args:
+        buffer (_bytes_): _data_
+        pos (_int_): _where the scan goes on_
+        depth (_int_): _open brackets before pos_
+
+    Returns:
+        _tuple_: _end of the value (None if more data is needed), resume position, depth_
+    """
+    for match in ARRAY_TOKEN.finditer(buffer, pos):
+        if match.group(1):
+            # the string goes on in the next chunk
+            return None, match.start(), depth
+        token = match.group(2)
+        if token is None:
+            continue
+        if token in b'[{':
+            depth += 1
+        elif token in b']}':
+            if depth == 0:
+                # a number or literal before the end of the array
+                return match.start(), match.start(), depth
+            depth -= 1
+            if depth == 0:
+                return match.end(), match.end(), depth
+        elif depth == 0:
+            return match.start(), match.start(), depth
+    return None, len(buffer), depth
+
+
+def iter_array_elements(filepath, pointer=0, chunk_size=READ_CHUNK_BYTES):
+    """
+        elements of the top-level array from the pointer
+
+    Args:
+        filepath (_str_): _full path and name_
+        pointer (_int_): _0 or the byte offset after an element_
+        chunk_size (_int_): _read size_
+
+    Yields:
+        _tuple_: _element and the byte offset after it_
+    """
+    with open(filepath, 'rb') as file:
+        base = pointer
+        # UTF-8 BOM is not part of the document
+        if pointer == 0 and file.read(len(BOM)) == BOM:
+            base = len(BOM)
+        file.seek(base)
+        buffer = file.read(chunk_size)
+        pos = 0
+        # open, first (element or end), next (comma or end), element
+        state = "open" if pointer == 0 else "next"
+        start = None
+        scan = depth = 0
+        while True:
+            if start is None:
+                pos = skip_whitespace(buffer, pos)
+            if pos >= len(buffer) or start is not None:
+                more = file.read(chunk_size)
+                if not more:
+                    return
+                # keep the element being scanned, drop what was read
+                keep = pos if start is None else start
+                buffer = buffer[keep:] + more
+                base += keep
+                pos -= keep
+                if start is not None:
+                    scan -= start
+                    start = 0
+                    end, scan, depth = scan_element(buffer, scan, depth)
+                    if end is None:
+                        continue
+                    yield json_codec.loads(buffer[start:end]), base + end
+                    start = None
+                    pos = end
+                    state = "next"
+                continue
+            char = buffer[pos:pos + 1]
+            if state == "open":
+                if char != b'[':
+                    raise ValueError("not a JSON array")
+                pos += 1
+                state = "first"
+            elif char == b']' and state in ("first", "next"):
+                return
+            elif state == "next":
+                if char != b',':
+                    raise ValueError(f"',' expected at {base + pos}")
+                pos += 1
+                state = "element"
+            else:
+                end, scan, depth = scan_element(buffer, pos, 0)
+                if end is None:
+                    start = pos
+                    continue
+                yield json_codec.loads(buffer[pos:end]), base + end
+                pos = end
+                state = "next"
+
+
+def read_array(filepath, pointer, max_bytes=READ_MAX_BYTES, max_records=READ_MAX_RECORDS,
+               chunk_size=READ_CHUNK_BYTES):
+    """
+        the next batch of elements
+
+    Returns:
+        _list_: _elements and the byte offset after the last one_
+
+    Raises:
+        ValueError: _the array is broken at the pointer - what was parsed
+            before the error is returned first_
+    """
+    data = []
+    offset = pointer
+    elements = iter_array_elements(filepath, pointer, chunk_size)
+    try:
+        for element, offset in elements:
+            data.append(element)
+            if len(data) >= max_records or offset - pointer >= max_bytes:
+                break
+    except ValueError:
+        # ship the parsed elements, the next read starts at the error
+        if not data:
+            raise
+    finally:
+        elements.close()
+    return [data, offset]
@@ -0,0 +1,159 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# JSON codec layer - one place to decode and encode JSON for the readers
+# and the Elasticsearch sink. orjson or a simdjson binding (pysimdjson) is
+# used when it is installed, the standard json module otherwise.
+# extract() decodes only the keys that are needed (lazy with simdjson).
+# Dependency: json, [optional] orjson, [optional] simdjson
+
+
+import json
+
+
+BACKENDS = ("orjson", "simdjson", "stdlib")
+# every backend raises a ValueError subclass for invalid JSON or UTF-8
+DecodeError = ValueError
+
+
+class JsonCodec:
+    def __init__(self, name, loads, dumps, extract=None):
+        """
+            decode and encode functions of one backend
+            loads: bytes or str to an object, dumps: object to compact UTF-8 bytes
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.extract = extract or self.extract_keys
+
+    def extract_keys(self, raw, keys):
+        """
+            the given keys of a JSON object - full decode and pick
+        """
+        document = self.loads(bytes(raw) if isinstance(raw, memoryview) else raw)
+        if not isinstance(document, dict):
+            return {}
+        return {key: document[key] for key in keys if key in document}
+
+
+def stdlib_dumps(document):
+    return json.dumps(document, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def make_stdlib_codec():
+    return JsonCodec("stdlib", json.loads, stdlib_dumps)
+
+
+def make_orjson_codec():
+    import orjson
+
+    def dumps(document):
+        try:
+            return orjson.dumps(document)
+        except TypeError:
+            # types orjson does not serialize - ex. int over 64 bits
+            return stdlib_dumps(document)
+
+    return JsonCodec("orjson", orjson.loads, dumps)
+
+
+def make_simdjson_codec():
+    import simdjson
+
+    parser = simdjson.Parser()
+
+    def to_python(value):
+        if isinstance(value, simdjson.Object):
+            return value.as_dict()
+        if isinstance(value, simdjson.Array):
+            return value.as_list()
+        return value
+
+    def loads(raw):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        return to_python(parser.parse(bytes(raw)))
+
+    def extract(raw, keys):
+        # lazy - only the requested values become Python objects
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        document = parser.parse(bytes(raw))
+        if not isinstance(document, simdjson.Object):
+            return {}
+        return {key: to_python(document[key]) for key in keys if key in document}
+
+    # simdjson only decodes - orjson encodes if it's there
+    try:
+        dumps = make_orjson_codec().dumps
+    except ImportError:
+        dumps = stdlib_dumps
+    return JsonCodec("simdjson", loads, dumps, extract)
+
+
+def make_codec(name="auto"):
+    """
+        codec of the backend
+
+    Args:
+        name (_str_): _auto, orjson, simdjson or stdlib_
+
+    Returns:
+        _JsonCodec_: _codec - auto picks the fastest one installed_
+    """
+    makers = {"orjson": make_orjson_codec, "simdjson": make_simdjson_codec, 
+              "stdlib": make_stdlib_codec}
+    if name == "auto":
+        for backend in BACKENDS:
+            try:
+                return makers[backend]()
+            except ImportError:
+                continue
+    if name not in makers:
+        raise ValueError(f"unknown JSON backend '{name}' - {', '.join(('auto',) + BACKENDS)}")
+    return makers[name]()
+
+
+# the codec in use - set_codec rebinds the module functions
+codec = make_codec("auto")
+loads = codec.loads
+dumps = codec.dumps
+extract = codec.extract
+
+
+def set_codec(name="auto"):
+    """
+        use the backend for every reader and the sink
+
+    Args:
+        name (_str_): _auto, orjson, simdjson or stdlib_
+
+    Returns:
+        _JsonCodec_: _codec in use_
+    """
+    global codec, loads, dumps, extract
+    codec = make_codec(name)
+    loads = codec.loads
+    dumps = codec.dumps
+    extract = codec.extract
+    return codec
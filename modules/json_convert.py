@@ -28,21 +28,51 @@
 
 
 import csv
-import gzip
 import os
 import json
+import stat as stat_module
 import sys
-from modules.helper import get_uncompressed_size
+from functools import partial
+from modules.stream_reader import BOM
+from modules.stream_reader import READ_MAX_BYTES
+from modules.stream_reader import READ_MAX_RECORDS
+from modules.stream_reader import is_quiet
+from modules.stream_reader import iter_lines
+from modules.stream_reader import read_records
+from modules.reader_plan import detect_plan
+from modules.gzip_stream import iter_gz_lines
+from modules.handle_pool import iter_tail_lines
+from modules.json_array import read_array
+from modules.csv_reader import read_csv_rows
+from modules import json_codec
 
 
 # CSV, JSON, NDJSON, log formats decoding
 
-def validate_file_csv(filename):
+def is_regular_file(filename, stat=None):
+    '''
+    regular file check - the scanner's stat saves the syscall
+    '''
+    if stat is None:
+        return os.path.isfile(filename)
+    return stat_module.S_ISREG(stat.st_mode)
+
+
+def get_file_size(filepath, stat=None):
+    '''
+    file size - the scanner's stat saves the syscall
+    '''
+    if stat is None:
+        return os.path.getsize(filepath)
+    return stat.st_size
+
+
+def validate_file_csv(filename, stat=None):
     '''
     validate if the file is a CSV
     '''
     # if it's a file
-    if not os.path.isfile(filename):
+    if not is_regular_file(filename, stat):
         return False
     
     # either csv or xlsx
@@ -52,12 +82,12 @@ def validate_file_csv(filename):
     return False
 
 
-def validate_file_json(filename):
+def validate_file_json(filename, stat=None):
     '''
     validate if the file is a json
     '''
     # if it's a file
-    if not os.path.isfile(filename):
+    if not is_regular_file(filename, stat):
         return False
     
     # end with JSON
@@ -67,12 +97,12 @@ def validate_file_json(filename):
     return False
 
 
-def validate_file_log(filename):
+def validate_file_log(filename, stat=None):
     '''
     validate if the file is a log 
     '''
     # if it's a file
-    if not os.path.isfile(filename):
+    if not is_regular_file(filename, stat):
         return False
     
     # end with log
@@ -82,12 +112,12 @@ def validate_file_log(filename):
     return False
 
 
-def validate_file_gz(filename):
+def validate_file_gz(filename, stat=None):
     '''
     validate if the file is a log 
     '''
     # if it's a file
-    if not os.path.isfile(filename):
+    if not is_regular_file(filename, stat):
         return False
     
     # end with log
@@ -97,103 +127,76 @@ def validate_file_gz(filename):
     return False
 
 
-def read_gz_to_json(filepath, pointer):
-    '''
-    Read the GZ file only and this needs to be a log
-    
-    return: a list of JSON
-    '''
-    # return list
-    ret_val = [[], pointer]
-    # validate if the file is a GZ
-    if validate_file_gz(filepath) == False:
-        return ret_val
-    
+def read_gz_to_json(filepath, pointer, stat=None, max_bytes=READ_MAX_BYTES, 
+                    max_records=READ_MAX_RECORDS, plan=None, gzindex=None):
+    """
+        read a gzip archive of a log (JSON lines or Zeek TSV)
+        streamed with zlib from the uncompressed pointer, no temp file
+
+    Args:
+        filepath (_str_): _full path and file name_
+        pointer (_int_): _uncompressed byte offset_
+        stat (_os.stat_result_): _stat of the file if it's known_
+        max_bytes (_int_): _maximum uncompressed bytes to read_
+        max_records (_int_): _maximum records to return_
+        plan (_ReaderPlan_): _cached format and header of the file_
+        gzindex (_GzipIndex_): _seek points to resume near the pointer_
+
+    Returns:
+        _list_: _data and pointer (int)_
+    """
     data =[]
     ret_val = [data, pointer]
+    # validate if the file is a GZ
+    if validate_file_gz(filepath, stat) == False:
+        return ret_val
     if pointer == -1:
         return ret_val
-
     try:
-        # TSV type handling
-        tsv_flag = validate_file_tsv(filepath)
-        file_size = get_uncompressed_size(filepath)
-
-        if file_size == 0:
-            return ret_val
-
-        # TSV Format
-        if tsv_flag:
-            tsv_fields = get_fields_from_tsv(filepath)
-            with gzip.open(filepath, mode='r', encoding='utf-8-sig') as file:
-                # if the pointer is at the end of the file
-                if file.seek(pointer) == file_size:
-                    return ret_val            
-                lines = file.readlines()
-                if len(tsv_fields) > 0:
-                    return parse_tsv_to_json(lines, tsv_fields, pointer)
-        # JSON Format
-        else:        
-            with gzip.open(filepath, mode='r', encoding='utf-8-sig') as file:
-                # if the pointer is at the end of the file
-                if file.seek(pointer) == file_size:
-                    return ret_val
-                lines = file.readlines()
-                return parse_text_to_json(lines, pointer)
-
+        # format and header from the decompressed head
+        plan = detect_plan(filepath) if plan is None else plan
+        parser = get_line_parser(plan)
+        if parser is not None:
+            parse_line, views = parser
+            line_reader = partial(iter_gz_lines, index=gzindex)
+            ret_val = read_records(filepath, pointer, parse_line, max_bytes, 
+                                   max_records, True, views, line_reader)
+        # unknown format - skip the file
+        elif plan.complete:
+            ret_val = [[], -1]
     except FileNotFoundError:
-        print(f"Error: The file '{filepath}' was not found.")
-    except json.JSONDecodeError as err:
-        # invalid format.. skip
-        pass
+        print(f"[ERROR] The file '{filepath}' was not found.")
     except Exception as err:
+        # invalid or truncated archive
         print(f'[ERROR] {err} - {filepath} file..')
         ret_val[1] = -1
-    return ret_val     
+    return ret_val
 
 
-def read_csv_to_json(csv_file, pointer):
+def read_csv_to_json(csv_file, pointer, stat=None, max_bytes=READ_MAX_BYTES, 
+                     max_records=READ_MAX_RECORDS, plan=None, handles=None):
     '''
     Read the CSV file only and add data to a list to load
+    binary mode from the pointer, bounded by max_bytes and max_records
+    the header and the row parser come from the reader plan (cached per file)
     
-    return: a list of JSON
+    return: a list of JSON and the byte offset after the last row
     '''
     # return list
     ret_val = [[], pointer]
     # validate if the file is a CSV
-    if validate_file_csv(csv_file) == False:
+    if validate_file_csv(csv_file, stat) == False:
         return ret_val
     
     try:
-        # field names for appended data
-        with open(csv_file, mode='r', encoding='utf-8-sig') as file:
-            first_line = file.readline()
-            field_names = [idx.strip() for idx in first_line.strip().split(',')]
-            file.close()
-        # read with UTF-8 - csv
-        with open(csv_file, mode='r', encoding='utf-8-sig') as file:
-            # file load with the position
-            file.seek(pointer)
-            # if the pointer is at the end of the file
-            if file.tell() == os.path.getsize(csv_file):
-                ret_val[1] = file.tell()
-                return ret_val
-            if pointer == 0:
-                # read the csv and add to the list
-                reader = csv.DictReader(file)
-                ret_val[0] = [row for row in reader]
-                ret_val[1] = file.tell()
-            else:
-                lines = file.readlines()
-                for line in lines:
-                    line_bytes = line.encode('utf-8')
-                    line_length = len(line_bytes)
-                    ret_val[1] += line_length
-                    if ',' in line:
-                        values = [idx.strip() for idx in line.strip().split(',')]
-                        mapped_data = {field_names[idx]: values[idx] for idx in range(len(field_names))}
-                        ret_val[0].append(mapped_data)
-                        
+        # field names for appended data - the first line
+        plan = detect_plan(csv_file) if plan is None else plan
+        if not plan.complete:
+            return ret_val
+        # rows after the header - quoted fields may span lines
+        ret_val = read_csv_rows(csv_file, max(pointer, plan.header_end), plan, 
+                                max_bytes, max_records, partial(is_quiet, csv_file, stat),
+                                get_line_reader(handles))
     # unknown errors or unable to covert
     except FileNotFoundError:
         print(f"[ERROR] The file '{csv_file}' was not found.")
@@ -205,102 +208,138 @@ def read_csv_to_json(csv_file, pointer):
     return ret_val
 
 
-def read_to_json(filepath, pointer):
+def read_to_json(filepath, pointer, stat=None, max_bytes=READ_MAX_BYTES, 
+                 max_records=READ_MAX_RECORDS, plan=None, handles=None):
     # return list
     data = []
     ret_val = [data, pointer]
     # validate if the file is a 
-    if validate_file_json(filepath) == False:
+    if validate_file_json(filepath, stat) == False:
         return ret_val
 
     # JSON Load
     try:
-        # NDJSON
-        with open(filepath, mode='r', encoding='utf-8-sig') as file:
-            # read the first line
-            first_line = file.readline()
-            # if it's a JSON format
-            if first_line.startswith('{') and\
-                first_line.strip().endswith('}'):
-                file.close()
-                return reformat_to_json(filepath, pointer)
+        # NDJSON - the first line is a JSON
+        plan = detect_plan(filepath) if plan is None else plan
+        if plan.format == "ndjson":
+            return reformat_to_json(filepath, pointer, stat, max_bytes, max_records, plan,
+                                    handles)
+        # top-level array - the next elements in batches, resumable mid-array
+        if plan.array:
+            return read_array(filepath, pointer, max_bytes, max_records)
         # JSON
-        with open(filepath, 'r', encoding='utf-8-sig') as file:
+        with open(filepath, 'rb') as file:
             # file load with the position
             file.seek(pointer)
+            content = file.read()
             # if the pointer is at the end of the file
-            if file.tell() == os.path.getsize(filepath):
+            if not content.strip():
                 return ret_val
-            ret_val[0] = json.load(file)
-            ret_val[1] = file.tell()
+            # the codec takes bytes - no str copy of the document
+            start = len(BOM) if pointer == 0 and content.startswith(BOM) else 0
+            ret_val[0] = json_codec.loads(content[start:])
+            ret_val[1] = pointer + len(content)
         return ret_val
 
     # unknown errors or unable to covert
     except FileNotFoundError:
         print(f"[ERROR] The file '{filepath}' was not found.")
-    except json.JSONDecodeError as err:
-        pass
+    except json_codec.DecodeError as err:
+        # a broken array doesn't get better - a document may be half-written
+        if plan is not None and plan.array:
+            print(f'[ERROR] {err} - {filepath} file..')
+            ret_val[1] = -1
     except Exception as err:
         print(f'[ERROR] {err} - {filepath} file..')
         ret_val[1] = -1
     return ret_val
 
 
-def parse_tsv_from_line(line):
-    ret_val = []
-    if len(line) > 0:
-        ret_val = [idx.strip() for idx in line.split('\t')]
-        if len(ret_val) == 0:
-            temp = [idx.strip() for idx in line.split(' ')]
-            for idx in temp:
-                if not '\n' == idx:
-                    ret_val.append(idx)
-        if len(ret_val) == 1 and '\t' not in line:
-            ret_val = [idx.strip() for idx in line.split(' ') if idx.strip()]
-    return ret_val
-
-
 def get_fields_from_tsv(filepath):
     """
-        get the field from tsv
+        get the field from tsv - the #fields of the reader plan
     Args:
-        lines (_list_): _filepath_
+        filepath (_str_): _full path and name (log or gz)_
 
     Returns:
-        _list_: _file names_
+        _list_: _field names, empty if it's not a Zeek TSV log_
     """
-    ret_val = []
     try:
-        if filepath.lower().endswith("gz"):
-            with gzip.open(filepath, mode='r', encoding='utf-8-sig') as file:
-                for line in file:
-                    if len(line) > 0 and \
-                        line[0] == "#" and \
-                        "fields" in line:
-                        # tsv to a list
-                        ret_val = parse_tsv_from_line(line)
-                        # remove "fields" string
-                        ret_val.pop(0)
-                        break
-        else:
-            with open(filepath, mode='r', encoding='utf-8-sig') as file:
-                for line in file:
-                    if len(line) > 0 and \
-                        line[0] == "#" and \
-                        "fields" in line:
-                        # tsv to a list
-                        ret_val = parse_tsv_from_line(line)
-                        # remove "fields" string
-                        ret_val.pop(0)
-                        break
+        plan = detect_plan(filepath)
     except ValueError:
-        return ret_val
-    return ret_val
+        return []
+    return list(plan.fields) if plan.format == "tsv" else []
+
+
+def parse_tsv_line(line, tsv_fields, separator='\t'):
+    """
+        a TSV line to a JSON
+    Args:
+        line (_str_): _values_
+        tsv_fields (_list_): _field name_
+        separator (_str_): _Zeek #separator_
+
+    Returns:
+        _dict_: _JSON or None for comments, empty or invalid lines_
+    """
+    # remove empty line, commented lines and JSON lines
+    if line.startswith('#') or line.startswith('{'):
+        return None
+    line = line.strip()
+    if line == "":
+        return None
+    # Split by tab, or by spaces if no tabs
+    elements = line.split(separator)
+    if len(elements) == 1:
+        elements = [ele for ele in line.split(' ') if ele]
+    # only process lines with the correct number of fields
+    if len(elements) != len(tsv_fields):
+        return None
+    return dict(zip(tsv_fields, elements))
+
+
+def parse_json_line(line):
+    """
+        a JSON line (bytes) to a JSON
+    Args:
+        line (_bytes_): _line_
+
+    Returns:
+        _dict_: _JSON or None for comments, empty or invalid lines_
+    """
+    line = line.strip()
+    # Skip empty lines, commented lines and TSV lines
+    if not line.startswith(b'{') or not line.endswith(b'}'):
+        return None
+    try:
+        return json_codec.loads(line)
+    except json_codec.DecodeError:
+        return None
+
+
+def parse_raw_json_line(line):
+    """
+        a JSON line passed through as raw bytes - only a structural check,
+        no decoding and no encoding again for the _bulk body
+    Args:
+        line (_bytes or memoryview_): _line_
+
+    Returns:
+        _bytes or memoryview_: _the line or None for comments, empty or invalid lines_
+    """
+    if len(line) > 1 and line[0] == 0x7b and line[-1] == 0x7d:
+        return line
+    # leading or trailing spaces
+    line = bytes(line).strip()
+    if not line.startswith(b'{') or not line.endswith(b'}'):
+        return None
+    return line
 
 
 def parse_tsv_to_json(lines, tsv_fields, pointer):
     """
-        to create JSONs to a list
+        to create JSONs to a list - the list API of parse_tsv_line,
+        the line parser of the TSV reader
     Args:
         lines (_list_): _values_
         tsv_fields (_list_): _field name_
@@ -318,27 +357,9 @@ def parse_tsv_to_json(lines, tsv_fields, pointer):
         # handle JSON lines or empty fields
         if line.startswith('{'):
             return [[], orig_pointer]
-        
-        # remove empty line and add
-        if line.strip() == "":
-            pointer += len(line)
-            continue
-        
-        # handle commented lines
-        if line.startswith("#"):
-            pointer += len(line)
-            continue
-
-        # Split by tab, or by spaces if no tabs
-        elements = line.strip().split('\t')
-        if len(elements) == 1 and '\t' not in line:
-            elements = [ele for ele in line.strip().split(' ') if ele]
-
-        # only process lines with the correct number of fields
-        if len(elements) == len(tsv_fields):
-            record = {tsv_fields[idx]: elements[idx] for idx in range(len(tsv_fields))}
+        record = parse_tsv_line(line, tsv_fields)
+        if record is not None:
             data.append(record)
-        
         # Update pointer by line length
         pointer += len(line)
 
@@ -348,103 +369,59 @@ def parse_tsv_to_json(lines, tsv_fields, pointer):
     return ret_val
 
 
-def parse_text_to_json(lines, pointer):
+def get_line_reader(handles=None):
     """
-        to create JSONs to a list from log text
+        line reader - pooled handles in the tail-follow mode, a new open otherwise
     Args:
-        lines (_list_): _values_
-        pointer (_int_): _current position_
+        handles (_HandlePool_): _open handles, None without the tail-follow mode_
 
     Returns:
-        _list_: _data and pointer (int)_
+        _callable_: _iter_lines or iter_tail_lines with the pool_
     """
+    if handles is None:
+        return iter_lines
+    return partial(iter_tail_lines, pool=handles)
 
-    data =[]
-    ptr = pointer
-    idx = 0
-    for idx, line in enumerate(lines):
-
-        line_bytes = line.encode('utf-8')
-        line_length = len(line_bytes)
-        # Skip TSV lines
-        if '\t' in line:
-            break
-
-        # Skip empty lines
-        if not line.strip():
-            ptr += line_length 
-            continue
-
-        # Skip commented lines
-        if line.startswith("#"):
-            ptr += line_length
-            continue
-
-        # Parse JSON lines
-        if line.startswith("{") and line.strip().endswith("}"):
-            try:
-                json_data = json.loads(line)
-                data.append(json_data)
-            except json.JSONDecodeError:
-                pass
-
-        # Update pointer for processed lines
-        pointer += line_length
-    # last line if there is a new line
-    if idx != 0:
-        if idx == len(lines) - 1 and \
-            not line.endswith('\n'):
-                pointer += 1
-
-    return [data, pointer]
-
-
-def validate_file_tsv(filepath):
-    # field names for appended data
-    if filepath.lower().endswith("gz"):
-        with gzip.open(filepath, mode='r', encoding='utf-8-sig') as file:
-            # first 5 lines checking to see if it's a TSV
-            counts = 5
-            for idx in range(0, counts):
-                first_line = file.readline()
-                if first_line[0].strip() == "{":
-                    return False
-            for idx in range(0, counts):
-                first_line = file.readline()
-                if "\t" in first_line:
-                    return True
-            for idx in range(0, counts):
-                first_line = file.readline()
-                if ':' in first_line:
-                    return False
-            return True
-    else:
-        with open(filepath, mode='r', encoding='utf-8-sig') as file:
-            # first 5 lines checking to see if it's a TSV
-            counts = 5
-            for idx in range(0, counts):
-                first_line = file.readline()
-                if first_line[0].strip() == "{":
-                    return False
-            # first 5 lines
-            for idx in range(0, counts):
-                first_line = file.readline()
-                if "\t" in first_line:
-                    return True
-            for idx in range(0, counts):
-                first_line = file.readline()
-                if ':' in first_line:
-                    return False
-            return True
-            
-
-def read_log_to_json(filepath, pointer):
+
+def get_line_parser(plan):
+    """
+        line parser of the plan - TSV (typed if compiled) or JSON lines
+    Args:
+        plan (_ReaderPlan_): _format and header of the file_
+
+    Returns:
+        _tuple_: _parse_line and views (raw passthrough), None for unknown formats_
+    """
+    # TSV Format
+    if plan.format == "tsv":
+        # typed columns from #types if the plan has the compiled parser
+        if plan.parse_line is not None:
+            return plan.parse_line, False
+        tsv_fields = plan.fields
+        separator = plan.separator
+        def parse_line(line):
+            return parse_tsv_line(line.decode('utf-8', 'replace'), tsv_fields, separator)
+        return parse_line, False
+    # JSON Format - raw lines in the passthrough mode
+    if plan.format == "ndjson":
+        return (parse_raw_json_line if plan.raw else parse_json_line), plan.raw
+    return None
+
+
+def read_log_to_json(filepath, pointer, stat=None, max_bytes=READ_MAX_BYTES, 
+                     max_records=READ_MAX_RECORDS, plan=None, handles=None):
     """
         read log if it's a JSON or TSV
+        binary mode from the pointer, bounded by max_bytes and max_records
 
     Args:
         filepath (_str_): _full path and file name_
         pointer (_int_): _location_
+        stat (_os.stat_result_): _stat of the file if it's known_
+        max_bytes (_int_): _maximum bytes to read_
+        max_records (_int_): _maximum records to return_
+        plan (_ReaderPlan_): _cached format and header of the file_
+        handles (_HandlePool_): _open handles of the tail-follow mode_
 
     Returns:
         _list_: _data and pointer (int)_
@@ -452,33 +429,24 @@ def read_log_to_json(filepath, pointer):
     data =[]
     ret_val = [data, pointer]
     # validate if the file is a 
-    if validate_file_log(filepath) == False:
+    if validate_file_log(filepath, stat) == False:
         return ret_val
     if pointer == -1:
         return ret_val
     try:
-        tsv_flag = validate_file_tsv(filepath)
-        # TSV Format
-        if tsv_flag:
-            tsv_fields = get_fields_from_tsv(filepath)
-            with open(filepath, mode='r', encoding='utf-8-sig')as file:
-                # if the pointer is at the end of the file
-                if file.seek(pointer) == os.path.getsize(filepath):
-                    return ret_val
-                #print(lines, tsv_fields, pointer, os.path.getsize(filepath))
-                if len(tsv_fields) > 0:
-                    lines = file.readlines()
-                    return parse_tsv_to_json(lines, tsv_fields, pointer)
-                else:
-                    ret_val = [[], -1]
-        # JSON Format
-        else:        
-            with open(filepath, mode='r', encoding='utf-8-sig') as file:
-                # if the pointer is at the end of the file
-                if file.seek(pointer) == os.path.getsize(filepath):
-                    return ret_val
-                lines = file.readlines()
-                ret_val = parse_text_to_json(lines, pointer)
+        # the last line without a new line - checked only if there is one
+        final = partial(is_quiet, filepath, stat)
+        # format and header - detected once per file with the plan cache
+        plan = detect_plan(filepath) if plan is None else plan
+        parser = get_line_parser(plan)
+        if parser is not None:
+            parse_line, views = parser
+            ret_val = read_records(filepath, pointer, parse_line, 
+                                   max_bytes, max_records, final, views, 
+                                   get_line_reader(handles))
+        # unknown format - skip the file
+        elif plan.complete:
+            ret_val = [[], -1]
     except FileNotFoundError:
         print(f"[ERROR] The file '{filepath}' was not found.")
     except json.JSONDecodeError as err:
@@ -487,16 +455,23 @@ def read_log_to_json(filepath, pointer):
     except Exception as err:
         print(f'[ERROR] {err} - {filepath} file..')
         ret_val[1] = -1
-    return ret_val        
+    return ret_val
 
 
-def reformat_to_json(filepath, pointer):
+def reformat_to_json(filepath, pointer, stat=None, max_bytes=READ_MAX_BYTES, 
+                     max_records=READ_MAX_RECORDS, plan=None, handles=None):
     """
         if load_to_json function fails, then the format needs to reload
+        NDJSON - one JSON per line, binary mode from the pointer
 
     Args:
         filepath (_str_): _full path and file name_
         pointer (_int_): _location_
+        stat (_os.stat_result_): _stat of the file if it's known_
+        max_bytes (_int_): _maximum bytes to read_
+        max_records (_int_): _maximum records to return_
+        plan (_ReaderPlan_): _raw lines (passthrough) if the plan says so_
+        handles (_HandlePool_): _open handles of the tail-follow mode_
 
     Returns:
         _list_: _data and pointer (int)_
@@ -505,34 +480,14 @@ def reformat_to_json(filepath, pointer):
     data = []
     ret_val = [data, pointer]
     # validate if the file is a 
-    if validate_file_json(filepath) == False:
+    if validate_file_json(filepath, stat) == False:
         return ret_val
     try:
-        with open(filepath, mode='r', encoding='utf-8-sig') as file:
-            # file load with the position
-            file.seek(pointer)
-            # if the pointer is at the end of the file
-            if file.tell() == os.path.getsize(filepath):
-                return ret_val
-            # pythonic way to load
-            for line in file:
-                try:
-                    line_bytes = line.encode('utf-8')
-                    line_length = len(line_bytes)
-                    # Skip empty lines
-                    if not line.strip():
-                        ptr += line_length 
-                        continue
-                    # Skip commented lines
-                    if line.startswith("#"):
-                        ptr += line_length
-                        continue
-                    # json load
-                    line_json = json.loads(line)
-                    data.append(line_json)
-                    ret_val[1] += line_length
-                except json.JSONDecodeError as err:
-                    continue
+        raw = plan is not None and plan.raw
+        parse_line = parse_raw_json_line if raw else parse_json_line
+        ret_val = read_records(filepath, pointer, parse_line, max_bytes, 
+                               max_records, partial(is_quiet, filepath, stat), raw,
+                               get_line_reader(handles))
     except FileNotFoundError:
         # unknown errors or unable to covert
         print(f"[ERROR] The file '{filepath}' was not found.")
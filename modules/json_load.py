@@ -32,6 +32,20 @@
 import time
 import getpass
 import gc
+import json
+from modules import json_codec
+from modules.compact_rows import CompactRow
+
+
+# _bulk request limits - documents and body size per request
+BULK_MAX_DOCS = 1000
+BULK_MAX_BYTES = 5 * 1024 * 1024
+# retries only for the rejected documents
+BULK_MAX_RETRIES = 3
+BULK_RETRY_BACKOFF = 1
+BULK_RETRY_BACKOFF_MAX = 30
+# item status codes that are worth sending again
+BULK_RETRY_STATUS = (429, 502, 503, 504)
 
 
 def get_ipport_from_input():
@@ -171,16 +185,197 @@ def connect_elk_db():
         gc.collect()    
 
 
-def load_json_to_elk(locator=None, json_val=[]):
+def serialize_document(document):
     """
-        load json string or a list of JSONs to Elk DB
+        JSON document as bytes for the _bulk body
+        raw lines (passthrough) are used as they are,
+        compact rows with the template of their schema
+
+    Args:
+        document (_dict, bytes or CompactRow_): _JSON document, raw JSON line or compact row_
+
+    Returns:
+        _bytes or memoryview_: _serialized document without the new line_
+    """
+    if isinstance(document, (bytes, bytearray, memoryview)):
+        return document
+    if isinstance(document, CompactRow):
+        return document.schema.serialize(document)
+    return json_codec.dumps(document)
+
+
+def serialize_bulk_action(action, document):
+    """
+        serialize one document as a _bulk action line and a source line
+
+    Args:
+        action (_bytes_): _action line with the index name and the new line_
+        document (_dict or bytes_): _JSON document or a raw JSON line_
+
+    Returns:
+        _bytes_: _NDJSON lines for the _bulk API_
+    """
+    return action + serialize_document(document) + b'\n'
+
+
+def get_bulk_action(index):
+    """
+        _bulk action line for the index
+
+    Args:
+        index (_str_): _index name_
+
+    Returns:
+        _bytes_: _action line_
+    """
+    return json.dumps({"index": {"_index": index}}, 
+                      separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def iter_bulk_batches(index, documents, positions, 
+                      max_docs=BULK_MAX_DOCS, max_bytes=BULK_MAX_BYTES):
+    """
+        split the documents into _bulk request bodies by count and size
+        a document bigger than max_bytes is sent alone
+
+    Args:
+        index (_str_): _index name_
+        documents (_list_): _a list of JSONs_
+        positions (_list_): _positions of the documents to send_
+        max_docs (_int or callable_): _maximum documents per request_
+        max_bytes (_int_): _maximum body size per request_
+
+    Yields:
+        _tuple_: _positions in the batch and the NDJSON body (bytes)_
+    """
+    action = get_bulk_action(index)
+    get_max_docs = max_docs if callable(max_docs) else lambda: max_docs
+    limit = get_max_docs()
+    batch = []
+    body = bytearray()
+    for pos in positions:
+        source = serialize_document(documents[pos])
+        size = len(action) + len(source) + 1
+        if batch and (len(batch) >= limit or \
+                      len(body) + size > max_bytes):
+            yield batch, bytes(body)
+            batch = []
+            body = bytearray()
+            limit = get_max_docs()
+        batch.append(pos)
+        # raw lines are copied once - from the read buffer into the body
+        body += action
+        body += source
+        body += b'\n'
+    if batch:
+        yield batch, bytes(body)
+
+
+def get_bulk_failures(response, positions):
+    """
+        per-item results of a _bulk response
+
+    Args:
+        response (_dict_): _bulk API response_
+        positions (_list_): _positions of the documents in the request_
+
+    Returns:
+        _tuple_: _positions to retry and a list of rejected items (position, status, reason)_
+    """
+    retry = []
+    rejected = []
+    if not response.get("errors"):
+        return retry, rejected
+    for pos, item in zip(positions, response.get("items", [])):
+        # one action per item - index
+        result = next(iter(item.values()), {})
+        status = result.get("status", 0)
+        if 200 <= status < 300:
+            continue
+        if status in BULK_RETRY_STATUS:
+            retry.append(pos)
+        else:
+            reason = result.get("error", {})
+            if isinstance(reason, dict):
+                reason = reason.get("reason", reason.get("type", ""))
+            rejected.append((pos, status, reason))
+    return retry, rejected
+
+
+def send_bulk_batch(client, positions, body):
+    """
+        send one _bulk request
+
+    Args:
+        client (_Elasticsearch_): _client_
+        positions (_list_): _positions of the documents in the body_
+        body (_bytes_): _NDJSON body_
+
+    Returns:
+        _tuple_: _positions to retry and a list of rejected items_
+    """
+    try:
+        response = client.bulk(operations=body)
+    except Exception as err:
+        # the whole request failed (connection, 429, time out) - retry all
+        print(f'[ERROR] Bulk request failed - {err}', flush=True)
+        return list(positions), []
+    return get_bulk_failures(response, positions)
+
+
+def get_bulk_sink(locator):
+    """
+        the Elasticsearch sink of the locator, created on the first use
+
+    Args:
+        locator (_Locator_): Locator instance
+
+    Returns:
+        _BulkSink_: _sink with the locator's client and limits_
+    """
+    from modules.bulk_sink import BulkSink
+
+    if getattr(locator, "sink", None) is None or locator.sink.client is not locator.client:
+        locator.sink = BulkSink(locator.client,
+                                max_concurrency=getattr(locator, "bulk_workers", 1),
+                                max_docs=getattr(locator, "bulk_max_docs", BULK_MAX_DOCS),
+                                max_bytes=getattr(locator, "bulk_max_bytes", BULK_MAX_BYTES),
+                                max_retries=getattr(locator, "bulk_max_retries", BULK_MAX_RETRIES))
+    return locator.sink
+
+
+def submit_json_to_elk(locator, json_val, index=None):
+    """
+        load_json_to_elk in the background of the locator's sink
+
+    Args:
+        locator (_Locator_): Locator instance
+        json_val (_list_): _a list of JSONs_
+        index (_str_): _index name, the locator's current index by default_
+
+    Returns:
+        _Future_: _result() is the result of load_json_to_elk_
+    """
+    index = locator.get_index() if index is None else index
+    return get_bulk_sink(locator).submit(load_json_to_elk, locator, json_val, index)
+
+
+def load_json_to_elk(locator=None, json_val=[], index=None):
+    """
+        load json string or a list of JSONs to Elk DB with the _bulk API
+        batches are sent concurrently by the locator's sink and
+        only the documents rejected with a retryable status are sent again
 
     Args:
         locator (_Locator_): Locator instance
         json_val (JSON or _str or list_): _load the JSON to Elk DB_
+        index (_str_): _index name, the locator's current index by default_
 
         if the dict or list has strings, then it converts strings 
         to JSON to the Elasticsearch server.
+
+    Returns:
+        _bool_: _True if every document is accepted or permanently rejected_
     """
     # no data to send.
     if len(json_val) == 0:
@@ -189,26 +384,25 @@ def load_json_to_elk(locator=None, json_val=[]):
     if locator == None or locator.client == None:
         print("[ALERT] No connection to the SIEM...... Please press ctrl-c")
         return False
-    
-    from elasticsearch import Elasticsearch as elk_db
-    
+
     # one index
     if isinstance(json_val, dict):
-        # Elastic REST API
-        locator.client.index(index=locator.get_index(),\
-                             document=json_val)
-    # multiple indexes
-    elif isinstance(json_val, list):
-        # Elastic REST API
-        for idx, json_str in enumerate(json_val):
-            # pause per 1000 indexes at the time
-            if idx % 1000 == 0:
-                time.sleep(locator.interval)
-            locator.client.index(index=locator.get_index(),\
-                                 document=json_str)
+        json_val = [json_val]
     # invalid type
-    else:
+    elif not isinstance(json_val, list):
         return False
-    
-    return True
 
+    index = locator.get_index() if index is None else index
+    sink = get_bulk_sink(locator)
+    pending, rejected = sink.load(index, json_val)
+
+    # mapping errors and other permanent rejects are reported, not retried
+    if rejected:
+        pos, status, reason = rejected[0]
+        print(f'[ERROR] {len(rejected)} document(s) rejected by the "{index}" index; '
+              f'first: status {status} - {reason}', flush=True)
+    if pending:
+        print(f'[ERROR] {len(pending)} document(s) not accepted after {sink.max_retries} retries', 
+              flush=True)
+        return False
+    return True
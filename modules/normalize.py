@@ -0,0 +1,284 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Field normalization - a declarative mapping per index (zeek_conn,
+# suricata_eve, or a pattern like zeek_*) compiled once into rename, move,
+# cast, collect, remove and set operations, applied to a batch in one pass.
+# Compact rows get a compiled schema (the renames cost nothing per row),
+# dicts a list of the operations. Shipping ECS-like documents this way
+# saves an Elasticsearch ingest pipeline on every event.
+# Dependency: fnmatch, json
+
+
+import fnmatch
+import json
+from modules.compact_rows import CompactRow
+from modules.compact_rows import RowSchema
+from modules.zeek_types import to_iso
+
+
+NORMALIZE_OPERATIONS = ("move", "rename", "cast", "collect", "remove", "set")
+# mapping of a bare --normalize - ECS source/destination for Zeek and Suricata
+NORMALIZE_DEFAULT = {
+    "zeek_*": {
+        "rename": {"id.orig_h": "source.ip", "id.orig_p": "source.port",
+                   "id.resp_h": "destination.ip", "id.resp_p": "destination.port"},
+        "cast": {"source.port": "int", "destination.port": "int"},
+        "collect": {"related.ip": ["source.ip", "destination.ip"]}
+    },
+    "suricata_*": {
+        "rename": {"src_ip": "source.ip", "src_port": "source.port",
+                   "dest_ip": "destination.ip", "dest_port": "destination.port"},
+        "cast": {"source.port": "int", "destination.port": "int"},
+        "collect": {"related.ip": ["source.ip", "destination.ip"]}
+    }
+}
+# schemas compiled per index before the cache starts over
+NORMALIZE_SCHEMAS = 1024
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ("t", "true", "1", "yes", "y")
+    return bool(value)
+
+
+NORMALIZE_CASTS = {"int": int, "float": float, "str": str, "bool": to_bool, "iso": to_iso}
+
+
+def cast_value(cast, value):
+    """
+        typed value - the value as it is if it does not convert
+    """
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (ValueError, TypeError, OverflowError, OSError):
+        return value
+
+
+class NormalizePlan:
+    def __init__(self, mapping):
+        """
+            compiled operations of one mapping, in this order:
+            move (nested path to a field), rename, cast, collect (a list of the
+            values of fields), remove and set (constants) - each one sees the
+            names after the operations before it
+
+        Args:
+            mapping (_dict_): _operation name to its fields - ex. {"rename": {"id.resp_h": "dest_ip"}}
+        """
+        unknown = [name for name in mapping if name not in NORMALIZE_OPERATIONS]
+        if unknown:
+            raise ValueError(f"unknown operations {unknown} - use {', '.join(NORMALIZE_OPERATIONS)}")
+        self.moves = [(source, tuple(source.split('.')), target)
+                      for source, target in dict(mapping.get("move", {})).items()]
+        self.renames = list(dict(mapping.get("rename", {})).items())
+        self.casts = []
+        for name, cast in dict(mapping.get("cast", {})).items():
+            if cast not in NORMALIZE_CASTS:
+                raise ValueError(f"unknown cast '{cast}' of '{name}' - use {', '.join(NORMALIZE_CASTS)}")
+            self.casts.append((name, NORMALIZE_CASTS[cast]))
+        self.collects = [(name, tuple(sources)) 
+                         for name, sources in dict(mapping.get("collect", {})).items()]
+        self.removes = list(mapping.get("remove", []))
+        self.constants = dict(mapping.get("set", {}))
+        self.schemas = {}
+
+    def apply_dict(self, record):
+        """
+            normalize a dict in place
+        """
+        for source, path, target in self.moves:
+            # Zeek JSON keeps "id.orig_h" as one key, Suricata nests the objects
+            if source in record:
+                record[target] = record.pop(source)
+                continue
+            parent, value = None, record
+            for name in path:
+                if not isinstance(value, dict):
+                    value = None
+                    break
+                parent, value = value, value.get(name)
+            if value is not None:
+                # nested dicts can be shared by records (lookup caches) - copy the parents
+                parent = record
+                for name in path[:-1]:
+                    nested = dict(parent[name])
+                    parent[name] = nested
+                    parent = nested
+                del parent[path[-1]]
+                record[target] = value
+        for source, target in self.renames:
+            if source in record:
+                record[target] = record.pop(source)
+        for name, cast in self.casts:
+            value = record.get(name)
+            if value is not None:
+                record[name] = cast_value(cast, value)
+        for name, sources in self.collects:
+            values = []
+            for source in sources:
+                value = record.get(source)
+                if value is not None and value not in values:
+                    values.append(value)
+            if values:
+                record[name] = values
+        for name in self.removes:
+            record.pop(name, None)
+        if self.constants:
+            record.update(self.constants)
+        return record
+
+    def compile_schema(self, schema):
+        """
+            the operations on the columns of a schema - nested moves do not apply
+            to flat rows, a move of a field in the row is a rename
+
+        Returns:
+            _callable_: _row of the schema to a row of the normalized schema_
+        """
+        # output columns - [name, source position, cast]
+        columns = [[name, pos, None] for pos, name in enumerate(schema.fields)]
+
+        def rename(source, target):
+            if any(column[0] == source for column in columns):
+                columns[:] = [column for column in columns if column[0] != target]
+                for column in columns:
+                    if column[0] == source:
+                        column[0] = target
+
+        for source, _, target in self.moves:
+            rename(source, target)
+        for source, target in self.renames:
+            rename(source, target)
+        for name, cast in self.casts:
+            for column in columns:
+                if column[0] == name:
+                    column[2] = cast
+        # collected values by the source position and the cast
+        sources = {column[0]: (column[1], column[2]) for column in columns}
+        collects = [(name, [sources[source] for source in found if source in sources])
+                    for name, found in self.collects]
+        for name, _ in collects:
+            columns[:] = [column for column in columns if column[0] != name]
+        removed = set(self.removes) | set(self.constants)
+        columns = [column for column in columns if column[0] not in removed]
+        collects = [(name, found) for name, found in collects if name not in removed]
+        fields = [column[0] for column in columns] + [name for name, _ in collects] + \
+                 list(self.constants)
+        row = RowSchema(fields).row
+        keep = [column[1] for column in columns]
+        casts = [(pos, column[2]) for pos, column in enumerate(columns) if column[2] is not None]
+        constants = list(self.constants.values())
+        width = len(schema.fields)
+
+        def normalize(values):
+            if len(values) < width:
+                values = values + (None,) * (width - len(values))
+            output = [values[pos] for pos in keep]
+            for pos, cast in casts:
+                output[pos] = cast_value(cast, output[pos])
+            for _, found in collects:
+                collected = []
+                for pos, cast in found:
+                    value = values[pos] if cast is None else cast_value(cast, values[pos])
+                    if value is not None and value not in collected:
+                        collected.append(value)
+                output.append(collected or None)
+            output.extend(constants)
+            return row(output)
+
+        return normalize
+
+    def apply_row(self, row):
+        """
+            normalized copy of a compact row - the schema is compiled once
+        """
+        normalize = self.schemas.get(row.schema)
+        if normalize is None:
+            if len(self.schemas) >= NORMALIZE_SCHEMAS:
+                self.schemas.clear()
+            normalize = self.schemas[row.schema] = self.compile_schema(row.schema)
+        return normalize(row)
+
+
+def load_mappings(filepath=None):
+    """
+        mappings of a JSON file - index name or pattern to the operations
+
+    Args:
+        filepath (_str_): _mapping file, None for the default mapping_
+
+    Returns:
+        _dict_: _index name or pattern to the compiled plan_
+    """
+    if filepath is None:
+        mappings = NORMALIZE_DEFAULT
+    else:
+        with open(filepath, encoding='utf-8') as file:
+            try:
+                mappings = json.load(file)
+            except json.JSONDecodeError as err:
+                raise ValueError(f"'{filepath}' is not a JSON mapping - {err}")
+    if not isinstance(mappings, dict):
+        raise ValueError("the mapping is an object of index names to the operations")
+    plans = {}
+    for name, mapping in mappings.items():
+        if not isinstance(mapping, dict):
+            raise ValueError(f"the mapping of '{name}' is not an object")
+        try:
+            plans[name] = NormalizePlan(mapping)
+        except (ValueError, TypeError, AttributeError) as err:
+            raise ValueError(f"'{name}': {err}")
+    return plans
+
+
+class NormalizeStage:
+    def __init__(self, plans):
+        """
+            the plan of the index - the exact name, else the first pattern that matches
+        """
+        self.plans = plans
+        self.indexes = {}
+
+    def get_plan(self, index):
+        if index not in self.indexes:
+            plan = self.plans.get(index)
+            if plan is None:
+                plan = next((plan for pattern, plan in self.plans.items()
+                             if fnmatch.fnmatchcase(index, pattern)), None)
+            self.indexes[index] = plan
+        return self.indexes[index]
+
+    def process(self, index, documents):
+        plan = self.get_plan(index)
+        if plan is None:
+            return documents
+        apply_dict, apply_row = plan.apply_dict, plan.apply_row
+        for pos, record in enumerate(documents):
+            if isinstance(record, dict):
+                apply_dict(record)
+            elif isinstance(record, CompactRow):
+                documents[pos] = apply_row(record)
+        return documents
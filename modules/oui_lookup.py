@@ -0,0 +1,258 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# MAC OUI vendor lookup - the IEEE registry files (oui.csv, mam.csv,
+# oui36.csv or oui.txt) are compiled once into a binary prefix table that
+# is memory-mapped and binary searched: start up is instant and the pages
+# are shared by every process that maps the table. Locally administered
+# MACs (randomized by phones and laptops) are flagged without a lookup.
+# Dependency: csv, mmap, re, struct
+
+
+import csv
+import mmap
+import os
+import re
+import struct
+from functools import lru_cache
+from modules.checkpoint import write_atomic
+from modules.stages import get_path
+from modules.stages import get_record
+from modules.stages import iter_records
+
+
+OUI_TABLE_FILE = "horang_oui.bin"
+OUI_TABLE_MAGIC = b"HOUI"
+OUI_TABLE_VERSION = 1
+# magic, version, sections
+OUI_HEADER = struct.Struct("<4sHH")
+# prefix bits, entries, offset of the first entry
+OUI_SECTION = struct.Struct("<BII")
+# prefix, vendor name offset and length
+OUI_ENTRY = struct.Struct("<QIH")
+# recent MACs and their vendors
+OUI_CACHE = 65536
+# MAC field (path in the record) and the field added with the vendor
+OUI_FIELDS = ((("mac",), "mac_oui"), (("orig_l2_addr",), "orig_l2_oui"),
+              (("resp_l2_addr",), "resp_l2_oui"), (("ether", "src_mac"), "src_mac_oui"),
+              (("ether", "dest_mac"), "dest_mac_oui"))
+
+OUI_TEXT_LINE = re.compile(r'^\s*([0-9A-Fa-f]{2})-([0-9A-Fa-f]{2})-([0-9A-Fa-f]{2})\s+\(hex\)\s+(.+?)\s*$')
+MAC_SEPARATORS = re.compile(r'[:\-.]')
+
+
+def parse_mac(value):
+    """
+        48-bit integer of a MAC - aa:bb:cc:dd:ee:ff, aa-bb-cc-dd-ee-ff or aabb.ccdd.eeff
+
+    Returns:
+        _int_: _MAC, None if it's not a MAC_
+    """
+    if not isinstance(value, str):
+        return None
+    digits = MAC_SEPARATORS.sub('', value)
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+def iter_oui_file(filepath):
+    """
+        assignments of an IEEE registry file - CSV (MA-L, MA-M, MA-S) or oui.txt
+
+    Yields:
+        _tuple_: _prefix bits, prefix and organization name_
+    """
+    with open(filepath, newline='', encoding='utf-8-sig', errors='replace') as file:
+        if filepath.lower().endswith(".csv"):
+            for row in csv.DictReader(file):
+                assignment = (row.get("Assignment") or "").strip()
+                name = (row.get("Organization Name") or "").strip()
+                try:
+                    yield len(assignment) * 4, int(assignment, 16), name
+                except ValueError:
+                    continue
+            return
+        for line in file:
+            match = OUI_TEXT_LINE.match(line)
+            if match:
+                yield 24, int("".join(match.group(1, 2, 3)), 16), match.group(4)
+
+
+def compile_oui_table(filepaths, target=OUI_TABLE_FILE):
+    """
+        compile the registry files into the binary prefix table
+
+    Args:
+        filepaths (_list_): _IEEE registry files_
+        target (_str_): _table file, replaced atomically_
+
+    Returns:
+        _int_: _entries in the table_
+    """
+    sections = {}
+    for filepath in filepaths:
+        for bits, prefix, name in iter_oui_file(filepath):
+            if 0 < bits <= 48 and name:
+                sections.setdefault(bits, {})[prefix] = name
+    names = bytearray()
+    offsets = {}
+    entries = []
+    # the longest prefixes first - MA-S, MA-M, then MA-L
+    for bits in sorted(sections, reverse=True):
+        for prefix, name in sorted(sections[bits].items()):
+            if name not in offsets:
+                offsets[name] = len(names)
+                names += name.encode('utf-8')[:0xffff]
+            entries.append((bits, prefix, offsets[name], len(name.encode('utf-8')[:0xffff])))
+    header_size = OUI_HEADER.size + OUI_SECTION.size * len(sections)
+    table = bytearray(OUI_HEADER.pack(OUI_TABLE_MAGIC, OUI_TABLE_VERSION, len(sections)))
+    offset = header_size
+    for bits in sorted(sections, reverse=True):
+        table += OUI_SECTION.pack(bits, len(sections[bits]), offset)
+        offset += OUI_ENTRY.size * len(sections[bits])
+    names_offset = offset
+    for _, prefix, name_offset, length in entries:
+        table += OUI_ENTRY.pack(prefix, names_offset + name_offset, length)
+    table += names
+    write_atomic(target, bytes(table))
+    return len(entries)
+
+
+class OUITable:
+    def __init__(self, filepath=OUI_TABLE_FILE):
+        """
+            compiled prefix table, memory-mapped read only
+        """
+        with open(filepath, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = OUI_HEADER.unpack_from(self.map, 0)
+        if magic != OUI_TABLE_MAGIC or version != OUI_TABLE_VERSION:
+            self.map.close()
+            raise ValueError(f"'{filepath}' is not an OUI table - compile it again")
+        self.sections = [OUI_SECTION.unpack_from(self.map, OUI_HEADER.size + OUI_SECTION.size * pos)
+                         for pos in range(count)]
+
+    def __len__(self):
+        return sum(count for _, count, _ in self.sections)
+
+    def lookup(self, mac):
+        """
+            vendor of the longest matching prefix
+
+        Args:
+            mac (_int_): _48-bit MAC_
+
+        Returns:
+            _str_: _vendor name, None if it's not assigned_
+        """
+        unpack = OUI_ENTRY.unpack_from
+        for bits, count, offset in self.sections:
+            key = mac >> (48 - bits)
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                prefix, name_offset, length = unpack(self.map, offset + middle * OUI_ENTRY.size)
+                if prefix < key:
+                    low = middle + 1
+                elif prefix > key:
+                    high = middle
+                else:
+                    return self.map[name_offset:name_offset + length].decode('utf-8', 'replace')
+        return None
+
+    def close(self):
+        self.map.close()
+
+
+def open_oui_table(filepaths, target=OUI_TABLE_FILE):
+    """
+        the compiled table - compiled again if a registry file is newer
+
+    Args:
+        filepaths (_str_): _comma separated IEEE registry files_
+        target (_str_): _table file_
+
+    Returns:
+        _OUITable_: _memory-mapped table_
+    """
+    sources = [filepath.strip() for filepath in str(filepaths).split(',') if filepath.strip()]
+    try:
+        stale = any(os.path.getmtime(source) > os.path.getmtime(target) for source in sources)
+    except FileNotFoundError:
+        stale = True
+    if stale:
+        if not sources:
+            raise ValueError("--oui needs the IEEE registry files - ex. --oui=oui.csv")
+        count = compile_oui_table(sources, target)
+        print(f'[INFO] OUI table "{target}" compiled with {count} prefixes', flush=True)
+    return OUITable(target)
+
+
+class OUIStage:
+    def __init__(self, table, fields=OUI_FIELDS, cache_size=OUI_CACHE):
+        """
+            vendor fields for the MAC fields of the records
+        """
+        self.table = table
+        self.fields = fields
+        self.lookup = lru_cache(maxsize=cache_size)(self.find)
+
+    def find(self, value):
+        """
+            vendor values of a MAC
+
+        Args:
+            value (_str_): _MAC_
+
+        Returns:
+            _dict_: _vendor, or local for locally administered MACs, None if unknown_
+        """
+        mac = parse_mac(value)
+        if mac is None:
+            return None
+        # U/L bit of the first octet - randomized or set by the admin, no vendor
+        if mac >> 40 & 0x02:
+            return {"local": True}
+        vendor = self.table.lookup(mac)
+        return {"vendor": vendor} if vendor else None
+
+    def process(self, index, documents):
+        lookup = self.lookup
+        for pos, record in iter_records(documents):
+            added = None
+            for path, target in self.fields:
+                value = get_path(record, path)
+                values = lookup(value) if isinstance(value, str) else None
+                if values is not None:
+                    added = added or {}
+                    # a copy per record - the cached values are shared
+                    added[target] = dict(values)
+            if added:
+                get_record(documents, pos).update(added)
+        return documents
+
+    def close(self):
+        self.table.close()
@@ -0,0 +1,258 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Reader plan - how to read a file, detected once per file identity.
+# The format, the Zeek TSV header (#separator, #set_separator, #empty_field,
+# #unset_field, #fields, #types) and the CSV header are parsed from one read
+# of the file head and cached until the file is rotated or truncated.
+# Dependency: gzip, re
+
+
+import gzip
+import re
+from collections import OrderedDict
+from modules.stream_reader import BOM
+from modules.csv_reader import CSV_TYPES
+from modules.csv_reader import detect_csv_types
+from modules.csv_reader import make_csv_parser
+from modules.csv_reader import parse_csv_header
+from modules.zeek_types import make_tsv_parser
+from modules.compact_rows import make_compact_tsv_parser
+
+
+# head bytes and lines for the detection
+PLAN_HEAD_BYTES = 64 * 1024
+PLAN_HEAD_LINES = 15
+# cached plans
+PLAN_CACHE_MAX = 10000
+# files read with a plan
+PLAN_EXTENSIONS = ("json", "csv", "log", "gz")
+
+
+class ReaderPlan:
+    def __init__(self, format=None):
+        """
+            detected format and header of a file
+            format: tsv, ndjson, document (one JSON), csv or None (unknown)
+        """
+        self.format = format
+        self.encoding = "utf-8"
+        self.fields = []
+        self.types = []
+        self.separator = "\t"
+        self.set_separator = ","
+        self.empty_field = "(empty)"
+        self.unset_field = "-"
+        self.path = ""
+        # byte offset after the header line (CSV)
+        self.header_end = 0
+        # a plan from an incomplete header is not cached
+        self.complete = False
+        # compiled row parser (typed Zeek TSV), None for the default parser
+        self.parse_line = None
+        # compiled CSV row parser (typed columns), None for strings
+        self.parse_row = None
+        # NDJSON lines passed through as raw bytes
+        self.raw = False
+        # a document that is one top-level array - read element by element
+        self.array = False
+
+
+def unescape_separator(value):
+    """
+        Zeek writes the separator escaped - ex. \\x09
+    """
+    return re.sub(r'\\x([0-9a-fA-F]{2})', lambda match: chr(int(match.group(1), 16)), value)
+
+
+def read_head(filepath):
+    """
+        the first bytes of the file, decompressed for gz
+
+    Returns:
+        _bytes_: _head of the file_
+    """
+    if filepath.lower().endswith("gz"):
+        with gzip.open(filepath, mode='rb') as file:
+            return file.read(PLAN_HEAD_BYTES)
+    with open(filepath, mode='rb') as file:
+        return file.read(PLAN_HEAD_BYTES)
+
+
+def split_header(line, separator):
+    """
+        Zeek header values after the key, by the separator or by spaces
+    """
+    values = line.rstrip('\r').split(separator)
+    if len(values) == 1:
+        values = [ele for ele in line.strip().split(' ') if ele]
+    return [ele.strip() for ele in values[1:]]
+
+
+def parse_zeek_header(plan, lines):
+    """
+        read the Zeek TSV header lines to the plan
+    """
+    for line in lines:
+        if not line.startswith('#'):
+            break
+        if line.startswith('#separator'):
+            value = line[len('#separator'):].strip()
+            plan.separator = unescape_separator(value) or plan.separator
+        elif line.startswith('#set_separator'):
+            plan.set_separator = (split_header(line, plan.separator) or [plan.set_separator])[0]
+        elif line.startswith('#empty_field'):
+            plan.empty_field = (split_header(line, plan.separator) or [plan.empty_field])[0]
+        elif line.startswith('#unset_field'):
+            plan.unset_field = (split_header(line, plan.separator) or [plan.unset_field])[0]
+        elif line.startswith('#path'):
+            plan.path = (split_header(line, plan.separator) or [""])[0]
+        elif line.startswith('#fields'):
+            plan.fields = split_header(line, plan.separator)
+        elif line.startswith('#types'):
+            plan.types = split_header(line, plan.separator)
+
+
+def detect_plan(filepath):
+    """
+        detect the format and parse the header from one read of the head
+
+    Args:
+        filepath (_str_): _full path and name_
+
+    Returns:
+        _ReaderPlan_: _plan of the file_
+    """
+    raw = read_head(filepath)
+    head = raw
+    plan = ReaderPlan()
+    if head.startswith(BOM):
+        plan.encoding = "utf-8-sig"
+        head = head[len(BOM):]
+    # only complete lines
+    complete = head.endswith(b'\n')
+    lines = head.split(b'\n')
+    if not complete:
+        lines = lines[:-1]
+    lines = [line.decode('utf-8', 'replace').rstrip('\r') for line in lines[:PLAN_HEAD_LINES]]
+    name = filepath.lower()
+
+    if name.endswith("csv"):
+        plan.format = "csv"
+        # a quoted header may span lines
+        header = parse_csv_header(raw)
+        if header is not None:
+            plan.fields, plan.header_end = header
+            plan.complete = True
+        return plan
+
+    records = [line.strip() for line in lines if line.strip() and not line.startswith('#')]
+    if name.endswith("json"):
+        # NDJSON if the first line is a JSON, otherwise one JSON document
+        first_line = lines[0].strip() if lines else ""
+        if first_line.startswith('{') and first_line.endswith('}'):
+            plan.format = "ndjson"
+        else:
+            plan.format = "document"
+            plan.array = head.lstrip().startswith(b'[')
+        plan.complete = len(head.strip()) > 0
+        return plan
+
+    # log and gz - JSON lines or Zeek TSV
+    if records and records[0].startswith('{'):
+        plan.format = "ndjson"
+        plan.complete = True
+        return plan
+    parse_zeek_header(plan, lines)
+    if plan.fields:
+        plan.format = "tsv"
+        # the header is complete once a data line or #types follows #fields
+        plan.complete = bool(plan.types) or len(records) > 0
+    elif records and ':' in records[0] and '\t' not in records[0]:
+        plan.format = "ndjson"
+        plan.complete = True
+    else:
+        # unknown once there are enough lines to tell
+        plan.complete = len(lines) >= PLAN_HEAD_LINES
+    return plan
+
+
+class PlanCache:
+    def __init__(self, max_plans=PLAN_CACHE_MAX, typed=True, time_format="epoch",
+                 passthrough=False, csv_types=CSV_TYPES, compact=False):
+        """
+            reader plans by file identity (st_dev, st_ino), least recently used out
+            Zeek TSV plans with #types get a typed row parser,
+            NDJSON plans pass the raw lines through in the passthrough mode,
+            CSV plans get a row parser typed by csv_types (off, auto or name:type),
+            TSV and CSV rows are compact rows (tuples of one schema) if compact
+        """
+        self.max_plans = max_plans
+        self.typed = typed
+        self.time_format = time_format
+        self.passthrough = passthrough
+        self.csv_types = csv_types
+        self.compact = compact
+        self.plans = OrderedDict()
+
+    def get(self, filepath, key=None):
+        """
+            cached plan of the file or a new one
+
+        Args:
+            filepath (_str_): _full path and name_
+            key (_tuple_): _(st_dev, st_ino), None to detect without caching_
+
+        Returns:
+            _ReaderPlan_: _plan of the file_
+        """
+        if key is not None:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                return plan
+        plan = detect_plan(filepath)
+        if self.typed and plan.format == "tsv" and len(plan.types) == len(plan.fields):
+            plan.parse_line = make_tsv_parser(plan, self.time_format, self.compact)
+        elif self.compact and plan.format == "tsv":
+            plan.parse_line = make_compact_tsv_parser(plan)
+        plan.raw = self.passthrough and plan.format == "ndjson"
+        if plan.format == "csv" and plan.complete and (self.csv_types != "off" or self.compact):
+            plan.parse_row = make_csv_parser(plan.fields, 
+                                             detect_csv_types(filepath, plan, self.csv_types),
+                                             self.compact)
+        if key is not None and plan.complete:
+            self.plans[key] = plan
+            if len(self.plans) > self.max_plans:
+                self.plans.popitem(last=False)
+        return plan
+
+    def invalidate(self, key):
+        self.plans.pop(key, None)
+
+    def set_passthrough(self, passthrough):
+        """
+            switch the passthrough mode - ex. off when a stage needs the fields
+        """
+        if passthrough != self.passthrough:
+            self.passthrough = passthrough
+            self.plans.clear()
@@ -0,0 +1,143 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Sharded reader for one large line-format file (Zeek TSV, NDJSON).
+# The file is mmap'ed and split at new lines into byte-range shards that
+# worker processes parse on their own cores. A worker returns NDJSON lines
+# (bytes) ready for the _bulk body instead of pickled dicts, and the shard
+# ranges merge back into one monotonic position for the checkpoint.
+# Dependency: mmap, os
+
+
+import heapq
+import mmap
+import os
+from modules import json_codec
+from modules.json_convert import get_line_parser
+from modules.reader_plan import PlanCache
+from modules.stream_reader import BOM
+from modules.stream_reader import iter_chunk_lines
+
+
+# files with more unread bytes than this are sharded
+SHARD_MIN_BYTES = 256 * 1024 * 1024
+# bytes per shard
+SHARD_BYTES = 32 * 1024 * 1024
+# formats with one record per line
+SHARD_FORMATS = ("tsv", "ndjson")
+
+
+def split_shards(filepath, start=0, end=None, shard_bytes=SHARD_BYTES):
+    """
+        byte ranges of about shard_bytes that start and end at new lines
+
+    Args:
+        filepath (_str_): _full path and name_
+        start (_int_): _first byte (start of a line)_
+        end (_int_): _last byte (exclusive), the end of the last full line by default_
+        shard_bytes (_int_): _target shard size_
+
+    Returns:
+        _list_: _(start, end) of the shards_
+    """
+    shards = []
+    with open(filepath, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return shards
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if end is None:
+                # a line still being written is left for the tail reader
+                end = view.rfind(b'\n', start) + 1
+            end = min(end, size)
+            while start < end:
+                boundary = view.find(b'\n', min(start + shard_bytes, end) - 1, end)
+                stop = end if boundary == -1 else boundary + 1
+                shards.append((start, stop))
+                start = stop
+    return shards
+
+
+def parse_shard(filepath, start, end, settings):
+    """
+        parse one shard to NDJSON lines - runs in a worker process
+
+    Args:
+        filepath (_str_): _full path and name_
+        start (_int_): _first byte of the shard_
+        end (_int_): _end of the shard_
+        settings (_dict_): _plan options (typed, time_format, passthrough) and json_backend_
+
+    Returns:
+        _list_: _serialized documents (bytes) without new lines_
+    """
+    if settings.get("json_backend") and settings["json_backend"] != json_codec.codec.name:
+        json_codec.set_codec(settings["json_backend"])
+    plan = PlanCache(typed=settings["typed"], time_format=settings["time_format"],
+                     passthrough=settings["passthrough"]).get(filepath)
+    parser = get_line_parser(plan)
+    if parser is None or plan.format not in SHARD_FORMATS:
+        raise ValueError(f"{plan.format} is not a line format")
+    parse_line = parser[0]
+    dumps = json_codec.dumps
+    documents = []
+    with open(filepath, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            chunk = view[start:end]
+    if start == 0 and chunk.startswith(BOM):
+        chunk = chunk[len(BOM):]
+    for line, _ in iter_chunk_lines((chunk,), start):
+        record = parse_line(line)
+        if record is None:
+            continue
+        documents.append(bytes(record) if plan.raw else dumps(record))
+    return documents
+
+
+class ShardCommitter:
+    def __init__(self, start):
+        """
+            one monotonic position from shards that finish in any order
+            the position moves only over a contiguous run of finished shards
+        """
+        self.position = start
+        self.finished = []
+
+    def done(self, start, end):
+        """
+            a shard is shipped
+
+        Args:
+            start (_int_): _first byte of the shard_
+            end (_int_): _end of the shard_
+
+        Returns:
+            _int_: _new position to commit, None if it did not move_
+        """
+        heapq.heappush(self.finished, (start, end))
+        moved = False
+        while self.finished and self.finished[0][0] <= self.position:
+            _, stop = heapq.heappop(self.finished)
+            if stop > self.position:
+                self.position = stop
+                moved = True
+        return self.position if moved else None
@@ -0,0 +1,305 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Disk spool (write-ahead log) between the readers and the SIEM.
+# Parsed batches are appended to segment files - length, CRC32 and the
+# index with the NDJSON documents - and fsync'd before the file position is
+# committed, so every byte is parsed once even while Elasticsearch is down.
+# A sender thread ships the batches in order and records the delivered
+# position; delivered segments are deleted and a torn record at the end of
+# the last segment (crash during the write) is cut off at start up.
+# Dependency: json, os, struct, threading, zlib
+
+
+import json
+import os
+import struct
+import threading
+import zlib
+from modules.checkpoint import write_atomic
+from modules.json_load import BULK_RETRY_BACKOFF
+from modules.json_load import BULK_RETRY_BACKOFF_MAX
+from modules.json_load import serialize_document
+
+
+SPOOL_DIR = "horang_spool"
+# a new segment after this many bytes
+SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024
+# undelivered bytes - the readers wait (positions are not committed) above it
+SPOOL_MAX_BYTES = 1024 * 1024 * 1024
+SPOOL_STATE_FILE = "spool_state.json"
+SPOOL_SEGMENT_SUFFIX = ".wal"
+# payload length and CRC32 of the payload
+RECORD_HEADER = struct.Struct("<II")
+
+
+class SpoolEntry:
+    def __init__(self, index, documents, segment, end):
+        """
+            one spooled batch and the position after it
+        """
+        self.index = index
+        self.documents = documents
+        self.segment = segment
+        self.end = end
+
+
+def get_segment_name(segment):
+    return f"{segment:012d}{SPOOL_SEGMENT_SUFFIX}"
+
+
+def encode_record(index, documents):
+    """
+        one batch as a spool record
+
+    Args:
+        index (_str_): _index name_
+        documents (_list_): _JSONs, raw JSON lines or compact rows_
+
+    Returns:
+        _bytes_: _header and payload - the index line and one document per line_
+    """
+    lines = [json.dumps({"index": index, "count": len(documents)}).encode('utf-8')]
+    lines.extend(bytes(serialize_document(document)) for document in documents)
+    payload = b'\n'.join(lines)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_record(file):
+    """
+        the next record of the segment
+
+    Returns:
+        _tuple_: _index and documents (bytes), None at the end or at a torn record_
+    """
+    header = file.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    length, crc = RECORD_HEADER.unpack(header)
+    payload = file.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    lines = payload.split(b'\n')
+    meta = json.loads(lines[0])
+    return meta["index"], lines[1:1 + meta["count"]]
+
+
+class Spool:
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 max_bytes=SPOOL_MAX_BYTES):
+        """
+            segmented write-ahead log of the batches, replayed after a restart
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.lock = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self.state_path = os.path.join(directory, SPOOL_STATE_FILE)
+        # delivered position - segment and byte offset
+        self.acked = self.load_state()
+        self.segments = self.list_segments()
+        self.recover()
+        self.file = None
+        self.open_segment(self.segments[-1] if self.segments else self.acked[0])
+
+    def load_state(self):
+        try:
+            with open(self.state_path, "rb") as file:
+                segment, offset = json.loads(file.read())["acked"]
+            return [int(segment), int(offset)]
+        except FileNotFoundError:
+            return [1, 0]
+        except (ValueError, KeyError, TypeError) as err:
+            print(f'[ERROR] Ignoring the broken spool state "{self.state_path}" - {err}', 
+                  flush=True)
+            return [1, 0]
+
+    def list_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SPOOL_SEGMENT_SUFFIX) and name[:-len(SPOOL_SEGMENT_SUFFIX)].isdigit():
+                segments.append(int(name[:-len(SPOOL_SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def get_path(self, segment):
+        return os.path.join(self.directory, get_segment_name(segment))
+
+    def recover(self):
+        """
+            cut a torn record off the last segment and drop the delivered segments
+        """
+        for segment in [segment for segment in self.segments if segment < self.acked[0]]:
+            os.remove(self.get_path(segment))
+            self.segments.remove(segment)
+        if not self.segments:
+            return
+        path = self.get_path(self.segments[-1])
+        with open(path, "rb") as file:
+            end = 0
+            while read_record(file) is not None:
+                end = file.tell()
+            size = file.seek(0, os.SEEK_END)
+        if end < size:
+            print(f'[ERROR] Spool segment "{path}" ends with a torn record; '
+                  f'{size - end} byte(s) cut off', flush=True)
+            with open(path, "r+b") as file:
+                file.truncate(end)
+
+    def open_segment(self, segment):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.get_path(segment), "ab")
+        if segment not in self.segments:
+            self.segments.append(segment)
+        self.segment = segment
+
+    def get_pending_bytes(self):
+        """
+            bytes not delivered yet
+        """
+        size = 0
+        for segment in self.segments:
+            if segment == self.segment:
+                size += self.file.tell()
+            else:
+                size += os.path.getsize(self.get_path(segment))
+        return max(0, size - self.acked[1])
+
+    def append(self, index, documents):
+        """
+            write one batch, durable before the file position is committed
+
+        Args:
+            index (_str_): _index name_
+            documents (_list_): _JSONs, raw JSON lines or compact rows_
+
+        Returns:
+            _bool_: _False if the spool is full - the batch is not written_
+        """
+        record = encode_record(index, documents)
+        with self.lock:
+            pending = self.get_pending_bytes()
+            if pending > 0 and pending + len(record) > self.max_bytes:
+                return False
+            if self.file.tell() > 0 and self.file.tell() + len(record) > self.segment_bytes:
+                self.open_segment(self.segment + 1)
+            self.file.write(record)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.lock.notify_all()
+        return True
+
+    def next(self, timeout=None):
+        """
+            the oldest batch not delivered
+
+        Args:
+            timeout (_float_): _maximum wait in seconds for a new batch or a wake up_
+
+        Returns:
+            _SpoolEntry_: _batch, None if there is nothing to send_
+        """
+        with self.lock:
+            entry = self.read_acked()
+            if entry is None and timeout != 0:
+                self.lock.wait(timeout)
+                entry = self.read_acked()
+            return entry
+
+    def wake_up(self):
+        with self.lock:
+            self.lock.notify_all()
+
+    def read_acked(self):
+        """
+            the record at the delivered position - the next segment at the end of one
+        """
+        segment, offset = self.acked
+        while segment <= self.segment:
+            if segment in self.segments:
+                with open(self.get_path(segment), "rb") as file:
+                    file.seek(offset)
+                    record = read_record(file)
+                    if record is not None:
+                        return SpoolEntry(record[0], record[1], segment, file.tell())
+            if segment == self.segment:
+                return None
+            segment, offset = segment + 1, 0
+        return None
+
+    def ack(self, entry):
+        """
+            record the batch as delivered, delete the segments before it
+        """
+        with self.lock:
+            self.acked = [entry.segment, entry.end]
+            write_atomic(self.state_path, json.dumps({"acked": self.acked}).encode('utf-8'))
+            for segment in [segment for segment in self.segments if segment < entry.segment]:
+                os.remove(self.get_path(segment))
+                self.segments.remove(segment)
+            self.lock.notify_all()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class SpoolSender(threading.Thread):
+    def __init__(self, spool, send):
+        """
+            ships the spooled batches in order, retried with a backoff
+
+        Args:
+            spool (_Spool_): _spool to drain_
+            send (_callable_): _send(index, documents) - True if the batch is delivered_
+        """
+        super().__init__(name="horang-spool", daemon=True)
+        self.spool = spool
+        self.send = send
+        self.stopped = threading.Event()
+
+    def run(self):
+        backoff = BULK_RETRY_BACKOFF
+        while not self.stopped.is_set():
+            entry = self.spool.next(timeout=1)
+            if entry is None:
+                continue
+            try:
+                delivered = self.send(entry.index, entry.documents)
+            except Exception as err:
+                print(f'[ERROR] Spool sender - {err}', flush=True)
+                delivered = False
+            if delivered:
+                self.spool.ack(entry)
+                backoff = BULK_RETRY_BACKOFF
+            else:
+                # the SIEM is down or rejects the requests - same batch again later
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, BULK_RETRY_BACKOFF_MAX)
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.spool.wake_up()
+        self.join(timeout)
@@ -0,0 +1,142 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Enrichment stages between the readers and the sink.
+# A stage takes one batch of records with the index name and returns it
+# with its fields added; the pipeline runs the stages in order. Raw JSON
+# lines (passthrough) have no fields - a stage that reads only a few keys
+# of them (raw_lines, ex. threat intel) keeps the passthrough, the forwarder
+# turns it off for the other stages.
+# Dependency: -
+
+
+from modules import json_codec
+from modules.compact_rows import CompactRow
+
+
+def iter_records(documents):
+    """
+        records with fields - dicts and compact rows, both with get()
+
+    Yields:
+        _tuple_: _position and record_
+    """
+    for pos, record in enumerate(documents):
+        if isinstance(record, (dict, CompactRow)):
+            yield pos, record
+
+
+def iter_raw_lines(documents):
+    """
+        raw JSON lines of the passthrough
+
+    Yields:
+        _tuple_: _position and line (bytes or memoryview)_
+    """
+    for pos, record in enumerate(documents):
+        if isinstance(record, (bytes, bytearray, memoryview)):
+            yield pos, record
+
+
+def get_path(record, path):
+    """
+        value of a field - nested objects by the path (ex. Suricata ether.src_mac)
+
+    Args:
+        record (_dict_): _record or compact row_
+        path (_tuple_): _field names from the top_
+
+    Returns:
+        _object_: _value, None if a field is missing_
+    """
+    value = record.get(path[0])
+    for name in path[1:]:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def get_record(documents, pos):
+    """
+        the record at the position as a dict to add fields to
+        a compact row or a raw JSON line is replaced by its dict, other lines give None
+
+    Args:
+        documents (_list_): _records of the batch_
+        pos (_int_): _position_
+
+    Returns:
+        _dict_: _record, None for raw JSON lines_
+    """
+    record = documents[pos]
+    if isinstance(record, dict):
+        return record
+    if isinstance(record, CompactRow):
+        record = documents[pos] = record.to_dict()
+        return record
+    if isinstance(record, (bytes, bytearray, memoryview)):
+        record = documents[pos] = json_codec.loads(bytes(record))
+        return record
+    return None
+
+
+class StagePipeline:
+    def __init__(self, stages=None):
+        """
+            enrichment stages in order - ex. GeoIP, then threat intel
+            stage.process(index, documents) returns the batch,
+            stage.close() (optional) saves the state of a stateful stage
+        """
+        self.stages = list(stages or [])
+
+    def add(self, stage):
+        self.stages.append(stage)
+
+    def __bool__(self):
+        return len(self.stages) > 0
+
+    def needs_fields(self):
+        """
+            True if a stage works on decoded records only - the passthrough goes off
+        """
+        return any(not getattr(stage, "raw_lines", False) for stage in self.stages)
+
+    def apply(self, index, documents):
+        """
+            run the stages on one batch
+
+        Args:
+            index (_str_): _index name of the batch_
+            documents (_list_): _records_
+
+        Returns:
+            _list_: _records with the added fields_
+        """
+        for stage in self.stages:
+            documents = stage.process(index, documents)
+        return documents
+
+    def close(self):
+        for stage in self.stages:
+            if hasattr(stage, "close"):
+                stage.close()
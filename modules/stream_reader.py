@@ -0,0 +1,179 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Bounded-memory streaming reader for the line formats (NDJSON, TSV, CSV).
+# Files are read in binary mode in chunks; every line carries the exact byte
+# offset after it, so the pointer needs no re-encoding and can resume anywhere.
+# Dependency: os, time
+
+
+import os
+import time
+
+
+BOM = b'\xef\xbb\xbf'
+# read size from the disk
+READ_CHUNK_BYTES = 1024 * 1024
+# limits per read - the rest of the file is read with the next call
+READ_MAX_BYTES = 64 * 1024 * 1024
+READ_MAX_RECORDS = 100000
+# a last line without a new line is read only when the file is quiet
+TAIL_QUIET_SECONDS = 5
+
+
+def is_quiet(filepath, stat=None):
+    """
+        True if the file has not been written for TAIL_QUIET_SECONDS
+
+    Args:
+        filepath (_str_): _full path and name_
+        stat (_os.stat_result_): _stat of the file if it's known_
+    """
+    try:
+        stat = os.stat(filepath) if stat is None else stat
+    except OSError:
+        return True
+    return time.time() - stat.st_mtime > TAIL_QUIET_SECONDS
+
+
+def iter_chunk_lines(chunks, offset=0, max_bytes=None, final=True, views=False, rest=None):
+    """
+        lines of a stream of byte chunks with the offset after each line
+
+    Args:
+        chunks (_iterable_): _bytes in order (file reads or decompressed blocks)_
+        offset (_int_): _byte offset of the first chunk_
+        max_bytes (_int_): _stop after this many bytes, None for the whole stream_
+        final (_bool or callable_): _yield the last line even without a new line_
+        views (_bool_): _yield memoryview slices of the buffer instead of copies_
+        rest (_list_): _gets the bytes read but not yielded when the lines stop_
+
+    Yields:
+        _tuple_: _line without the new line (bytes) and the byte offset after it_
+    """
+    start = offset
+    buffer = pending = b''
+    pos = 0
+    try:
+        for chunk in chunks:
+            buffer = pending + chunk if pending else chunk
+            view = memoryview(buffer) if views else buffer
+            pos = 0
+            while True:
+                newline = buffer.find(b'\n', pos)
+                if newline == -1:
+                    break
+                end = newline - 1 if newline > pos and buffer[newline - 1] == 0x0d else newline
+                line = view[pos:end]
+                offset += newline + 1 - pos
+                pos = newline + 1
+                yield line, offset
+                if max_bytes is not None and offset - start >= max_bytes:
+                    return
+            pending = buffer[pos:]
+            buffer = pending
+            pos = 0
+        if pending and (final() if callable(final) else final):
+            offset += len(pending)
+            buffer = b''
+            yield pending.rstrip(b'\r'), offset
+    finally:
+        if rest is not None:
+            rest.append(bytes(buffer[pos:]))
+
+
+def iter_lines(filepath, pointer=0, max_bytes=None, final=True, chunk_size=READ_CHUNK_BYTES,
+               views=False):
+    """
+        lines of the file from the pointer, binary mode
+
+    Args:
+        filepath (_str_): _full path and name_
+        pointer (_int_): _byte offset to start from (start of a line)_
+        max_bytes (_int_): _stop after this many bytes, None for the whole file_
+        final (_bool_): _yield the last line even without a new line_
+        chunk_size (_int_): _read size_
+        views (_bool_): _yield memoryview slices of the read buffer instead of copies_
+
+    Yields:
+        _tuple_: _line without the new line (bytes) and the byte offset after it_
+    """
+    with open(filepath, 'rb') as file:
+        offset = pointer
+        if pointer == 0:
+            # UTF-8 BOM is not part of the first line
+            if file.read(len(BOM)) == BOM:
+                offset = len(BOM)
+            else:
+                file.seek(0)
+        else:
+            file.seek(pointer)
+        chunks = iter(lambda: file.read(chunk_size), b'')
+        yield from iter_chunk_lines(chunks, offset, max_bytes, final, views)
+
+
+def iter_record_chunks(filepath, pointer, parse_line, max_bytes=READ_MAX_BYTES,
+                       max_records=READ_MAX_RECORDS, final=True, views=False,
+                       line_reader=iter_lines):
+    """
+        records in chunks with the resumable pointer after each chunk
+
+    Args:
+        filepath (_str_): _full path and name_
+        pointer (_int_): _byte offset to start from_
+        parse_line (_callable_): _line (bytes) to a record, None to skip the line_
+        max_bytes (_int_): _maximum bytes per chunk_
+        max_records (_int_): _maximum records per chunk_
+        final (_bool_): _read the last line even without a new line_
+        views (_bool_): _lines as memoryview slices (raw passthrough)_
+        line_reader (_callable_): _iter_lines or a reader with its arguments (gzip)_
+
+    Yields:
+        _list_: _records and the pointer after them_
+    """
+    data = []
+    start = pointer
+    for line, offset in line_reader(filepath, pointer, None, final, views=views):
+        pointer = offset
+        record = parse_line(line)
+        if record is not None:
+            data.append(record)
+        if len(data) >= max_records or pointer - start >= max_bytes:
+            yield [data, pointer]
+            data = []
+            start = pointer
+    if data or pointer != start:
+        yield [data, pointer]
+
+
+def read_records(filepath, pointer, parse_line, max_bytes=READ_MAX_BYTES,
+                 max_records=READ_MAX_RECORDS, final=True, views=False, line_reader=iter_lines):
+    """
+        the first chunk of records from the pointer
+
+    Returns:
+        _list_: _records and the pointer after them_
+    """
+    for chunk in iter_record_chunks(filepath, pointer, parse_line, max_bytes,
+                                    max_records, final, views, line_reader):
+        return chunk
+    return [[], pointer]
@@ -0,0 +1,403 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Threat intel stage - every record is matched against local IOC feeds
+# (IPs/CIDRs, domains, URLs and file hashes, one indicator per line or
+# Zeek intel files). Addresses and hashes are hash lookups, domains and
+# URL hosts walk a reversed-label trie. Changed feeds are loaded into a
+# new index by a background thread and swapped in one assignment. Raw
+# NDJSON lines (passthrough) are matched on the few fields extracted from
+# them and only a line with a match is decoded to add the field.
+# Dependency: threading
+
+
+import os
+import re
+import threading
+from functools import lru_cache
+from modules import json_codec
+from modules.geoip import parse_ip
+from modules.geoip import parse_network
+from modules.stages import get_path
+from modules.stages import get_record
+from modules.stages import iter_raw_lines
+from modules.stages import iter_records
+
+
+# field added with the matches
+INTEL_FIELD = "threat_intel"
+# seconds between the checks for changed feeds, 0 to load them once
+INTEL_RELOAD_SECONDS = 60
+# recent addresses and their matches per index
+INTEL_CACHE = 65536
+INTEL_IP_FIELDS = (("id.orig_h",), ("id.resp_h",), ("src_ip",), ("dest_ip",))
+# Zeek dns/http/ssl, Suricata dns/http/tls
+INTEL_DOMAIN_FIELDS = (("query",), ("host",), ("server_name",), ("dns", "rrname"),
+                       ("http", "hostname"), ("tls", "sni"))
+# host and URI fields of a URL
+INTEL_URL_FIELDS = ((("host",), ("uri",)), (("http", "hostname"), ("http", "url")))
+# Zeek files.log, Suricata fileinfo
+INTEL_HASH_FIELDS = (("md5",), ("sha1",), ("sha256",), ("fileinfo", "md5"),
+                     ("fileinfo", "sha1"), ("fileinfo", "sha256"))
+
+HASH_LENGTHS = (32, 40, 64)
+HEX_DIGITS = re.compile(r'^[0-9a-f]+$')
+DOMAIN_NAME = re.compile(r'^[a-z0-9_-]+(\.[a-z0-9_-]+)+$')
+FEED_COLUMNS = re.compile(r'[\t,; ]')
+
+
+def classify_indicator(value):
+    """
+        type of an indicator - ip, cidr, hash, url or domain
+
+    Returns:
+        _tuple_: _type, the normalized indicator and its parsed key (network
+                 of an IP/CIDR, host and path of a URL), None if it's not one_
+    """
+    value = value.strip().lower()
+    if len(value) in HASH_LENGTHS and HEX_DIGITS.match(value):
+        return "hash", value, None
+    # only a digit or a colon can start an address - no failed parses for names
+    if value[:1].isdigit() or ':' in value[:5]:
+        network = parse_network(value)
+        if network is not None:
+            return ("cidr" if '/' in value else "ip"), value, network
+    if "://" in value or '/' in value:
+        url = normalize_url(value)
+        return ("url", value, url) if url is not None else None
+    # wildcard domains match the subdomains anyway
+    if value.startswith("*."):
+        value = value[2:]
+    value = value.rstrip('.')
+    if DOMAIN_NAME.match(value):
+        return "domain", value, None
+    return None
+
+
+def normalize_url(value):
+    """
+        host and path of a URL, with or without the scheme
+
+    Returns:
+        _tuple_: _lower case host and path ("/" at least), None without a host_
+    """
+    _, separator, rest = value.strip().partition("://")
+    if not separator:
+        rest = value.strip()
+    host, _, path = rest.partition('/')
+    # user info and port
+    host = host.rsplit('@', 1)[-1]
+    if host.startswith('['):
+        host = host[1:host.find(']')]
+    else:
+        host = host.split(':', 1)[0]
+    host = host.lower().rstrip('.')
+    if not host:
+        return None
+    return host, '/' + path
+
+
+def iter_feed(filepath):
+    """
+        indicators of a feed - the first column of every line, comments skipped
+        (plain lists, CSV and Zeek intel files)
+
+    Yields:
+        _tuple_: _type, indicator and key - see classify_indicator_
+    """
+    with open(filepath, encoding='utf-8', errors='replace') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            classified = classify_indicator(FEED_COLUMNS.split(line, 1)[0])
+            if classified is not None:
+                yield classified
+
+
+def get_feed_state(filepaths):
+    """
+        modification time and size of the feeds, None for a missing feed
+    """
+    state = {}
+    for filepath in filepaths:
+        try:
+            stat = os.stat(filepath)
+            state[filepath] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            state[filepath] = None
+    return state
+
+
+class IntelIndex:
+    def __init__(self, cache_size=INTEL_CACHE):
+        """
+            indicators by type - a match gives (indicator, type, feed)
+            networks: hash tables per IP version and prefix length, longest first
+            domains: trie of reversed labels, None holds a domain indicator,
+            "/" the path prefixes of the URL indicators for the host
+        """
+        self.networks = {4: {}, 6: {}}
+        self.prefixes = {4: [], 6: []}
+        self.hashes = {}
+        self.domains = {}
+        self.urls = 0
+        self.count = 0
+        self.match_ip = lru_cache(maxsize=cache_size)(self.find_ip)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, kind, indicator, feed, key=None):
+        """
+            index one indicator - the first feed of a duplicate wins
+        """
+        meta = (indicator, kind, feed)
+        if kind in ("ip", "cidr"):
+            version, first, last = key or parse_network(indicator)
+            bits = 32 if version == 4 else 128
+            prefix = bits - (last - first).bit_length()
+            self.networks[version].setdefault(prefix, {}).setdefault(first >> (bits - prefix), meta)
+        elif kind == "hash":
+            self.hashes.setdefault(indicator, meta)
+        elif kind == "domain":
+            node = self.get_node(indicator)
+            node.setdefault(None, meta)
+        elif kind == "url":
+            host, path = key or normalize_url(indicator)
+            self.get_node(host).setdefault("/", []).append((path, meta))
+            self.urls += 1
+        else:
+            return
+        self.count += 1
+
+    def get_node(self, domain):
+        node = self.domains
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        return node
+
+    def load(self, filepaths):
+        """
+            index the feeds
+
+        Args:
+            filepaths (_list_): _feed files_
+
+        Returns:
+            _IntelIndex_: _self_
+        """
+        for filepath in filepaths:
+            feed = os.path.basename(filepath)
+            for kind, indicator, key in iter_feed(filepath):
+                self.add(kind, indicator, feed, key)
+        for version in (4, 6):
+            self.prefixes[version] = sorted(self.networks[version], reverse=True)
+        self.sort_paths(self.domains)
+        return self
+
+    def sort_paths(self, node):
+        # the longest URL prefix is checked first
+        for label, child in node.items():
+            if label == "/":
+                child.sort(key=lambda item: len(item[0]), reverse=True)
+            elif label is not None:
+                self.sort_paths(child)
+
+    def find_ip(self, address):
+        """
+            the most specific network (or address) with the address
+        """
+        parsed = parse_ip(address)
+        if parsed is None:
+            return None
+        version, ip = parsed
+        bits = 32 if version == 4 else 128
+        networks = self.networks[version]
+        for prefix in self.prefixes[version]:
+            meta = networks[prefix].get(ip >> (bits - prefix))
+            if meta is not None:
+                return meta
+        return None
+
+    def match_domain(self, host):
+        """
+            the longest indicator domain the host is or is under
+        """
+        node, found = self.domains, None
+        for label in reversed(host.lower().rstrip('.').split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
+
+    def match_url(self, host, path):
+        """
+            a URL indicator of the host whose path the URL starts with
+        """
+        node = self.domains
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+        for prefix, meta in node.get("/", ()):
+            if path.startswith(prefix):
+                return meta
+        return None
+
+    def match_hash(self, value):
+        return self.hashes.get(value.lower())
+
+
+class IntelReloader(threading.Thread):
+    def __init__(self, stage, interval=INTEL_RELOAD_SECONDS):
+        """
+            checks the feeds and builds a new index when one has changed
+        """
+        super().__init__(name="horang-intel", daemon=True)
+        self.stage = stage
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.stage.reload()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.join(timeout)
+
+
+class ThreatIntelStage:
+    # raw JSON lines are matched without a full decode
+    raw_lines = True
+
+    def __init__(self, filepaths, reload_seconds=INTEL_RELOAD_SECONDS, field=INTEL_FIELD):
+        """
+            IOC matches of the records, a list in the field
+            the feeds are loaded here - a missing feed raises OSError
+        """
+        self.filepaths = list(filepaths)
+        self.field = field
+        self.state = get_feed_state(self.filepaths)
+        self.index = IntelIndex().load(self.filepaths)
+        self.reloader = None
+        if reload_seconds > 0:
+            self.reloader = IntelReloader(self, reload_seconds)
+            self.reloader.start()
+
+    def reload(self):
+        """
+            a new index if a feed has changed, the old one is kept on an error
+            the batches in progress finish with the index they started with
+
+        Returns:
+            _bool_: _True if the index is swapped_
+        """
+        state = get_feed_state(self.filepaths)
+        if state == self.state:
+            return False
+        try:
+            index = IntelIndex().load(self.filepaths)
+        except OSError as err:
+            print(f'[ERROR] Threat intel feeds are not reloaded - {err}', flush=True)
+            return False
+        self.index = index
+        self.state = state
+        print(f'[INFO] Threat intel reloaded: {len(index)} indicators', flush=True)
+        return True
+
+    def get_matchers(self, intel):
+        """
+            fields to check with the index - only the indicator types it has
+
+        Returns:
+            _list_: _first field name, nested names, path and the match method_
+        """
+        matchers = []
+        networks = intel.prefixes[4] or intel.prefixes[6]
+        for paths, method, present in ((INTEL_IP_FIELDS, intel.match_ip, networks),
+                                       (INTEL_DOMAIN_FIELDS, intel.match_domain, intel.domains),
+                                       (INTEL_HASH_FIELDS, intel.match_hash, intel.hashes)):
+            if present:
+                matchers.extend((path[0], path[1:], path, method) for path in paths)
+        return matchers
+
+    def match(self, intel, matchers, record):
+        """
+            matches of one record
+
+        Returns:
+            _list_: _field, indicator, type and feed of the matches, None if none_
+        """
+        found = []
+        get = record.get
+        for first, nested, path, method in matchers:
+            value = get(first)
+            for name in nested:
+                value = value.get(name) if isinstance(value, dict) else None
+            if value and isinstance(value, str):
+                meta = method(value)
+                if meta is not None:
+                    found.append((path, meta))
+        if intel.urls:
+            for host_path, uri_path in INTEL_URL_FIELDS:
+                uri = get_path(record, uri_path)
+                if not isinstance(uri, str):
+                    continue
+                host = get_path(record, host_path)
+                # proxies log the absolute URI
+                url = normalize_url(uri) if "://" in uri else \
+                      normalize_url(f"{host}/{uri.lstrip('/')}") if isinstance(host, str) else None
+                meta = intel.match_url(*url) if url is not None else None
+                if meta is not None:
+                    found.append((uri_path, meta))
+        if not found:
+            return None
+        return [{"field": ".".join(path), "indicator": indicator, "type": kind, "feed": feed}
+                for path, (indicator, kind, feed) in found]
+
+    def process(self, index, documents):
+        # one index for the whole batch - a reload only swaps the reference
+        intel = self.index
+        matchers = self.get_matchers(intel)
+        for pos, record in iter_records(documents):
+            matches = self.match(intel, matchers, record)
+            if matches:
+                get_record(documents, pos)[self.field] = matches
+        keys = {matcher[0] for matcher in matchers}
+        if intel.urls:
+            keys.update(path[0] for paths in INTEL_URL_FIELDS for path in paths)
+        for pos, line in iter_raw_lines(documents):
+            try:
+                fields = json_codec.extract(line, keys)
+            except json_codec.DecodeError:
+                continue
+            matches = self.match(intel, matchers, fields) if fields else None
+            if matches:
+                get_record(documents, pos)[self.field] = matches
+        return documents
+
+    def close(self):
+        if self.reloader is not None:
+            self.reloader.stop()
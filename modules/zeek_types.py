@@ -0,0 +1,177 @@
+# The MIT License
+#
+# Copyright (c) 2024 Dave Jang
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# Typed Zeek TSV conversion driven by the #types header.
+# Column converters are compiled once per file (reader plan) and applied
+# with one loop per row: count/int/port to int, interval/double to float,
+# time to epoch or ISO 8601, bool to true/false, set/vector to lists, and
+# the unset (-) and empty ((empty)) markers are dropped.
+# Dependency: datetime
+
+
+from datetime import datetime
+from datetime import timezone
+from modules.compact_rows import RowSchema
+from modules.compact_rows import SharedValues
+
+
+# time fields - epoch (float) or iso (ISO 8601 string and @timestamp)
+TIME_FORMATS = ("epoch", "iso")
+
+
+def to_bool(value):
+    return value == "T"
+
+
+def to_iso(value):
+    return datetime.fromtimestamp(float(value), timezone.utc)\
+                   .isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+def get_converter(zeek_type, set_separator=",", time_format="epoch"):
+    """
+        converter for one Zeek type
+
+    Args:
+        zeek_type (_str_): _type from #types - ex. count, set[string]_
+        set_separator (_str_): _Zeek #set_separator_
+        time_format (_str_): _epoch or iso_
+
+    Returns:
+        _callable_: _str to the typed value_
+    """
+    if zeek_type.startswith("set[") or zeek_type.startswith("vector["):
+        convert = get_converter(zeek_type[zeek_type.index("[") + 1:-1], 
+                                set_separator, time_format)
+        if convert is str:
+            return lambda value: value.split(set_separator)
+        return lambda value: [convert(ele) for ele in value.split(set_separator)]
+    if zeek_type in ("count", "int", "port"):
+        return int
+    if zeek_type in ("double", "interval"):
+        return float
+    if zeek_type == "time":
+        return to_iso if time_format == "iso" else float
+    if zeek_type == "bool":
+        return to_bool
+    # string, addr, subnet, enum, pattern and others
+    return str
+
+
+def compile_converters(types, set_separator=",", time_format="epoch"):
+    """
+        one converter per column
+
+    Args:
+        types (_list_): _Zeek #types_
+        set_separator (_str_): _Zeek #set_separator_
+        time_format (_str_): _epoch or iso_
+
+    Returns:
+        _list_: _converters in the column order_
+    """
+    return [get_converter(zeek_type, set_separator, time_format) for zeek_type in types]
+
+
+def make_tsv_parser(plan, time_format="epoch", compact=False):
+    """
+        typed row parser for the plan - compiled once per file
+
+    Args:
+        plan (_ReaderPlan_): _plan with the Zeek #fields and #types_
+        time_format (_str_): _epoch or iso_
+        compact (_bool_): _compact rows (tuples of one schema) instead of dicts_
+
+    Returns:
+        _callable_: _line (bytes) to a JSON, None for comments, empty or invalid lines_
+    """
+    fields = plan.fields
+    separator = plan.separator
+    columns = list(zip(fields, compile_converters(plan.types, plan.set_separator, time_format)))
+    width = len(fields)
+    skip = (plan.unset_field, plan.empty_field)
+    # @timestamp from ts for the ISO format
+    timestamp = time_format == "iso" and "ts" in fields
+    if compact:
+        # sets and vectors are lists - not shared
+        shared = [not zeek_type.endswith("]") for zeek_type in plan.types]
+        return make_compact_parser(columns, separator, skip, timestamp, shared)
+
+    def parse_line(line):
+        if not line or line[0] == 0x23:
+            # comment line - #
+            return None
+        values = line.decode('utf-8', 'replace').split(separator)
+        if len(values) != width:
+            return None
+        record = {}
+        for (name, convert), value in zip(columns, values):
+            if value in skip:
+                continue
+            try:
+                record[name] = convert(value)
+            except ValueError:
+                record[name] = value
+        if timestamp and "ts" in record:
+            record["@timestamp"] = record["ts"]
+        return record
+
+    return parse_line
+
+
+def make_compact_parser(columns, separator, skip, timestamp, shared=None):
+    """
+        typed row parser to compact rows - None for the dropped values,
+        @timestamp is the last column for the ISO format
+    """
+    fields = [name for name, _ in columns]
+    converters = [convert for _, convert in columns]
+    width = len(fields)
+    row = RowSchema(fields + ["@timestamp"] if timestamp else fields).row
+    position = fields.index("ts") if timestamp else None
+    sharing = SharedValues(width, shared)
+    # a column that stops sharing is set to None in this list
+    tables = sharing.tables
+
+    def parse_line(line):
+        if not line or line[0] == 0x23:
+            # comment line - #
+            return None
+        values = line.decode('utf-8', 'replace').split(separator)
+        if len(values) != width:
+            return None
+        record = []
+        for convert, table, value in zip(converters, tables, values):
+            if value in skip:
+                record.append(None)
+                continue
+            try:
+                value = convert(value)
+            except ValueError:
+                pass
+            record.append(value if table is None else table.setdefault(value, value))
+        sharing.tick()
+        if timestamp:
+            record.append(record[position])
+        return row(record)
+
+    return parse_line
@@ -12,11 +12,58 @@ from modules.json_convert import read_gz_to_json
 from modules.forwarder_arg import validate_args
 from modules.forwarder_arg import Locator
 from horang_forwarder import load_data
+from horang_forwarder import monitor_directory
+from horang_forwarder import process_files
+import horang_forwarder
 from modules.json_load import load_json_to_elk
+from modules.json_load import iter_bulk_batches
+from modules.json_load import get_bulk_failures
+from modules.json_load import serialize_document
+from modules.bulk_sink import AIMDController
+from modules.bulk_sink import BulkSink
+from modules.checkpoint import CheckpointStore
+from modules.inotify_watch import InotifyWatcher
+from modules.inotify_watch import inotify_available
+from modules.dir_scanner import DirScanner
+from modules.stream_reader import iter_lines
+from modules.reader_plan import detect_plan
+from modules.reader_plan import PlanCache
+from modules.zeek_types import make_tsv_parser
+from modules.json_codec import make_codec
+from modules.json_codec import BACKENDS
+from modules import json_codec
+from modules.gzip_stream import GzipIndex
+from modules.helper import get_uncompressed_size
+from modules.backfill import run_backfill
+from modules.shard_reader import split_shards
+from modules.shard_reader import parse_shard
+from modules.shard_reader import ShardCommitter
+from modules.file_scheduler import FileScheduler
+from modules.file_scheduler import parse_lanes
+from modules.handle_pool import HandlePool
+from modules.json_array import iter_array_elements
+from modules.csv_reader import iter_csv_rows
+from modules.compact_rows import CompactRow
+from modules.compact_rows import RowSchema
+from modules.spool import Spool
+from modules.spool import SpoolSender
+from modules.stages import StagePipeline
+from modules.geoip import make_geoip_stage
+from modules.dhcp_join import DHCPJoinStage
+from modules.dhcp_join import LeaseIndex
+from modules.oui_lookup import OUIStage
+from modules.oui_lookup import open_oui_table
+from modules.threat_intel import ThreatIntelStage
+from modules.normalize import NormalizeStage
+from modules.normalize import load_mappings
 
 
 import os
 import sys
+import tempfile
+import pickle
+import time
+import gzip
 
 PROJECT_PATH = os.getcwd()
 SOURCE_PATH = os.path.join(
@@ -26,6 +73,54 @@ sys.path.append(SOURCE_PATH)
 
 PRINT_FLAG = False
 
+ZEEK_CONN_HEADER = "#separator \\x09\n#set_separator\t,\n#empty_field\t(empty)\n" \
+                   "#unset_field\t-\n#path\tconn\n" \
+                   "#fields\tts\tuid\tid.orig_h\tid.orig_p\tduration\ttunnel_parents\n" \
+                   "#types\ttime\tstring\taddr\tport\tinterval\tset[string]\n"
+
+
+def make_temp_dir():
+    """
+        a temporary directory without "__" in its name - load_data skips those paths as private
+    """
+    while True:
+        temp_dir = tempfile.TemporaryDirectory()
+        if "__" not in os.path.basename(temp_dir.name):
+            return temp_dir
+        temp_dir.cleanup()
+
+
+def load_or_crash(filepath, *args):
+    """
+        load_data of a backfill worker that dies on dns.log
+    """
+    if filepath.endswith("dns.log"):
+        os._exit(1)
+    return load_data(filepath, *args)
+
+
+class BulkClient:
+    """
+        _bulk API stand-in that rejects the given positions once with 429
+    """
+    def __init__(self, reject_once=()):
+        self.reject_once = set(reject_once)
+        self.requests = []
+
+    def bulk(self, operations):
+        lines = operations.splitlines()
+        docs = [json.loads(line) for line in lines[1::2]]
+        self.requests.append(docs)
+        items = []
+        for doc in docs:
+            status = 201
+            if doc.get("id") in self.reject_once:
+                self.reject_once.discard(doc.get("id"))
+                status = 429
+            items.append({"index": {"status": status}})
+        return {"errors": any(item["index"]["status"] != 201 for item in items), 
+                "items": items}
+
 class TestModuleMethods(unittest.TestCase):
 
     def test_Locator(self):
@@ -94,6 +189,13 @@ class TestModuleMethods(unittest.TestCase):
         locator = Locator('test')
         json_file = locator.set_filepath(SOURCE_PATH, "test5.log")
         self.assertEqual(get_fields_from_tsv(json_file), ret)
+        # the #fields of the reader plan - gz archives too, nothing for other formats
+        with make_temp_dir() as temp_dir:
+            gz_file = os.path.join(temp_dir, "test5.log.gz")
+            with open(json_file, "rb") as source, gzip.open(gz_file, "wb") as target:
+                target.write(source.read())
+            self.assertEqual(get_fields_from_tsv(gz_file), ret)
+        self.assertEqual(get_fields_from_tsv(locator.set_filepath(SOURCE_PATH, "test.csv")), [])
         # for future..
         # read log to json
         json_file = "test4.log"
@@ -328,5 +430,1097 @@ class TestModuleMethods(unittest.TestCase):
         self.assertEqual(csv_ret_val[0], json_ret_val[0])
 
 
+    def test_bulk_batches(self):
+        # batching by document count and body size
+        docs = [{"id": idx, "value": "x" * 10} for idx in range(10)]
+        batches = list(iter_bulk_batches("zeek_conn", docs, range(10), max_docs=4))
+        self.assertEqual([len(pos) for pos, body in batches], [4, 4, 2])
+        self.assertEqual(batches[0][1].count(b'\n'), 8)
+        one_doc = len(batches[0][1]) // 4
+        batches = list(iter_bulk_batches("zeek_conn", docs, range(10), 
+                                         max_docs=100, max_bytes=one_doc * 3))
+        self.assertEqual([len(pos) for pos, body in batches], [3, 3, 3, 1])
+
+        # per-item failures - retryable or rejected
+        response = {"errors": True, 
+                    "items": [{"index": {"status": 201}}, 
+                              {"index": {"status": 429}}, 
+                              {"index": {"status": 400, 
+                                         "error": {"reason": "mapping"}}}]}
+        retry, rejected = get_bulk_failures(response, [5, 6, 7])
+        self.assertEqual(retry, [6])
+        self.assertEqual(rejected, [(7, 400, "mapping")])
+
+        # only the rejected documents are sent again
+        locator = Locator("test")
+        locator.client = BulkClient(reject_once=[3])
+        locator.index = "zeek_conn"
+        locator.bulk_max_docs = 4
+        self.assertTrue(load_json_to_elk(locator, docs))
+        self.assertEqual(sorted(len(req) for req in locator.client.requests), [1, 2, 4, 4])
+        self.assertEqual(locator.client.requests[-1][0]["id"], 3)
+        locator.sink.close()
+
+    def test_bulk_backpressure(self):
+        # AIMD - halve on rejection, grow back on fast responses
+        controller = AIMDController(max_concurrency=8, max_docs=1000, min_docs=100,
+                                    latency_target=1.0)
+        self.assertEqual(controller.concurrency, 4)
+        controller.on_reject()
+        self.assertEqual((controller.concurrency, controller.batch_docs), (2, 500))
+        controller.on_success(5.0)
+        self.assertEqual((controller.concurrency, controller.batch_docs), (1, 250))
+        for idx in range(3):
+            controller.on_success(0.1)
+        self.assertEqual((controller.concurrency, controller.batch_docs), (3, 450))
+
+        # the sink is saturated during the cool down after a 429
+        docs = [{"id": idx} for idx in range(20)]
+        sink = BulkSink(BulkClient(reject_once=[1]), max_concurrency=2, max_docs=5)
+        pending, rejected = sink.load("zeek_conn", docs)
+        self.assertEqual((pending, rejected), ([], []))
+        self.assertEqual(sink.client.requests[-1], [{"id": 1}])
+        sink.cooldown_until = float("inf")
+        self.assertTrue(sink.saturated())
+        self.assertFalse(sink.wait_for_capacity(timeout=0.05))
+        sink.cooldown_until = 0
+        self.assertTrue(sink.wait_for_capacity(timeout=0.05))
+        sink.close()
+
+
+    def test_bulk_pipeline(self):
+        # the next chunk is read while the one before is in flight, positions follow the sends
+        class SlowClient(BulkClient):
+            def __init__(self):
+                super().__init__()
+                self.read_ahead = []
+                self.held = []
+
+            def bulk(self, operations):
+                # wait for the reader to take the next chunk (a serial reader never does)
+                time.sleep(0.2)
+                self.read_ahead.append(reads[0])
+                self.held.append(locator.scheduler.in_flight)
+                return super().bulk(operations)
+
+        reads = [0]
+        read = horang_forwarder.load_data
+        def count_reads(*args):
+            reads[0] += 1
+            return read(*args)
+
+        with make_temp_dir() as temp_dir:
+            zeek_dir = os.path.join(temp_dir, "zeek")
+            os.makedirs(zeek_dir)
+            conn_log = os.path.join(zeek_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                for idx in range(300):
+                    file.write("1591367999.5\tconn%d\t10.0.0.1\t53\t-\t(empty)\n" % idx)
+            locator = Locator("test")
+            locator.client = SlowClient()
+            locator.read_max_records = 100
+            horang_forwarder.load_data = count_reads
+            try:
+                self.assertEqual(process_files(locator, {conn_log: None}), set())
+            finally:
+                horang_forwarder.load_data = read
+            self.assertEqual([len(request) for request in locator.client.requests], [100] * 3)
+            # chunk N was in flight while chunk N+1 was read
+            self.assertEqual(locator.client.read_ahead[:2], [2, 3])
+            # the bytes of a chunk stay in the memory bound until it's loaded
+            self.assertTrue(locator.client.held and all(held > 0 for held in locator.client.held))
+            self.assertEqual(locator.scheduler.in_flight, 0)
+            self.assertEqual(locator.get_filepointer(conn_log), os.path.getsize(conn_log))
+
+            # Ctrl-C in the monitor loop - the sink is closed before the checkpoint
+            closed = []
+            class Checkpoint:
+                def flush(self):
+                    pass
+
+                def close(self):
+                    closed.append("checkpoint")
+
+            def interrupt(*args):
+                raise KeyboardInterrupt
+
+            sink_close = locator.sink.close
+            locator.sink.close = lambda: closed.append("sink") or sink_close()
+            locator.checkpoint = Checkpoint()
+            locator.dirlocator, locator.watch_mode = zeek_dir, "poll"
+            scan = horang_forwarder.scan_directory
+            horang_forwarder.scan_directory = interrupt
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    monitor_directory(locator)
+            finally:
+                horang_forwarder.scan_directory = scan
+            self.assertEqual(closed, ["sink", "checkpoint"])
+
+
+    def test_checkpoint(self):
+        # positions are flushed in batches and reloaded on restart
+        with make_temp_dir() as temp_dir:
+            checkpoint_file = os.path.join(temp_dir, "checkpoint.json")
+            store = CheckpointStore(checkpoint_file, flush_updates=3, flush_seconds=3600)
+            locator = Locator("test")
+            locator.set_checkpoint(store)
+            csv_file = locator.set_filepath(SOURCE_PATH, "test.csv")
+            json_file = locator.set_filepath(SOURCE_PATH, "test.json")
+            locator.set_filelocator(csv_file, 100)
+            locator.set_filelocator(json_file, 200)
+            self.assertFalse(os.path.exists(checkpoint_file))
+            locator.set_filelocator(csv_file, 300)
+            self.assertTrue(os.path.exists(checkpoint_file))
+            locator.set_filelocator(json_file, 400)
+            store.close()
+
+            locator = Locator("test")
+            locator.set_checkpoint(CheckpointStore(checkpoint_file))
+            self.assertEqual(locator.get_filepointer(locator.set_filepath(SOURCE_PATH, "test.csv")), 300)
+            self.assertEqual(locator.get_filepointer(locator.set_filepath(SOURCE_PATH, "test.json")), 400)
+            self.assertEqual(locator.get_filepointer(locator.set_filepath(SOURCE_PATH, "test3.json")), 0)
+            self.assertEqual(os.listdir(temp_dir), ["checkpoint.json"])
+
+            # a broken file starts empty
+            with open(checkpoint_file, "w") as file:
+                file.write("{broken")
+            self.assertEqual(CheckpointStore(checkpoint_file).entries, {})
+
+            # the forwarder's own files under the watched directory are never shipped
+            locator = Locator("test")
+            locator.set_checkpoint(CheckpointStore(checkpoint_file))
+            locator.add_state_file(os.path.join(temp_dir, "horang_dhcp.json"))
+            self.assertTrue(locator.skip_file(temp_dir, "checkpoint.json"))
+            self.assertTrue(locator.skip_file(temp_dir, "horang_dhcp.json"))
+            self.assertTrue(locator.skip_file(temp_dir, ".horang_x1.tmp"))
+            self.assertFalse(locator.skip_file(temp_dir, "conn.log"))
+
+
+    def test_file_identity(self):
+        # rotation and truncation by (dev, ino) and the head fingerprint
+        with make_temp_dir() as temp_dir:
+            checkpoint_file = os.path.join(temp_dir, "checkpoint.json")
+            log_dir = os.path.join(temp_dir, "zeek")
+            os.mkdir(log_dir)
+            with open(os.path.join(log_dir, "conn.log"), "w") as file:
+                file.write('{"a": 1}\n{"a": 2}\n')
+            locator = Locator("test")
+            locator.set_checkpoint(CheckpointStore(checkpoint_file))
+            conn_log = locator.set_filepath(log_dir, "conn.log")
+            self.assertEqual(locator.track_file(conn_log), 0)
+            locator.set_filelocator(conn_log, 18)
+            self.assertEqual(locator.track_file(conn_log), 18)
+
+            # rotated: the old file is finished under its new name
+            rotated_log = os.path.join(log_dir, "conn.01.log")
+            os.rename(conn_log, rotated_log)
+            with open(conn_log, "w") as file:
+                file.write('{"b": 1}\n')
+            self.assertEqual(locator.track_file(locator.set_filepath(log_dir, "conn.log")), 0)
+            self.assertEqual(locator.track_file(locator.set_filepath(log_dir, "conn.01.log")), 18)
+
+            # truncated: size going backwards
+            locator.set_filelocator(conn_log, 9)
+            with open(conn_log, "w") as file:
+                file.write('{}\n')
+            self.assertEqual(locator.track_file(locator.set_filepath(log_dir, "conn.log")), 0)
+            locator.set_filelocator(conn_log, 3)
+            locator.checkpoint.close()
+
+            # rotated while the forwarder was down
+            os.rename(conn_log, os.path.join(log_dir, "conn.02.log"))
+            with open(conn_log, "w") as file:
+                file.write('{"c": 1}\n{"c": 2}\n')
+            locator = Locator("test")
+            locator.set_checkpoint(CheckpointStore(checkpoint_file))
+            self.assertEqual(locator.track_file(locator.set_filepath(log_dir, "conn.log")), 0)
+            self.assertEqual(locator.track_file(locator.set_filepath(log_dir, "conn.02.log")), 3)
+            self.assertEqual(locator.track_file(locator.set_filepath(log_dir, "conn.01.log")), 18)
+
+
+    @unittest.skipUnless(inotify_available(), "inotify is Linux only")
+    def test_inotify_watcher(self):
+        # modified, created and moved files are reported
+        with make_temp_dir() as temp_dir:
+            conn_log = os.path.join(temp_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write('{"a": 1}\n')
+            watcher = InotifyWatcher(temp_dir)
+            self.assertEqual(watcher.read_events(timeout=0), (set(), False))
+            with open(conn_log, "a") as file:
+                file.write('{"a": 2}\n')
+            os.mkdir(os.path.join(temp_dir, "zeek"))
+            dns_log = os.path.join(temp_dir, "zeek", "dns.log")
+            with open(dns_log, "w") as file:
+                file.write('{"b": 1}\n')
+            os.rename(conn_log, os.path.join(temp_dir, "conn.01.log"))
+            changed = set()
+            for idx in range(3):
+                changed |= watcher.read_events(timeout=0.2)[0]
+            self.assertIn(os.path.join(temp_dir, "conn.01.log"), changed)
+            self.assertIn(dns_log, changed)
+            watcher.close()
+
+
+    def test_dir_scanner(self):
+        # only new or changed files are reported
+        with make_temp_dir() as temp_dir:
+            os.mkdir(os.path.join(temp_dir, "zeek"))
+            conn_log = os.path.join(temp_dir, "zeek", "conn.log")
+            dns_log = os.path.join(temp_dir, "dns.log")
+            for path in (conn_log, dns_log):
+                with open(path, "w") as file:
+                    file.write('{"a": 1}\n')
+            scanner = DirScanner(temp_dir, full_scan_every=100)
+            self.assertEqual([path for path, stat in scanner.scan()], [dns_log, conn_log])
+            self.assertEqual(scanner.scan(), [])
+            with open(conn_log, "a") as file:
+                file.write('{"a": 2}\n')
+            changed = scanner.scan()
+            self.assertEqual([path for path, stat in changed], [conn_log])
+            self.assertEqual(changed[0][1].st_size, 18)
+
+            # a file quiet for a long time is still found without a full scan
+            for _ in range(5):
+                self.assertEqual(scanner.scan(), [])
+            with open(dns_log, "a") as file:
+                file.write('{"a": 2}\n')
+            self.assertEqual([path for path, stat in scanner.scan()], [dns_log])
+
+            # removed files leave the cache
+            os.remove(conn_log)
+            new_log = os.path.join(temp_dir, "zeek", "http.log")
+            with open(new_log, "w") as file:
+                file.write('{"a": 1}\n')
+            self.assertEqual([path for path, stat in scanner.scan()], [new_log])
+            self.assertNotIn(conn_log, scanner.files)
+
+
+    def test_stream_reader(self):
+        # exact byte offsets, BOM and the last line without a new line
+        with make_temp_dir() as temp_dir:
+            json_log = os.path.join(temp_dir, "dns.log")
+            with open(json_log, "wb") as file:
+                file.write(b'\xef\xbb\xbf{"a": "\xc3\xa9"}\r\n#comment\n{"a": 2}\n{"a": 3}')
+            lines = list(iter_lines(json_log, 0, final=False))
+            self.assertEqual(lines, [(b'{"a": "\xc3\xa9"}', 16), (b'#comment', 25), 
+                                     (b'{"a": 2}', 34)])
+            self.assertEqual(list(iter_lines(json_log, 25))[-1], (b'{"a": 3}', 42))
+            self.assertEqual(list(iter_lines(json_log, 0, max_bytes=20, chunk_size=4)), 
+                             lines[:2])
+
+            # bounded reads resume from the returned pointer
+            data, pointer = read_log_to_json(json_log, 0, max_records=1)
+            self.assertEqual((data, pointer), ([{"a": "\u00e9"}], 16))
+            data, pointer = read_log_to_json(json_log, pointer)
+            self.assertEqual((data, pointer), ([{"a": 2}], 34))
+            # the last line is read once the writer is quiet
+            os.utime(json_log, (0, 0))
+            data, pointer = read_log_to_json(json_log, pointer)
+            self.assertEqual((data, pointer), ([{"a": 3}], 42))
+            self.assertEqual(read_log_to_json(json_log, pointer), [[], 42])
+
+            # CSV rows in chunks after the header
+            csv_file = os.path.join(SOURCE_PATH, "test.csv")
+            data, pointer = read_csv_to_json(csv_file, 0, max_records=2)
+            self.assertEqual(data[1], {'id': '2', 'details': '1001abcd', 'pages': '14'})
+            data, pointer = read_csv_to_json(csv_file, pointer, max_records=2)
+            self.assertEqual(data[0], {'id': '3', 'details': '1001abc', 'pages': '15'})
+
+
+    def test_reader_plan(self):
+        # Zeek header parsed once and cached by file identity
+        with make_temp_dir() as temp_dir:
+            conn_log = os.path.join(temp_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                file.write("1591367999.305988\tCMdzit1\t192.168.4.76\t36844\t-\t(empty)\n")
+            plan = detect_plan(conn_log)
+            self.assertEqual(plan.format, "tsv")
+            self.assertEqual(plan.separator, "\t")
+            self.assertEqual((plan.set_separator, plan.empty_field, plan.unset_field, plan.path), 
+                             (",", "(empty)", "-", "conn"))
+            self.assertEqual(plan.fields[-1], "tunnel_parents")
+            self.assertEqual(plan.types[-1], "set[string]")
+
+            locator = Locator("test")
+            conn_log = locator.set_filepath(temp_dir, "conn.log")
+            locator.track_file(conn_log)
+            plan = locator.get_plan(conn_log)
+            self.assertIs(locator.get_plan(conn_log), plan)
+            data, pointer = read_log_to_json(conn_log, 0, plan=plan)
+            self.assertEqual(data[0]["uid"], "CMdzit1")
+
+            # truncation drops the cached plan
+            with open(conn_log, "w") as file:
+                file.write('{"ts": 1}\n')
+            locator.track_file(conn_log)
+            self.assertEqual(locator.get_plan(conn_log).format, "ndjson")
+
+        for name, format in (("test.csv", "csv"), ("test.json", "document"), 
+                             ("test2.ndjson", "ndjson"), ("test4.log", "ndjson"), 
+                             ("test5.log", "tsv")):
+            self.assertEqual(detect_plan(os.path.join(SOURCE_PATH, name)).format, format)
+        self.assertEqual(detect_plan(os.path.join(SOURCE_PATH, "test.csv")).header_end, 20)
+
+
+    def test_zeek_types(self):
+        # columns typed by #types, unset and empty values dropped
+        with make_temp_dir() as temp_dir:
+            conn_log = os.path.join(temp_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                file.write("1591367999.305988\tCMdzit1\t192.168.4.76\t36844\t0.066\tCa,Cb\n")
+                file.write("1591367999.5\tCMdzit2\t192.168.4.76\t53\t-\t(empty)\n")
+            parse_line = make_tsv_parser(detect_plan(conn_log))
+            self.assertEqual(parse_line(b"1591367999.305988\tCMdzit1\t192.168.4.76\t36844\t0.066\tCa,Cb"),
+                             {"ts": 1591367999.305988, "uid": "CMdzit1", "id.orig_h": "192.168.4.76", 
+                              "id.orig_p": 36844, "duration": 0.066, "tunnel_parents": ["Ca", "Cb"]})
+            self.assertIsNone(parse_line(b"#close\t2020-06-05"))
+            self.assertIsNone(parse_line(b"1\t2"))
+
+            locator = Locator("test")
+            conn_log = locator.set_filepath(temp_dir, "conn.log")
+            locator.track_file(conn_log)
+            data, pointer = read_log_to_json(conn_log, 0, plan=locator.get_plan(conn_log))
+            self.assertEqual(data[1], {"ts": 1591367999.5, "uid": "CMdzit2", 
+                                       "id.orig_h": "192.168.4.76", "id.orig_p": 53})
+
+            # ISO time and @timestamp
+            parse_line = make_tsv_parser(detect_plan(conn_log), time_format="iso")
+            record = parse_line(b"1591367999.5\tCMdzit2\t192.168.4.76\t53\t-\t-")
+            self.assertEqual(record["ts"], "2020-06-05T14:39:59.500000Z")
+            self.assertEqual(record["@timestamp"], record["ts"])
+
+
+    def test_passthrough(self):
+        # raw NDJSON lines go into the _bulk body without decoding
+        ndjson_file = os.path.join(SOURCE_PATH, "test2.ndjson")
+        plan = PlanCache(passthrough=True).get(ndjson_file)
+        self.assertTrue(plan.raw)
+        data, pointer = read_to_json(ndjson_file, 0, plan=plan)
+        self.assertTrue(isinstance(data[0], memoryview))
+        with open(ndjson_file, "rb") as file:
+            lines = [line.strip() for line in file if line.strip()]
+        self.assertEqual([bytes(line) for line in data], lines)
+        self.assertEqual(pointer, os.path.getsize(ndjson_file))
+
+        positions, body = next(iter_bulk_batches("zeek_dns", data, range(len(data))))
+        self.assertEqual(body.splitlines()[1::2], lines)
+        self.assertEqual(body.splitlines()[0], b'{"index":{"_index":"zeek_dns"}}')
+
+        # decoded JSONs without the passthrough mode
+        plan = PlanCache().get(ndjson_file)
+        self.assertFalse(plan.raw)
+        self.assertTrue(isinstance(read_to_json(ndjson_file, 0, plan=plan)[0][0], dict))
+
+    def test_json_codec(self):
+        # every installed backend decodes and encodes the same way
+        raw = b'{"uid":"C1","id.orig_p":53,"query":"\xed\x95\x9c.kr","answers":["1.1.1.1"]}'
+        for backend in BACKENDS:
+            try:
+                codec = make_codec(backend)
+            except ImportError:
+                continue
+            document = codec.loads(raw)
+            self.assertEqual(document["query"], "\ud55c.kr")
+            self.assertEqual(json.loads(codec.dumps(document)), document)
+            self.assertEqual(codec.extract(raw, ("uid", "answers", "missing")),
+                             {"uid": "C1", "answers": ["1.1.1.1"]})
+            with self.assertRaises(ValueError):
+                codec.loads(b'{"uid":')
+        # compact UTF-8 like the _bulk body before
+        self.assertEqual(make_codec("stdlib").dumps({"a": "\ud55c", "b": 1}), 
+                         '{"a":"\ud55c","b":1}'.encode('utf-8'))
+        with self.assertRaises(ValueError):
+            make_codec("ujson")
+
+    def test_gzip_stream(self):
+        # rotated Zeek archives streamed in chunks, resumed from seek points
+        rows = ["1591367999.%06d\tC%d\t10.0.0.1\t%d\t-\t(empty)\n" % (idx, idx, idx % 65536)
+                for idx in range(3000)]
+        content = (ZEEK_CONN_HEADER + "".join(rows)).encode()
+        with make_temp_dir() as temp_dir:
+            conn_gz = os.path.join(temp_dir, "conn.log.gz")
+            # two members - rotated archives appended with cat
+            with open(conn_gz, "wb") as file:
+                file.write(gzip.compress(content[:60000]))
+                file.write(gzip.compress(content[60000:]))
+            self.assertEqual(get_uncompressed_size(conn_gz), len(content))
+
+            locator = Locator("test")
+            conn_gz = locator.set_filepath(temp_dir, "conn.log.gz")
+            locator.track_file(conn_gz)
+            plan = locator.get_plan(conn_gz)
+            pointer, uids = 0, []
+            while True:
+                data, next_pointer = load_data(conn_gz, pointer, None, 8192, 500, plan, 
+                                               locator.gzindex)
+                if next_pointer == pointer:
+                    break
+                uids.extend(record["uid"] for record in data)
+                pointer = next_pointer
+            self.assertEqual(uids, ["C%d" % idx for idx in range(3000)])
+            self.assertEqual(data, [])
+            self.assertEqual(pointer, len(content))
+
+            # a restart resumes from the member boundary kept in the checkpoint
+            locator.set_filelocator(conn_gz, pointer)
+            point = locator.gzindex.member_point(conn_gz, pointer)
+            self.assertEqual(point[1], len(content))
+            middle = content.index(b"1591367999.002000")
+            gzindex = GzipIndex()
+            gzindex.add_member(conn_gz, (os.stat(conn_gz).st_dev, os.stat(conn_gz).st_ino),
+                               *locator.gzindex.member_point(conn_gz, middle))
+            data, _ = read_gz_to_json(conn_gz, middle, max_records=2, plan=plan, gzindex=gzindex)
+            self.assertEqual([record["uid"] for record in data], ["C2000", "C2001"])
+
+            # an archive still being written keeps its last partial line
+            partial_gz = os.path.join(temp_dir, "partial.log.gz")
+            compressed = gzip.compress(content)
+            with open(partial_gz, "wb") as file:
+                file.write(compressed[:len(compressed) // 2])
+            data, pointer = read_gz_to_json(partial_gz, 0, plan=plan)
+            self.assertEqual(content[pointer - 1:pointer], b"\n")
+            self.assertEqual(len(data), content[:pointer].count(b"\n") - 7)
+
+    def test_backfill(self):
+        # archives loaded once by the process pool, finished files are skipped
+        shipped = []
+        def ship(locator, data):
+            shipped.append((locator.get_index(), len(data)))
+            return True
+        with make_temp_dir() as temp_dir:
+            archive = os.path.join(temp_dir, "zeek", "2024-05-01")
+            os.makedirs(archive)
+            rows = "".join("1591367999.5\tC%d\t10.0.0.1\t53\t-\t(empty)\n" % idx 
+                           for idx in range(1000))
+            with gzip.open(os.path.join(archive, "conn.00:00:00-01:00:00.log.gz"), "wt") as file:
+                file.write(ZEEK_CONN_HEADER + rows)
+            with open(os.path.join(archive, "dns.log"), "w") as file:
+                file.write(ZEEK_CONN_HEADER + "".join(rows.splitlines(True)[:500]))
+            with open(os.path.join(archive, "eve.json"), "w") as file:
+                file.write("".join('{"event_type":"dns","id":%d}\n' % idx for idx in range(300)))
+
+            locator = Locator("test")
+            locator.dirlocator = temp_dir
+            locator.read_max_records = 200
+            locator.set_checkpoint(CheckpointStore(os.path.join(temp_dir, "checkpoint.json")))
+            self.assertEqual(run_backfill(locator, load_data, ship, 2), [])
+            counts = {}
+            for index, count in shipped:
+                counts[index] = counts.get(index, 0) + count
+            self.assertEqual(sum(counts.values()), 1000 + 500 + 300)
+            self.assertTrue(all(count <= 200 for _, count in shipped))
+            entry = locator.checkpoint.get_entry(os.path.join(archive, "eve.json"))
+            self.assertTrue(entry["done"])
+            self.assertEqual(entry["pos"], os.path.getsize(os.path.join(archive, "eve.json")))
+
+            # a second run has nothing to do
+            shipped.clear()
+            locator = Locator("test")
+            locator.dirlocator = temp_dir
+            locator.set_checkpoint(CheckpointStore(os.path.join(temp_dir, "checkpoint.json")))
+            self.assertEqual(run_backfill(locator, load_data, ship, 2), [])
+            self.assertEqual(shipped, [])
+
+            # a worker dies - the others are stopped and the backfill returns to resume later
+            with open(os.path.join(archive, "dns.log"), "a") as file:
+                file.write(rows)
+            with open(os.path.join(archive, "http.log"), "w") as file:
+                file.write(ZEEK_CONN_HEADER + rows * 5)
+            locator = Locator("test")
+            locator.dirlocator = temp_dir
+            locator.read_max_records = 10
+            locator.set_checkpoint(CheckpointStore(os.path.join(temp_dir, "checkpoint.json")))
+            failed = run_backfill(locator, load_or_crash, ship, 2)
+            self.assertIn(os.path.join(archive, "dns.log"), failed)
+
+            # a file the sink does not take - its worker stops, the others finish
+            shipped.clear()
+            def refuse_http(locator, data):
+                return locator.filename != "http.log" and ship(locator, data)
+            locator = Locator("test")
+            locator.dirlocator = temp_dir
+            locator.read_max_records = 10
+            locator.set_checkpoint(CheckpointStore(os.path.join(temp_dir, "checkpoint.json")))
+            self.assertEqual(run_backfill(locator, load_data, refuse_http, 2),
+                             [os.path.join(archive, "http.log")])
+            # dns.log resumes after the 500 rows of the first run
+            self.assertEqual(sum(count for _, count in shipped), 1000)
+
+    def test_shard_reader(self):
+        # a large file split at new lines, parsed by shards to NDJSON bytes
+        settings = {"typed": True, "time_format": "epoch", "passthrough": False}
+        with make_temp_dir() as temp_dir:
+            conn_log = os.path.join(temp_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                for idx in range(2000):
+                    file.write("1591367999.5\tC%d\t10.0.0.1\t%d\t0.5\t(empty)\n" % (idx, idx))
+            size = os.path.getsize(conn_log)
+            shards = split_shards(conn_log, 0, size, 4096)
+            self.assertTrue(len(shards) > 10)
+            self.assertEqual(shards[0][0], 0)
+            self.assertEqual(shards[-1][1], size)
+            with open(conn_log, "rb") as file:
+                content = file.read()
+            for start, end in shards:
+                self.assertEqual(content[end - 1:end], b"\n")
+            self.assertEqual([start for start, _ in shards[1:]], [end for _, end in shards[:-1]])
+
+            documents = []
+            for start, end in shards:
+                documents.extend(parse_shard(conn_log, start, end, settings))
+            self.assertEqual(len(documents), 2000)
+            self.assertEqual(json.loads(documents[7]), {"ts": 1591367999.5, "uid": "C7", 
+                             "id.orig_h": "10.0.0.1", "id.orig_p": 7, "duration": 0.5})
+
+            # shards finish in any order, the position only moves over a contiguous run
+            committer = ShardCommitter(0)
+            self.assertIsNone(committer.done(*shards[1]))
+            self.assertIsNone(committer.done(*shards[2]))
+            self.assertEqual(committer.done(*shards[0]), shards[2][1])
+
+            # backfill with shards - one position, the file done
+            shipped = []
+            def ship(locator, data):
+                shipped.extend(data)
+                return True
+            locator = Locator("test")
+            locator.dirlocator = temp_dir
+            locator.set_checkpoint(CheckpointStore(os.path.join(temp_dir, "checkpoint.json")))
+            self.assertEqual(run_backfill(locator, load_data, ship, 2, 1, 4096), [])
+            self.assertEqual(sorted(json.loads(line)["uid"] for line in shipped),
+                             sorted("C%d" % idx for idx in range(2000)))
+            entry = locator.checkpoint.get_entry(conn_log)
+            self.assertEqual((entry["pos"], entry["done"]), (size, True))
+
+    def test_file_scheduler(self):
+        # lanes first, then round-robin with a budget per file and round
+        scheduler = FileScheduler(parse_lanes("zeek_notice*;zeek_dns*"))
+        self.assertEqual(scheduler.lanes, [["zeek_notice*"], ["zeek_dns*"]])
+        scheduler.add("/z/conn.log", None, "zeek_conn")
+        scheduler.add("/z/files.log", None, "zeek_files")
+        scheduler.add("/z/dns.log", None, "zeek_dns")
+        scheduler.add("/z/notice.log", None, "zeek_notice")
+        self.assertEqual([path for path, _ in scheduler.next_round()],
+                         ["/z/notice.log", "/z/dns.log", "/z/conn.log", "/z/files.log"])
+        scheduler.done("/z/notice.log")
+        scheduler.done("/z/dns.log")
+        self.assertEqual(scheduler.reserve(300 * 1024 * 1024), scheduler.memory_bytes)
+        self.assertEqual(scheduler.reserve(1), 0)
+        scheduler.release(scheduler.memory_bytes)
+        # the default lanes - Zeek notice.log and intel.log
+        self.assertEqual([FileScheduler().get_lane(index) for index in
+                          ("zeek_notice", "zeek_intel", "suricata_eve")], [0, 0, 1])
+
+        with make_temp_dir() as temp_dir:
+            zeek_dir = os.path.join(temp_dir, "zeek")
+            os.makedirs(zeek_dir)
+            with open(os.path.join(zeek_dir, "conn.log"), "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                for idx in range(300):
+                    file.write("1591367999.5\tconn%d\t10.0.0.1\t53\t-\t(empty)\n" % idx)
+            with open(os.path.join(zeek_dir, "notice.log"), "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                file.write("1591367999.5\tnotice0\t10.0.0.1\t53\t-\t(empty)\n")
+            locator = Locator("test")
+            locator.client = BulkClient()
+            locator.scheduler = FileScheduler(round_records=100)
+            pending = {os.path.join(zeek_dir, name): None for name in ("conn.log", "notice.log")}
+            self.assertEqual(process_files(locator, pending), set())
+            # the notice goes first, the conn.log backlog is read in turns
+            self.assertEqual(locator.client.requests[0][0]["uid"], "notice0")
+            self.assertEqual(len(locator.client.requests[1]), 100)
+            self.assertTrue(locator.scheduler.has_backlog())
+            rounds = 1
+            while locator.scheduler.has_backlog():
+                process_files(locator, {})
+                rounds += 1
+            self.assertEqual(rounds, 3)
+            uids = [doc["uid"] for request in locator.client.requests for doc in request]
+            self.assertEqual(uids, ["notice0"] + ["conn%d" % idx for idx in range(300)])
+            locator.sink.close()
+
+    def test_handle_pool(self):
+        # the handle stays open and a half-written line waits for its new line
+        with make_temp_dir() as temp_dir:
+            eve_json = os.path.join(temp_dir, "eve.json")
+            with open(eve_json, "wb") as file:
+                file.write(b'\xef\xbb\xbf{"id":0}\n{"id":1}\n{"id"')
+            plan = PlanCache().get(eve_json)
+            handles = HandlePool(max_handles=1)
+            data, pointer = read_to_json(eve_json, 0, plan=plan, handles=handles)
+            self.assertEqual((data, pointer), ([{"id": 0}, {"id": 1}], 21))
+            handle = handles.handles[eve_json]
+            self.assertEqual(handle.partial, b'{"id"')
+            with open(eve_json, "ab") as file:
+                file.write(b':2}\n{"id":3}\n')
+            data, pointer = read_to_json(eve_json, pointer, plan=plan, handles=handles)
+            self.assertEqual((data, pointer), ([{"id": 2}, {"id": 3}], 39))
+            self.assertIs(handles.handles[eve_json], handle)
+
+            # a retry from an older position moves the handle back
+            data, _ = read_to_json(eve_json, 21, plan=plan, handles=handles)
+            self.assertEqual(data, [{"id": 2}, {"id": 3}])
+            self.assertEqual(read_to_json(eve_json, 0, plan=plan, handles=handles)[0][0], {"id": 0})
+
+            # least recently used handle is closed
+            other_json = os.path.join(temp_dir, "other.json")
+            with open(other_json, "wb") as file:
+                file.write(b'{"id":9}\n')
+            self.assertEqual(read_to_json(other_json, 0, plan=plan, handles=handles)[0], [{"id": 9}])
+            self.assertTrue(handle.file.closed)
+            self.assertEqual(list(handles.handles), [other_json])
+            handles.close_all()
+
+    def test_csv_reader(self):
+        # quoted fields with commas and new lines, typed columns, a row being written
+        header = b'\xef\xbb\xbfsrc,dst,"bytes",note\r\n'
+        rows = [b'10.0.0.1,10.0.0.2,%d,"a, ""b""\r\nc"\r\n' % idx for idx in range(300)]
+        with make_temp_dir() as temp_dir:
+            netflow_csv = os.path.join(temp_dir, "netflow.csv")
+            with open(netflow_csv, "wb") as file:
+                file.write(header + b''.join(rows))
+            plan = PlanCache(csv_types="auto").get(netflow_csv)
+            self.assertEqual((plan.fields, plan.header_end), 
+                             (["src", "dst", "bytes", "note"], len(header)))
+            pointer, data = 0, []
+            while True:
+                batch, next_pointer = read_csv_to_json(netflow_csv, pointer, max_records=70, 
+                                                       plan=plan)
+                if next_pointer == pointer:
+                    break
+                data.extend(batch)
+                pointer = next_pointer
+            self.assertEqual(len(data), 300)
+            self.assertEqual(data[7], {"src": "10.0.0.1", "dst": "10.0.0.2", "bytes": 7, 
+                                       "note": 'a, "b"\nc'})
+            self.assertEqual(pointer, len(header) + sum(len(row) for row in rows))
+            # strings without the types
+            self.assertEqual(read_csv_to_json(netflow_csv, 0)[0][0]["bytes"], "0")
+
+            # a quoted field still being written waits for the rest of the row
+            with open(netflow_csv, "ab") as file:
+                file.write(b'10.0.0.3,10.0.0.4,5,"half\n')
+            self.assertEqual(read_csv_to_json(netflow_csv, pointer, plan=plan), [[], pointer])
+            lines = [(b'x,"half', 7), (b'row",1', 14), (b'y,2', 18)]
+            self.assertEqual(list(iter_csv_rows(iter(lines))), 
+                             [(["x", "half\nrow", "1"], 14), (["y", "2"], 18)])
+
+    def test_compact_rows(self):
+        # rows share one schema and the repeated values, and encode like the dicts
+        with make_temp_dir() as temp_dir:
+            conn_log = os.path.join(temp_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                for idx in range(50):
+                    file.write(f"159136799{idx % 10}.305988\tC{idx}\t192.168.4.76\t36844\t-"
+                               f"\t{'(empty)' if idx % 2 else 'Cx,Cy'}\n")
+            netflow_csv = os.path.join(temp_dir, "netflow.csv")
+            with open(netflow_csv, "w") as file:
+                file.write('sa,"note",bytes\n10.0.0.1,"a ""b""",5\n10.0.0.1,,7\n')
+            codec = json_codec.codec
+            try:
+                for filepath in (conn_log, netflow_csv):
+                    for time_format in ("epoch", "iso"):
+                        plans = [PlanCache(time_format=time_format, csv_types="auto", 
+                                           compact=compact).get(filepath) 
+                                 for compact in (False, True)]
+                        documents, rows = [load_data(filepath, 0, plan=plan)[0] for plan in plans]
+                        self.assertTrue(all(isinstance(row, CompactRow) for row in rows))
+                        self.assertEqual([row.to_dict() for row in rows], documents)
+                        address = "sa" if filepath == netflow_csv else "id.orig_h"
+                        self.assertEqual(rows[1].get(address), documents[1][address])
+                        self.assertIs(rows[0].schema, rows[1].schema)
+                        self.assertIs(rows[0].get(address), rows[1].get(address))
+                        for backend in ("stdlib", "orjson"):
+                            json_codec.set_codec(backend)
+                            self.assertEqual([serialize_document(row) for row in rows],
+                                             [json_codec.dumps(doc) for doc in documents])
+                        # rows cross processes (backfill) as dicts
+                        self.assertEqual(pickle.loads(pickle.dumps(rows[0])), documents[0])
+            finally:
+                json_codec.set_codec(codec.name)
+
+    def test_spool(self):
+        # batches survive a restart, a torn record is cut off, delivered segments go
+        with make_temp_dir() as temp_dir:
+            spool_dir = os.path.join(temp_dir, "spool")
+            spool = Spool(spool_dir, segment_bytes=100)
+            for idx in range(4):
+                self.assertTrue(spool.append("zeek_conn", [{"uid": "C%d" % idx}, b'{"raw":1}']))
+            self.assertEqual(len(spool.segments), 4)
+            entry = spool.next(timeout=0)
+            self.assertEqual((entry.index, entry.documents), 
+                             ("zeek_conn", [b'{"uid":"C0"}', b'{"raw":1}']))
+            spool.ack(entry)
+            spool.ack(spool.next(timeout=0))
+            self.assertEqual(len(spool.segments), 3)
+            spool.close()
+            # crash in the middle of a write
+            with open(os.path.join(spool_dir, "%012d.wal" % spool.segment), "ab") as file:
+                file.write(b'\x40\x00\x00\x00torn')
+            spool = Spool(spool_dir, segment_bytes=100, max_bytes=300)
+            self.assertEqual([spool.next(timeout=0).documents[0] for _ in range(1)], 
+                             [b'{"uid":"C2"}'])
+            self.assertFalse(spool.append("zeek_conn", [{"uid": "x" * 300}]))
+            spool.ack(spool.next(timeout=0))
+            spool.ack(spool.next(timeout=0))
+            self.assertIsNone(spool.next(timeout=0))
+            self.assertEqual(spool.get_pending_bytes(), 0)
+            spool.close()
+
+            # the reader commits once the batch is spooled, the sender ships it
+            zeek_dir = os.path.join(temp_dir, "zeek")
+            os.makedirs(zeek_dir)
+            conn_log = os.path.join(zeek_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                for idx in range(30):
+                    file.write("1591367999.5\tconn%d\t10.0.0.1\t53\t-\t(empty)\n" % idx)
+            locator = Locator("test")
+            locator.client = BulkClient()
+            locator.spool = Spool(os.path.join(temp_dir, "spool2"))
+            self.assertEqual(process_files(locator, {conn_log: None}), set())
+            self.assertEqual(locator.client.requests, [])
+            self.assertEqual(locator.get_filepointer(conn_log), os.path.getsize(conn_log))
+            sender = SpoolSender(locator.spool, 
+                                 lambda index, documents: load_json_to_elk(locator, documents, index))
+            sender.start()
+            for _ in range(100):
+                if locator.spool.get_pending_bytes() == 0:
+                    break
+                time.sleep(0.05)
+            sender.stop()
+            locator.spool.close()
+            locator.sink.close()
+            uids = [doc["uid"] for request in locator.client.requests for doc in request]
+            self.assertEqual(uids, ["conn%d" % idx for idx in range(30)])
+
+    def test_geoip(self):
+        # GeoLite2 CSV blocks with the locations, IPv4 and IPv6, every record form
+        with make_temp_dir() as temp_dir:
+            blocks_csv = os.path.join(temp_dir, "GeoLite2-City-Blocks.csv")
+            with open(blocks_csv, "w") as file:
+                file.write("network,geoname_id,registered_country_geoname_id,latitude,longitude\n"
+                           "8.8.8.0/24,6252001,6252001,37.751,-97.822\n"
+                           "1.0.0.0/24,,2077456,,\n"
+                           "2001:4860::/32,6252001,6252001,,\n")
+            locations_csv = os.path.join(temp_dir, "GeoLite2-City-Locations-en.csv")
+            with open(locations_csv, "w") as file:
+                file.write("geoname_id,locale_code,continent_code,country_iso_code,country_name\n"
+                           "6252001,en,NA,US,United States\n2077456,en,OC,AU,Australia\n")
+            asn_csv = os.path.join(temp_dir, "GeoLite2-ASN-Blocks.csv")
+            with open(asn_csv, "w") as file:
+                file.write("network,autonomous_system_number,autonomous_system_organization\n"
+                           "8.8.8.0/24,15169,GOOGLE\n")
+            stage = make_geoip_stage(f"{blocks_csv},{asn_csv}", locations_csv, cache_size=8)
+            self.assertEqual(stage.lookup("8.8.8.8"), 
+                             {"continent_code": "NA", "country_iso_code": "US", 
+                              "country_name": "United States", 
+                              "location": {"lat": 37.751, "lon": -97.822},
+                              "asn": 15169, "as_org": "GOOGLE"})
+            self.assertEqual(stage.lookup("1.0.0.255")["country_iso_code"], "AU")
+            self.assertEqual(stage.lookup("2001:4860::8888")["country_iso_code"], "US")
+            for address in ("8.8.9.1", "192.168.0.1", "8.8.8", "-", "fe80::1%eth0"):
+                self.assertIsNone(stage.lookup(address))
+
+            plan = PlanCache(compact=True)
+            conn_log = os.path.join(temp_dir, "conn.log")
+            with open(conn_log, "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                file.write("1591367999.5\tC1\t8.8.8.8\t53\t-\t(empty)\n")
+            rows = load_data(conn_log, 0, plan=plan.get(conn_log))[0]
+            documents = rows + [{"src_ip": "1.0.0.1", "dest_ip": "10.0.0.1"}, b'{"src_ip":"8.8.8.8"}']
+            documents = stage.process("zeek_conn", documents)
+            self.assertEqual(documents[0]["orig_geo"]["as_org"], "GOOGLE")
+            self.assertEqual(documents[0]["uid"], "C1")
+            self.assertEqual(documents[1], {"src_ip": "1.0.0.1", "dest_ip": "10.0.0.1", 
+                                            "src_geo": {"country_iso_code": "AU", 
+                                                        "country_name": "Australia",
+                                                        "continent_code": "OC"}})
+            self.assertEqual(documents[2], b'{"src_ip":"8.8.8.8"}')
+            # each record gets its own copy of the cached values
+            self.assertIsNot(documents[0]["orig_geo"], stage.lookup("8.8.8.8"))
+
+    def test_dhcp_join(self):
+        # the host name of the lease valid at ts, renewals, eviction and the snapshot
+        with make_temp_dir() as temp_dir:
+            snapshot = os.path.join(temp_dir, "dhcp.json")
+            stage = DHCPJoinStage(snapshot, max_hosts=2)
+            stage.process("zeek_dhcp", [
+                {"ts": 1000.0, "assigned_addr": "10.0.0.5", "lease_time": 600.0, 
+                 "host_name": "laptop", "mac": "aa:bb:cc:00:00:01"},
+                # renewal - one lease until 2000
+                {"ts": 1400.0, "assigned_addr": "10.0.0.5", "lease_time": 600.0, 
+                 "host_name": "laptop", "mac": "aa:bb:cc:00:00:01"},
+                # the address goes to another host later
+                {"ts": "1970-01-01T00:40:00Z", "assigned_addr": "10.0.0.5", "lease_time": "600",
+                 "host_name": "phone", "mac": "aa:bb:cc:00:00:02"},
+                {"ts": 1000.0, "assigned_addr": "-", "host_name": "discover"}])
+            self.assertEqual(len(stage.index.hosts["10.0.0.5"]), 2)
+            documents = stage.process("zeek_conn", [
+                {"ts": 1900.0, "id.orig_h": "10.0.0.5", "id.resp_h": "8.8.8.8"},
+                {"ts": 2100.0, "id.orig_h": "10.0.0.5"},
+                {"ts": 2450.0, "id.orig_h": "10.0.0.9", "id.resp_h": "10.0.0.5"}])
+            self.assertEqual(documents[0]["orig_dhcp"], 
+                             {"host_name": "laptop", "mac": "aa:bb:cc:00:00:01"})
+            self.assertNotIn("orig_dhcp", documents[1])
+            self.assertEqual(documents[2]["resp_dhcp"]["host_name"], "phone")
+            stage.close()
+
+            # the state survives a restart, old leases go as the log time moves on
+            stage = DHCPJoinStage(snapshot, max_hosts=2)
+            self.assertEqual(stage.index.find("10.0.0.5", 1500.0)[2], "laptop")
+            stage.process("zeek_dhcp", [
+                {"ts": 9000.0, "assigned_addr": "10.0.0.6", "lease_time": 60.0, "host_name": "a"},
+                {"ts": 9001.0, "assigned_addr": "10.0.0.7", "lease_time": 60.0, "host_name": "b"},
+                {"ts": 9002.0, "assigned_addr": "10.0.0.8", "lease_time": 60.0, "host_name": "c"}])
+            self.assertEqual(list(stage.index.hosts), ["10.0.0.7", "10.0.0.8"])
+
+            # the expiry heap is capped with the addresses, renewals don't grow it
+            index = LeaseIndex(max_hosts=10)
+            for pos in range(20000):
+                index.add(f"10.1.{pos >> 8}.{pos & 255}", 1000.0 + pos, 7 * 86400.0)
+            index.add("10.2.0.1", 30000.0, 0xffffffff, "printer")
+            for _ in range(100):
+                index.add("10.2.0.1", 30000.0, 0xffffffff, "printer")
+            self.assertEqual(len(index.hosts), 10)
+            self.assertTrue(len(index.expiries) <= 2 * 10 + 4)
+            # an "infinite" lease goes like any other
+            index.add("10.3.0.1", 30000.0 + 365 * 86400, 600.0)
+            index.evict()
+            self.assertIsNone(index.find("10.2.0.1", 30001.0))
+            self.assertEqual(list(index.hosts), ["10.3.0.1"])
+
+            # conn.log records shipped with the host names
+            zeek_dir = os.path.join(temp_dir, "zeek")
+            os.makedirs(zeek_dir)
+            with open(os.path.join(zeek_dir, "dhcp.log"), "w") as file:
+                file.write(ZEEK_CONN_HEADER.replace("conn", "dhcp")
+                           .replace("uid\tid.orig_h\tid.orig_p\tduration\ttunnel_parents", 
+                                    "mac\tassigned_addr\tlease_time\thost_name")
+                           .replace("string\taddr\tport\tinterval\tset[string]", 
+                                    "string\taddr\tinterval\tstring"))
+                file.write("1591367990.0\t00:11:22:33:44:55\t192.168.4.76\t86400.0\tdesktop\n")
+            with open(os.path.join(zeek_dir, "conn.log"), "w") as file:
+                file.write(ZEEK_CONN_HEADER)
+                file.write("1591367999.3\tCMdzit1\t192.168.4.76\t36844\t-\t(empty)\n")
+            locator = Locator("test")
+            locator.client = BulkClient()
+            locator.stages.add(DHCPJoinStage(None))
+            locator.scheduler.lanes.insert(0, ["*_dhcp"])
+            process_files(locator, {os.path.join(zeek_dir, name): None 
+                                    for name in ("conn.log", "dhcp.log")})
+            locator.sink.close()
+            self.assertEqual(locator.client.requests[1][0]["orig_dhcp"], 
+                             {"host_name": "desktop", "mac": "00:11:22:33:44:55"})
+
+    def test_json_array(self):
+        # array elements one by one, resumed from the offset after an element
+        elements = [{"a": "x]y,\"z{", "n": [1, {"b": "}"}]}, 12, "s,]", None, [], {"k": "\ud55c"}] * 20
+        content = json.dumps(elements, ensure_ascii=False, indent=1).encode()
+        with make_temp_dir() as temp_dir:
+            export_json = os.path.join(temp_dir, "export.json")
+            with open(export_json, "wb") as file:
+                file.write(b'\xef\xbb\xbf' + content)
+            for chunk_size in (1, 7, 4096):
+                self.assertEqual([element for element, _ in 
+                                  iter_array_elements(export_json, 0, chunk_size)], elements)
+            plan = detect_plan(export_json)
+            self.assertEqual((plan.format, plan.array), ("document", True))
+            pointer, data = 0, []
+            while True:
+                batch, next_pointer = read_to_json(export_json, pointer, max_records=25, plan=plan)
+                if next_pointer == pointer:
+                    break
+                self.assertTrue(len(batch) <= 25)
+                data.extend(batch)
+                pointer = next_pointer
+            self.assertEqual(data, elements)
+            # the offset after the last element, before "]"
+            self.assertEqual(pointer, len(content) + 3 - 2)
+
+            # an export still being written - only the complete elements
+            with open(export_json, "wb") as file:
+                file.write(content[:len(content) // 2])
+            batch, pointer = read_to_json(export_json, 0, plan=plan)
+            self.assertEqual(batch, elements[:len(batch)])
+            self.assertEqual(content[pointer:pointer + 1], b",")
+
+            # a broken array - the elements before the error, then the error
+            with open(export_json, "wb") as file:
+                file.write(b'[{"a":1},{"a":2} {"a":3}]')
+            batch, pointer = read_to_json(export_json, 0, plan=plan)
+            self.assertEqual((batch, pointer), ([{"a": 1}, {"a": 2}], 16))
+            self.assertEqual(read_to_json(export_json, pointer, plan=plan), [[], -1])
+
+    def test_oui_lookup(self):
+        # the longest prefix from the compiled table, nested Suricata fields, local MACs
+        with make_temp_dir() as temp_dir:
+            oui_csv = os.path.join(temp_dir, "oui.csv")
+            with open(oui_csv, "w") as file:
+                file.write("Registry,Assignment,Organization Name,Organization Address\n"
+                           "MA-L,00000C,\"Cisco Systems, Inc\",San Jose CA\n"
+                           "MA-L,70B3D5,IEEE Registration Authority,Piscataway NJ\n")
+            oui36_csv = os.path.join(temp_dir, "oui36.csv")
+            with open(oui36_csv, "w") as file:
+                file.write("Registry,Assignment,Organization Name,Organization Address\n"
+                           "MA-S,70B3D5123,Small Sensors,Somewhere\n")
+            oui_txt = os.path.join(temp_dir, "oui.txt")
+            with open(oui_txt, "w") as file:
+                file.write("OUI/MA-L\t\tOrganization\n"
+                           "3C-5A-B4   (hex)\t\tGoogle, Inc.\n"
+                           "3C5AB4     (base 16)\t\tGoogle, Inc.\n")
+            table_path = os.path.join(temp_dir, "oui.bin")
+            table = open_oui_table(",".join((oui_csv, oui36_csv, oui_txt)), table_path)
+            self.assertEqual(len(table), 4)
+            stage = OUIStage(table)
+            records = [{"mac": "00:00:0c:12:34:56", "orig_l2_addr": "70-b3-d5-12-3f-ff",
+                        "resp_l2_addr": "70b3.d5ff.0001"},
+                       {"ether": {"src_mac": "3c:5a:b4:00:00:01", "dest_mac": "da:a1:19:00:00:01"}},
+                       {"mac": "not a mac", "orig_l2_addr": "ff:ff:ff"}]
+            stage.process("zeek_dhcp", records)
+            self.assertEqual(records[0]["mac_oui"], {"vendor": "Cisco Systems, Inc"})
+            self.assertEqual(records[0]["orig_l2_oui"], {"vendor": "Small Sensors"})
+            self.assertEqual(records[0]["resp_l2_oui"], {"vendor": "IEEE Registration Authority"})
+            self.assertEqual(records[1]["src_mac_oui"], {"vendor": "Google, Inc."})
+            # 0xda has the locally administered bit - randomized, no lookup
+            self.assertEqual(records[1]["dest_mac_oui"], {"local": True})
+            self.assertEqual(records[2], {"mac": "not a mac", "orig_l2_addr": "ff:ff:ff"})
+            stage.close()
+
+            # a bare --oui maps the compiled table without the registry files
+            table = open_oui_table("", table_path)
+            self.assertEqual(table.lookup(0x3c5ab4000001), "Google, Inc.")
+            self.assertIsNone(table.lookup(0x020000000001))
+            table.close()
+
+
+    def test_threat_intel(self):
+        # IP/CIDR, domain suffix, URL prefix and hash matches, then a reload swap
+        with make_temp_dir() as temp_dir:
+            feed = os.path.join(temp_dir, "feed.txt")
+            with open(feed, "w") as file:
+                file.write("# test feed\n"
+                           "203.0.113.0/24\n"
+                           "203.0.113.7,a more specific match\n"
+                           "2001:db8::/32\n"
+                           "*.Evil.example\n"
+                           "http://cdn.example.net/payload/\n"
+                           "D41D8CD98F00B204E9800998ECF8427E\n"
+                           "not an indicator\n")
+            intel = os.path.join(temp_dir, "intel.dat")
+            with open(intel, "w") as file:
+                file.write("#fields\tindicator\tindicator_type\tmeta.source\n"
+                           "198.51.100.1\tIntel::ADDR\ttest\n")
+            stage = ThreatIntelStage([feed, intel], reload_seconds=0)
+            self.assertEqual(len(stage.index), 7)
+            records = [{"id.orig_h": "10.0.0.1", "id.resp_h": "203.0.113.7"},
+                       {"id.orig_h": "203.0.113.9", "id.resp_h": "2001:db8::1"},
+                       {"query": "a.b.evil.example"},
+                       {"host": "cdn.example.net", "uri": "/payload/x.bin"},
+                       {"host": "cdn.example.net", "uri": "/static/x.js"},
+                       {"fileinfo": {"md5": "d41d8cd98f00b204e9800998ecf8427e"}},
+                       {"src_ip": "198.51.100.1", "dns": {"rrname": "notevil.example"}},
+                       '{"raw": "passthrough line"}']
+            stage.process("zeek_conn", records)
+            get = lambda record: [(match["field"], match["indicator"], match["type"])
+                                  for match in record.get("threat_intel", [])]
+            self.assertEqual(get(records[0]), [("id.resp_h", "203.0.113.7", "ip")])
+            self.assertEqual(get(records[1]), [("id.orig_h", "203.0.113.0/24", "cidr"),
+                                               ("id.resp_h", "2001:db8::/32", "cidr")])
+            self.assertEqual(get(records[2]), [("query", "evil.example", "domain")])
+            self.assertEqual(get(records[3]), [("uri", "http://cdn.example.net/payload/", "url")])
+            self.assertEqual(get(records[4]), [])
+            self.assertEqual(get(records[5]), [("fileinfo.md5", "d41d8cd98f00b204e9800998ecf8427e",
+                                                "hash")])
+            self.assertEqual(get(records[6]), [("src_ip", "198.51.100.1", "ip")])
+            self.assertEqual(records[6]["threat_intel"][0]["feed"], "intel.dat")
+            self.assertEqual(records[7], '{"raw": "passthrough line"}')
+            # raw NDJSON lines - only the indicator fields are decoded, a match parses the line
+            lines = [b'{"src_ip":"203.0.113.7","http":{"hostname":"cdn.example.net",'
+                     b'"url":"/payload/a"}}',
+                     memoryview(b'{"src_ip":"10.0.0.1","event_type":"flow"}'), b'[1,2]', b'{"src_']
+            stage.process("suricata_eve", lines)
+            self.assertEqual(get(lines[0]), [("src_ip", "203.0.113.7", "ip"), 
+                                             ("http.url", "http://cdn.example.net/payload/", "url")])
+            self.assertEqual([type(line) for line in lines[1:]], [memoryview, bytes, bytes])
+            self.assertFalse(StagePipeline([stage]).needs_fields())
+            self.assertTrue(StagePipeline([stage, NormalizeStage({})]).needs_fields())
+
+            # unchanged feeds keep the index, a changed feed swaps in a new one
+            old_index = stage.index
+            self.assertFalse(stage.reload())
+            with open(feed, "a") as file:
+                file.write("192.0.2.1\n")
+            os.utime(feed, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+            self.assertTrue(stage.reload())
+            self.assertIsNot(stage.index, old_index)
+            records = [{"id.resp_h": "192.0.2.1"}]
+            stage.process("zeek_conn", records)
+            self.assertEqual(get(records[0]), [("id.resp_h", "192.0.2.1", "ip")])
+            # a missing feed keeps the last index
+            os.remove(intel)
+            self.assertFalse(stage.reload())
+            self.assertEqual(len(stage.index), 8)
+            stage.close()
+
+
+    def test_normalize(self):
+        # one mapping on dicts and compact rows - the same documents either way
+        with make_temp_dir() as temp_dir:
+            mapping = os.path.join(temp_dir, "mapping.json")
+            with open(mapping, "w") as file:
+                json.dump({"zeek_conn": {"rename": {"id.orig_h": "src_ip", "id.orig_p": "src_port"},
+                                         "cast": {"src_port": "int", "duration": "float"},
+                                         "collect": {"ips": ["src_ip", "id.resp_h"]},
+                                         "remove": ["tunnel_parents"],
+                                         "set": {"event.module": "zeek"}},
+                           "suricata_*": {"move": {"http.hostname": "url.domain"}}}, file)
+            stage = NormalizeStage(load_mappings(mapping))
+            schema = RowSchema(["ts", "uid", "id.orig_h", "id.orig_p", "id.resp_h",
+                                "duration", "tunnel_parents"])
+            values = ["1700000000.0", "C1", "10.0.0.1", "5353", "10.0.0.2", "0.5", None]
+            documents = [schema.row(values), dict(zip(schema.fields, values[:-1]))]
+            documents = stage.process("zeek_conn", documents)
+            expected = {"ts": "1700000000.0", "uid": "C1", "src_ip": "10.0.0.1", "src_port": 5353,
+                        "id.resp_h": "10.0.0.2", "duration": 0.5, "ips": ["10.0.0.1", "10.0.0.2"],
+                        "event.module": "zeek"}
+            self.assertIsInstance(documents[0], CompactRow)
+            self.assertEqual(documents[0].to_dict(), expected)
+            self.assertEqual(documents[1], expected)
+            self.assertEqual(json.loads(serialize_document(documents[0])), expected)
+            # the schema is compiled once for the rows of a file
+            second = stage.process("zeek_conn", [schema.row(values)])[0]
+            self.assertIs(second.schema, documents[0].schema)
+
+            # nested move by pattern, an index without a mapping is left as it is
+            eve = [{"http": {"hostname": "example.com", "url": "/"}}]
+            stage.process("suricata_eve", eve)
+            self.assertEqual(eve, [{"http": {"url": "/"}, "url.domain": "example.com"}])
+            # a move out of a dict shared by records (the lookup caches) leaves it as it was
+            shared = {"hostname": "example.com", "url": "/"}
+            eve = stage.process("suricata_eve", [{"http": shared}, {"http": shared}])
+            self.assertEqual(shared, {"hostname": "example.com", "url": "/"})
+            self.assertEqual([record["url.domain"] for record in eve], ["example.com"] * 2)
+            dns = [{"query": "example.com"}]
+            self.assertEqual(stage.process("zeek_dns", dns), [{"query": "example.com"}])
+
+            # a bare --normalize - ECS addresses
+            stage = NormalizeStage(load_mappings())
+            records = stage.process("suricata_eve", [{"src_ip": "10.0.0.1", "dest_port": "443"}])
+            self.assertEqual(records, [{"source.ip": "10.0.0.1", "destination.port": 443,
+                                        "related.ip": ["10.0.0.1"]}])
+            with open(mapping, "w") as file:
+                json.dump({"zeek_conn": {"cast": {"duration": "decimal"}}}, file)
+            with self.assertRaises(ValueError):
+                load_mappings(mapping)
+
+
 if __name__ == '__main__':
     unittest.main()